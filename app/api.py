@@ -1,14 +1,30 @@
-import pandas as pd
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import Body, FastAPI, HTTPException, Query, Request
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 import uuid
 from datetime import datetime
 import os
-from typing import Dict, Optional
+import json
+from typing import List, Optional
 import asyncio
 from fastapi.middleware.cors import CORSMiddleware
 # Import your existing code
-from app.main import generate_report_df
+from app.main import REPORT_ENGINE, run_report
+from app.parallel import shutdown_process_pool
+from app.rollup import rollup_refresher
+from app.storage import get_storage_backend
+from app.cache import ReportCache
+from app.jobs import ReportExecutor
+from app.job_store import create_job_store
+from app.metrics import ReportProfile, log_event, registry, stage
+from app.progress import ReportProgress
+from app.sinks import CSVSink
+from app.timeline import parse_anchor, parse_window
+from app.store_uptime import MAX_BATCH_STORES, StoreUptimeCache
+from app.streaming import MAX_STATUS_BATCH, StatusIngestor, parse_polls
+from app.report_index import (
+    COMPRESSED_SUFFIXES, MAX_PAGE_SIZE, compressed_report, load_report_index, negotiate_encoding, parse_filter,
+)
+from app.report_store import create_report_store
 
 app = FastAPI()
 
@@ -20,95 +36,237 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-# Store report status and file paths
-report_status: Dict[str, Dict] = {}
-def save_report(report: pd.DataFrame, output_path: str):
-    """Save the generated report to a CSV file."""
-    try:
-        report.to_csv(output_path, index=False)
-        print(f"Report saved successfully to {output_path}")
-    except Exception as e:
-        print(f"Error saving report: {str(e)}")
-        raise
-async def generate_report_task(report_id: str):
-    """Background task to generate report"""
+# How often a stream checks for new rows, and how much it sends at a time
+REPORT_STREAM_INTERVAL = float(os.getenv('REPORT_STREAM_INTERVAL', 0.5))
+REPORT_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Store report status and file paths, shared by all workers
+report_status = create_job_store()
+# Report files with their size, age and last fetch, shared by all workers
+report_store = create_report_store()
+# Finished reports by data version
+report_cache = ReportCache(report_store)
+# Per-store polls and metrics for the /stores endpoints
+store_uptime = StoreUptimeCache()
+# Writer for polls posted to /status
+status_ingestor = StatusIngestor()
+
+def generate_report_task(report_id: str, snapshot: str, options: dict, progress_status=None, cancelled=None) -> dict:
+    """
+    Generates and saves a report in an executor thread, returning its file path and profile
+    Rows are written once, batch by batch, to a partial CSV that /reports/{report_id}/stream
+    sends while the report runs and that becomes the stored report when it is done;
+    progress_status(**fields) receives the progress meanwhile, and the report stops
+    with ReportCancelled between two batches once cancelled() is true
+    """
+    partial_path = os.path.join(report_store.directory, f"report_{report_id}.partial.csv")
+    on_update = None
+    if progress_status is not None:
+        on_update = lambda progress: progress_status(progress=progress, partial_path=partial_path)
+    progress = ReportProgress(on_update, cancelled=cancelled)
+
+    profile = ReportProfile()
     try:
-        # Generate report using existing function
-        report_df = generate_report_df()
-        
-        # Create reports directory if it doesn't exist
-        os.makedirs('reports', exist_ok=True)
-        
-        # Save report to CSV
-        output_path = f"reports/report_{report_id}.csv"
-        save_report(report_df, output_path)
-        
-        # Update report status
-        report_status[report_id]["status"] = "Complete"
-        report_status[report_id]["file_path"] = output_path
-        
-    except Exception as e:
-        report_status[report_id]["status"] = "Failed"
-        report_status[report_id]["error"] = str(e)
+        with profile.activate(), progress.activate():
+            run_report([CSVSink(partial_path)], **options)
+
+            # Moves the partial CSV into the store, or shares the file of an identical report
+            with stage('write'):
+                output_path = report_store.add(partial_path)
+            log_event('report_saved', path=output_path)
+            report_cache.put(snapshot, output_path)
+    finally:
+        progress.close()
+        # Streams that already opened it keep reading; later ones get the report itself
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return {"file_path": output_path, "profile": profile.as_dict(), "progress": progress.as_dict()}
+
+def compress_report(file_path: str, encoding: str) -> str:
+    """Writes the compressed download of a stored report and records it in the store"""
+    compressed_path = compressed_report(file_path, encoding)
+    report_store.add_encoding(file_path, encoding)
+    return compressed_path
+
+def update_report_status(report_id: str, **fields):
+    """Records a status change reported by the executor"""
+    job = report_status.get(report_id)
+    # A cancel handled by another worker wins over this worker's result
+    if job is not None and job["status"] != "Cancelled":
+        report_status.update(report_id, **fields)
+        if fields.get("status") in ("Complete", "Failed", "Cancelled"):
+            registry.add_job(fields["status"])
+
+def report_cancelled(report_id: str) -> bool:
+    """Whether report_id was cancelled, possibly through another worker"""
+    job = report_status.get(report_id)
+    return job is not None and job["status"] == "Cancelled"
+
+# Reports run in a bounded pool off the event loop
+executor = ReportExecutor(generate_report_task, update_report_status, is_cancelled=report_cancelled)
+
+def report_options(window: List[str], bucket: Optional[str], as_of: List[str]) -> dict:
+    """Validated timeline options of a trigger, empty for the fixed report"""
+    for spec in window + ([bucket] if bucket else []):
+        parse_window(spec)
+    for value in as_of:
+        parse_anchor(value)
+    options = {"windows": window, "bucket": bucket, "as_of": as_of}
+    return {key: value for key, value in options.items() if value}
+
+def data_snapshot(options: dict):
+    """Identifies the data and options a report would be computed from; triggers on the same snapshot share one job"""
+    snapshot = f"{REPORT_ENGINE}|{get_storage_backend().data_version()}"
+    if options:
+        snapshot += "|" + json.dumps(options, sort_keys=True)
+    return snapshot
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    executor.shutdown()
+    status_ingestor.shutdown()
+    rollup_refresher.shutdown()
+    shutdown_process_pool()
 
 @app.post("/trigger_report")
-async def trigger_report(background_tasks: BackgroundTasks):
+async def trigger_report(
+    window: List[str] = Query([]),
+    bucket: Optional[str] = None,
+    as_of: List[str] = Query([]),
+):
     """
     Trigger report generation
     Returns a report_id that can be used to fetch the report status and result
+    window (repeatable, e.g. 3h or 30d), bucket and as_of replace the six
+    fixed columns with custom windows, a bucket series or historical anchors
     """
+    try:
+        options = report_options(window, bucket, as_of)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     try:
         # Generate unique report ID
         report_id = str(uuid.uuid4())
         
+        # A finished report over the same data is returned right away
+        snapshot = await asyncio.get_running_loop().run_in_executor(None, data_snapshot, options)
+        cached_path = report_cache.get(snapshot)
+        if cached_path is not None:
+            report_status.create(
+                report_id,
+                status="Complete",
+                timestamp=datetime.utcnow(),
+                file_path=cached_path
+            )
+            return {"report_id": report_id}
+        
         # Initialize report status
-        report_status[report_id] = {
-            "status": "Running",
-            "timestamp": datetime.utcnow(),
-            "file_path": None
-        }
+        report_status.create(
+            report_id,
+            status="Queued",
+            timestamp=datetime.utcnow(),
+            file_path=None
+        )
         
-        # Trigger background task
-        background_tasks.add_task(generate_report_task, report_id)
+        # Queue the report, joining a pending job over the same data if there is one
+        executor.submit(report_id, snapshot, options)
         
         return {"report_id": report_id}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/cancel_report/{report_id}")
+async def cancel_report(report_id: str):
+    """
+    Cancel a queued or running report
+    The underlying job stops only when no other report_id shares it
+    """
+    job = report_status.get(report_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report ID not found")
+    if executor.cancel(report_id):
+        return {"status": "Cancelled"}
+    # The job may be owned by another worker
+    if job["status"] in ("Queued", "Running"):
+        report_status.update(report_id, status="Cancelled")
+        registry.add_job("Cancelled")
+        return {"status": "Cancelled"}
+    raise HTTPException(status_code=409, detail=f"Report already {job['status']}")
+
+@app.get("/metrics")
+async def metrics():
+    """Report stage timings, counters, cache and report store stats of this worker in Prometheus text format"""
+    cache = report_cache.stats()
+    store = report_store.stats()
+    gauges = {
+        "report_cache_hits": cache["hits"],
+        "report_cache_misses": cache["misses"],
+        "report_cache_entries": cache["entries"],
+        "report_cache_size_bytes": cache["size_bytes"],
+        "report_store_files": store["files"],
+        "report_store_size_bytes": store["size_bytes"],
+    }
+    return PlainTextResponse(registry.render(gauges), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache_stats")
+async def cache_stats():
+    """Report cache hit/miss counts and current size"""
+    return report_cache.stats()
+
 @app.get("/get_report/{report_id}")
-async def get_report(report_id: str):
+async def get_report(report_id: str, request: Request):
     """
     Get report status and result
     If report is complete, returns the CSV file
-    If report is running, returns status
+    If report is running, returns status and progress
     """
     try:
         # Check if report ID exists
-        if report_id not in report_status:
+        job = report_status.get(report_id)
+        if job is None:
             raise HTTPException(status_code=404, detail="Report ID not found")
             
-        status = report_status[report_id]["status"]
+        status = job["status"]
         
-        # If report is still running
-        if status == "Running":
-            return {"status": "Running"}
+        # If report is still waiting or running
+        if status in ("Queued", "Running"):
+            return {"status": status, "progress": job.get("progress")}
+            
+        # If report was cancelled
+        elif status == "Cancelled":
+            return {"status": "Cancelled"}
             
         # If report failed
         elif status == "Failed":
-            error = report_status[report_id].get("error", "Unknown error")
+            error = job.get("error", "Unknown error")
             raise HTTPException(status_code=500, detail=f"Report generation failed: {error}")
             
         # If report is complete
         elif status == "Complete":
-            file_path = report_status[report_id]["file_path"]
-            if not os.path.exists(file_path):
+            # The store's index knows the file and its compressed copies
+            file_path = job["file_path"]
+            stored = report_store.get(file_path)
+            if stored is None:
                 raise HTTPException(status_code=404, detail="Report file not found")
                 
+            # Serve a precompressed copy when the client accepts zstd or gzip
+            encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+            headers = {"Vary": "Accept-Encoding"}
+            if encoding is not None:
+                if encoding in stored["encodings"]:
+                    file_path += COMPRESSED_SUFFIXES[encoding]
+                else:
+                    file_path = await asyncio.get_running_loop().run_in_executor(
+                        None, compress_report, file_path, encoding
+                    )
+                headers["Content-Encoding"] = encoding
             return FileResponse(
                 file_path,
                 media_type="text/csv",
-                filename=f"store_report_{report_id}.csv"
+                filename=f"store_report_{report_id}.csv",
+                headers=headers
             )
             
     except HTTPException:
@@ -117,6 +275,184 @@ async def get_report(report_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/reports/{report_id}")
+async def get_report_status(report_id: str):
+    """
+    Get the job status of a report
+    Finished reports include their profile: stage timings and counters
+    """
+    job = report_status.get(report_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report ID not found")
+    return {key: value for key, value in job.items() if key not in ("file_path", "partial_path")}
+
+async def stream_report_rows(report_id: str):
+    """
+    Yields the partial CSV of a running report as its rows are written,
+    until the report is complete
+    """
+    rows = None
+    try:
+        while True:
+            # Read before the rows, so a complete report's rows are all in the file
+            job = report_status.get(report_id)
+            status = job["status"]
+            if rows is None and status == "Complete":
+                # Finished before the stream got to its rows: send the report itself
+                with open(job["file_path"], "rb") as report:
+                    while chunk := report.read(REPORT_STREAM_CHUNK_SIZE):
+                        yield chunk
+                return
+            if rows is None and job.get("partial_path"):
+                try:
+                    rows = open(job["partial_path"], "rb")
+                except FileNotFoundError:
+                    pass
+            if rows is not None:
+                chunk = rows.read(REPORT_STREAM_CHUNK_SIZE)
+                if chunk:
+                    yield chunk
+                    continue
+            if status == "Complete":
+                return
+            if status not in ("Queued", "Running"):
+                # Ends the response without its last chunk, so clients see it's incomplete
+                raise RuntimeError(f"Report {report_id} {status.lower()} while streaming")
+            await asyncio.sleep(REPORT_STREAM_INTERVAL)
+    finally:
+        if rows is not None:
+            rows.close()
+
+@app.get("/reports/{report_id}/stream")
+async def stream_report(report_id: str):
+    """
+    Download a report as CSV while it runs
+    Rows of finished stores are sent with chunked transfer as they are written to
+    the report, so the stream has the same bytes as the finished report
+    """
+    job = report_status.get(report_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report ID not found")
+    status = job["status"]
+    if status == "Cancelled":
+        return {"status": "Cancelled"}
+    if status == "Failed":
+        error = job.get("error", "Unknown error")
+        raise HTTPException(status_code=500, detail=f"Report generation failed: {error}")
+    if status == "Complete" and report_store.get(job["file_path"]) is None:
+        raise HTTPException(status_code=404, detail="Report file not found")
+    return StreamingResponse(
+        stream_report_rows(report_id),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="store_report_{report_id}.csv"'}
+    )
+
+@app.get("/reports/{report_id}/rows")
+def get_report_rows(
+    report_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort: str = "store_id",
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    store_id_prefix: Optional[str] = None,
+    filter: List[str] = Query([]),
+):
+    """
+    Get one page of a finished report
+    Filters look like downtime_last_day>30 and may be repeated; pass the
+    returned next_cursor to continue after the last row of a page
+    """
+    job = report_status.get(report_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report ID not found")
+
+    status = job["status"]
+    if status in ("Queued", "Running", "Cancelled"):
+        return {"status": status}
+    if status == "Failed":
+        error = job.get("error", "Unknown error")
+        raise HTTPException(status_code=500, detail=f"Report generation failed: {error}")
+
+    file_path = job["file_path"]
+    if report_store.get(file_path) is None:
+        raise HTTPException(status_code=404, detail="Report file not found")
+
+    try:
+        filters = [parse_filter(expression) for expression in filter]
+        total, rows, next_cursor = load_report_index(file_path).query(
+            filters=filters,
+            store_id_prefix=store_id_prefix,
+            sort=sort,
+            descending=order == "desc",
+            offset=offset,
+            limit=limit,
+            cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        "status": status,
+        "total": total,
+        "offset": offset if cursor is None else None,
+        "limit": limit,
+        "rows": rows,
+        "next_cursor": next_cursor,
+    }
+
+
+@app.post("/status")
+async def post_status(polls: List[dict] = Body(..., embed=True)):
+    """
+    Ingest a batch of polls, each with store_id, timestamp_utc and status
+    Polls are upserted by (store_id, timestamp_utc) and may arrive in any
+    order; the response comes once they are committed
+    """
+    if len(polls) > MAX_STATUS_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_STATUS_BATCH} polls per request")
+    try:
+        store_status, duplicates = parse_polls(polls)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        await asyncio.wrap_future(status_ingestor.submit(store_status))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Writing polls failed: {e}")
+    return {"written": len(store_status), "duplicates": duplicates}
+
+@app.get("/stores/{store_id}/uptime")
+def get_store_uptime(store_id: str):
+    """
+    Get the report metrics of one store without running a full report
+    Computed as of the newest poll of any store, like the report
+    """
+    try:
+        latest, rows, unknown = store_uptime.get([store_id])
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if unknown:
+        raise HTTPException(status_code=404, detail="Store ID not found")
+    return {"store_id": store_id, "as_of": latest, **rows[store_id]}
+
+@app.post("/stores/uptime")
+def get_stores_uptime(store_ids: List[str] = Body(..., embed=True)):
+    """
+    Get the report metrics of several stores
+    Unknown store IDs are listed in not_found
+    """
+    if len(store_ids) > MAX_BATCH_STORES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_STORES} store IDs per request")
+    try:
+        latest, rows, unknown = store_uptime.get(store_ids)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {
+        "as_of": latest,
+        "stores": [{"store_id": store_id, **metrics} for store_id, metrics in rows.items()],
+        "not_found": unknown,
+    }
+
 
 if __name__ == "__main__":
     import uvicorn
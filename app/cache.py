@@ -0,0 +1,85 @@
+"""
+Finished-report cache keyed by data version.
+
+A data version identifies everything a report depends on (see
+fetch_data_version). A trigger whose version matches a finished report
+reuses its file instead of recomputing. Entries live in SQLite next to the
+job store, so all workers share them. The files themselves belong to the
+ReportStore: an entry whose file it evicted is a miss.
+"""
+import os
+import time
+
+from app.sqlite_db import SQLiteDatabase
+
+REPORT_CACHE_PATH = os.getenv('REPORT_CACHE_PATH', os.path.join('reports', 'jobs.sqlite3'))
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv('REPORT_CACHE_MAX_ENTRIES', 20))
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS report_cache (
+        version TEXT PRIMARY KEY,
+        file_path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS report_cache_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+]
+
+
+class ReportCache:
+    """Maps data versions to report files of a ReportStore, keeping the newest versions."""
+
+    def __init__(self, store, path=None, max_entries=None):
+        self.store = store
+        self.path = path or REPORT_CACHE_PATH
+        self.max_entries = max_entries or REPORT_CACHE_MAX_ENTRIES
+        self._db = SQLiteDatabase(self.path, SCHEMA)
+
+    def _count(self, name):
+        self._db.connection().execute(
+            "INSERT INTO report_cache_stats (name, value) VALUES (?, 1)"
+            " ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+
+    def get(self, version):
+        """Returns the cached report file for version, or None, counting the hit or miss."""
+        row = self._db.connection().execute(
+            "SELECT file_path FROM report_cache WHERE version = ?", (version,)
+        ).fetchone()
+        if row is not None and self.store.get(row[0]) is None:
+            self._db.connection().execute("DELETE FROM report_cache WHERE version = ?", (version,))
+            row = None
+        self._count("hits" if row else "misses")
+        return row[0] if row else None
+
+    def put(self, version, file_path):
+        """Caches a finished report and drops the oldest versions over the limit."""
+        stored = self.store.get(file_path, touch=False)
+        self._db.connection().execute(
+            "INSERT OR REPLACE INTO report_cache (version, file_path, size, created_at) VALUES (?, ?, ?, ?)",
+            (version, file_path, stored['size'] if stored else 0, time.time())
+        )
+        self.evict()
+
+    def evict(self):
+        """Drops the oldest entries over the limit; their files stay until the store evicts them."""
+        conn = self._db.connection()
+        conn.execute(
+            "DELETE FROM report_cache WHERE version NOT IN"
+            " (SELECT version FROM report_cache ORDER BY created_at DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+
+    def stats(self):
+        conn = self._db.connection()
+        counters = dict(conn.execute("SELECT name, value FROM report_cache_stats").fetchall())
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM report_cache").fetchone()
+        return {
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "entries": entries,
+            "size_bytes": size,
+        }
@@ -0,0 +1,506 @@
+"""
+Local columnar storage for report runs without MySQL.
+
+Polls are kept in one directory per UTC day holding three .npy columns
+sorted by store and time: store code (int32), timestamp in epoch
+microseconds (int64) and active (bool). Store codes index a store
+dictionary, stores.npy. A report only opens the day partitions that overlap
+its window and memory-maps them. Timezones and business hours are small and
+kept as whole column files. manifest.json records the days, the newest poll
+and a generation counter bumped by every load.
+
+Streamed polls don't rewrite their day: each flush appends a small segment
+file per day it touches, listed in the manifest, and reads merge a day's
+segments over its base columns. A day is compacted into new base columns
+once its segments reach a quarter of the base or COLUMNAR_MAX_SEGMENTS
+files. Writers take an exclusive flock on the store, so several processes
+can load into it.
+"""
+import fcntl
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from datetime import time
+
+import numpy as np
+import pandas as pd
+
+from app.engine import timestamp_to_us
+from app.fetch import FETCH_MEMORY_LIMIT_MB, POLL_BYTES, columns_to_frame, empty_status_frame
+from app.schedule import invalidate_schedules
+from app.storage import StorageBackend
+
+COLUMNAR_STORE_PATH = os.getenv('COLUMNAR_STORE_PATH', os.path.join('data', 'columnar'))
+COLUMNAR_CHUNK_SIZE = int(os.getenv('COLUMNAR_CHUNK_SIZE', 1_000_000))
+COLUMNAR_MAX_SEGMENTS = int(os.getenv('COLUMNAR_MAX_SEGMENTS', 64))
+
+DAY_US = 24 * 3_600_000_000
+STATUS_COLUMNS = {'code': np.int32, 'ts_us': np.int64, 'active': np.bool_}
+
+
+def _save_columns(directory, columns):
+    """Writes .npy columns into directory, replacing it as a whole."""
+    tmp = directory + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, values in columns.items():
+        np.save(os.path.join(tmp, f'{name}.npy'), values)
+    old = directory + '.old'
+    if os.path.exists(directory):
+        os.replace(directory, old)
+    os.replace(tmp, directory)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def _load_columns(directory, names, mmap_mode='r'):
+    return {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode) for name in names}
+
+
+def _merge_columns(parts):
+    """
+    Poll columns of parts sorted by store and time; on the same store and
+    time the row from the later part wins.
+    """
+    columns = {name: np.concatenate([np.asarray(part[name]) for part in parts]) for name in parts[0]}
+    # Stable sort keeps part order within duplicates; keep the last of each
+    order = np.lexsort((columns['ts_us'], columns['code']))
+    columns = {name: values[order] for name, values in columns.items()}
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = (columns['code'][1:] != columns['code'][:-1]) | (columns['ts_us'][1:] != columns['ts_us'][:-1])
+    return {name: values[last] for name, values in columns.items()}
+
+
+def _seconds_to_time(seconds):
+    return time(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def _time_to_seconds(values):
+    parts = pd.Series(values, dtype=str).str.split(':', expand=True).astype(int)
+    return (parts[0] * 3600 + parts[1] * 60 + parts[2]).to_numpy(dtype=np.int32)
+
+
+class ColumnarBackend(StorageBackend):
+    """Polls in day partitions of .npy columns under path, read through memory maps."""
+
+    def __init__(self, path=None):
+        self.path = path or COLUMNAR_STORE_PATH
+
+    # Layout
+
+    def _status_dir(self, day):
+        return os.path.join(self.path, 'store_status', day)
+
+    def _segment_path(self, name):
+        return os.path.join(self.path, 'store_status', '_segments', name)
+
+    def _manifest(self):
+        # segments: day -> [[segment file, rows], ...] in write order
+        manifest = {'days': [], 'latest_us': None, 'generation': 0, 'segments': {}, 'next_segment': 0}
+        path = os.path.join(self.path, 'manifest.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest.update(json.load(f))
+        return manifest
+
+    @contextmanager
+    def _write_lock(self):
+        """Exclusive across threads and processes; readers don't take it."""
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _save_manifest(self, manifest):
+        path = os.path.join(self.path, 'manifest.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path + '.tmp', path)
+
+    def _stores(self):
+        path = os.path.join(self.path, 'stores.npy')
+        return np.load(path) if os.path.exists(path) else np.empty(0, dtype=str)
+
+    def _save_stores(self, stores):
+        path = os.path.join(self.path, 'stores.npy')
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, stores)
+        os.replace(path + '.tmp', path)
+
+    def _store_generations(self, n_stores):
+        """Generation of the last load of each store's polls by code, -1 for stores without polls."""
+        path = os.path.join(self.path, 'store_generations.npy')
+        generations = np.load(path) if os.path.exists(path) else np.empty(0, dtype=np.int64)
+        # Stores added since the last save, read without the write lock
+        return np.concatenate([generations[:n_stores], np.full(max(n_stores - len(generations), 0), -1)])
+
+    def _mark_generations(self, codes, generation):
+        """
+        Records generation for the stores of codes. Saved after the manifest,
+        so a reader never pairs the new generation with the old polls.
+        """
+        generations = self._store_generations(len(self._stores()))
+        generations[np.unique(codes)] = generation
+        path = os.path.join(self.path, 'store_generations.npy')
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, generations)
+        os.replace(path + '.tmp', path)
+
+    def _day_columns(self, manifest, day, names=STATUS_COLUMNS):
+        """
+        The day's poll columns, sorted by store and time: its memory-mapped
+        base columns, merged with its segments when it has any.
+        """
+        try:
+            return self._read_day(manifest, day, names)
+        except FileNotFoundError:
+            # A writer compacted the day since manifest was read; its new base holds the segments
+            return self._read_day(self._manifest(), day, names)
+
+    def _read_day(self, manifest, day, names):
+        base = _load_columns(self._status_dir(day), names)
+        segments = manifest['segments'].get(day)
+        if not segments:
+            return base
+        parts = [base]
+        for name, _ in segments:
+            with np.load(self._segment_path(name)) as segment:
+                parts.append({column: segment[column] for column in names})
+        return _merge_columns(parts)
+
+    # Reads
+
+    def latest_timestamp(self):
+        latest_us = self._manifest()['latest_us']
+        if latest_us is None:
+            return None
+        return pd.Timestamp(latest_us, unit='us').to_pydatetime()
+
+    def data_version(self):
+        return str(self._manifest()['generation'])
+
+    def generation(self):
+        return self._manifest()['generation']
+
+    def _store_codes(self, store_ids):
+        """Sorted codes of the known stores among store_ids."""
+        return np.flatnonzero(np.isin(self._stores(), np.asarray(list(store_ids), dtype=str)))
+
+    @staticmethod
+    def _code_rows(codes, wanted):
+        """Row positions of the wanted codes in a partition sorted by code."""
+        lo = np.searchsorted(codes, wanted, side='left')
+        hi = np.searchsorted(codes, wanted, side='right')
+        if not len(wanted):
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(a, b) for a, b in zip(lo, hi)])
+
+    def store_generations(self, store_ids):
+        stores = self._stores()
+        generations = self._store_generations(len(stores))
+        codes = self._store_codes(store_ids)
+        return {stores[code]: int(generations[code]) for code in codes if generations[code] >= 0}
+
+    def _window_columns(self, start, end, store_ids=None):
+        """(codes, ts_us, active) of the polls in [start, end], ordered by store_id and time."""
+        start_us, end_us = timestamp_to_us(start), timestamp_to_us(end)
+        first_day = pd.Timestamp(start_us, unit='us').strftime('%Y-%m-%d')
+        last_day = pd.Timestamp(end_us, unit='us').strftime('%Y-%m-%d')
+        wanted = self._store_codes(store_ids) if store_ids is not None else None
+
+        parts = []
+        manifest = self._manifest()
+        for day in manifest['days']:
+            # Partition pruning: only days overlapping the window are opened
+            if not first_day <= day <= last_day:
+                continue
+            columns = self._day_columns(manifest, day)
+            if wanted is not None:
+                # Partitions are sorted by code, so a store's rows are one slice
+                rows = self._code_rows(columns['code'], wanted)
+                columns = {name: np.asarray(values)[rows] for name, values in columns.items()}
+            ts_us = columns['ts_us']
+            keep = (ts_us >= start_us) & (ts_us <= end_us)
+            parts.append(tuple(np.asarray(columns[name])[keep] for name in STATUS_COLUMNS))
+        if not parts:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64), np.empty(0, dtype=bool)
+
+        codes, ts_us, active = (np.concatenate(column) for column in zip(*parts))
+        # Same order as the MySQL backend: store_id, then time
+        store_rank = np.argsort(np.argsort(self._stores(), kind='stable'), kind='stable')
+        order = np.lexsort((ts_us, store_rank[codes]))
+        return codes[order], ts_us[order], active[order]
+
+    def _frame(self, stores, codes, ts_us, active):
+        # Partition codes index stores.npy, so they are the store_id categories as they are
+        return columns_to_frame(codes, ts_us.astype('datetime64[us]'), active, pd.Index(stores, dtype=str))
+
+    def fetch_status(self, start, end, store_ids=None):
+        codes, ts_us, active = self._window_columns(start, end, store_ids)
+        if not len(codes):
+            return empty_status_frame()
+        return self._frame(self._stores(), codes, ts_us, active)
+
+    def iter_store_chunks(self, start, end, memory_limit_mb=None):
+        memory_limit_mb = memory_limit_mb or FETCH_MEMORY_LIMIT_MB
+        max_rows = max(1, memory_limit_mb * 1024 * 1024 // POLL_BYTES)
+        codes, ts_us, active = self._window_columns(start, end)
+        stores = self._stores()
+        # Ends of the stores; chunks are cut at the last one within max_rows
+        boundaries = np.append(np.flatnonzero(codes[1:] != codes[:-1]) + 1, len(codes))
+        chunk_start = 0
+        while chunk_start < len(codes):
+            fitting = np.searchsorted(boundaries, chunk_start + max_rows, side='right')
+            next_store_end = boundaries[np.searchsorted(boundaries, chunk_start, side='right')]
+            # A store with more than max_rows polls makes a chunk of its own
+            chunk_end = max(boundaries[fitting - 1] if fitting else 0, next_store_end)
+            yield self._frame(stores, codes[chunk_start:chunk_end], ts_us[chunk_start:chunk_end],
+                              active[chunk_start:chunk_end])
+            chunk_start = chunk_end
+
+    def count_stores(self, start, end):
+        start_us, end_us = timestamp_to_us(start), timestamp_to_us(end)
+        first_day = pd.Timestamp(start_us, unit='us').strftime('%Y-%m-%d')
+        last_day = pd.Timestamp(end_us, unit='us').strftime('%Y-%m-%d')
+        seen = np.zeros(len(self._stores()), dtype=bool)
+        manifest = self._manifest()
+        for day in manifest['days']:
+            if not first_day <= day <= last_day:
+                continue
+            columns = self._day_columns(manifest, day, ['code', 'ts_us'])
+            ts_us = columns['ts_us']
+            seen[np.asarray(columns['code'])[(ts_us >= start_us) & (ts_us <= end_us)]] = True
+        return int(seen.sum())
+
+    @staticmethod
+    def _table_rows(columns, store_ids):
+        """Only the rows of store_ids; tables are sorted by store_id."""
+        if store_ids is None:
+            return columns
+        keys = columns['store_id']
+        wanted = np.unique(np.asarray(list(store_ids), dtype=str))
+        rows = ColumnarBackend._code_rows(keys, wanted)
+        return {name: values[rows] for name, values in columns.items()}
+
+    def fetch_store_tables(self, store_ids=None):
+        timezones = pd.DataFrame()
+        business_hours = pd.DataFrame()
+        tz_dir = os.path.join(self.path, 'timezones')
+        if os.path.isdir(tz_dir):
+            columns = self._table_rows(_load_columns(tz_dir, ['store_id', 'timezone_str']), store_ids)
+            timezones = pd.DataFrame({name: values.astype(object) for name, values in columns.items()})
+        bh_dir = os.path.join(self.path, 'business_hours')
+        if os.path.isdir(bh_dir):
+            columns = self._table_rows(
+                _load_columns(bh_dir, ['store_id', 'day_of_week', 'start_time_local', 'end_time_local']), store_ids
+            )
+            business_hours = pd.DataFrame({
+                'store_id': columns['store_id'].astype(object),
+                'day_of_week': columns['day_of_week'].astype(int),
+                'start_time_local': [_seconds_to_time(int(s)) for s in columns['start_time_local']],
+                'end_time_local': [_seconds_to_time(int(s)) for s in columns['end_time_local']],
+            })
+        return timezones, business_hours
+
+    # Loads
+
+    def insert_data(self, restart=False):
+        """
+        Loads the ingest CSV files, replacing rows with the same key like the
+        MySQL upserts. With restart=True the existing data is dropped first.
+        """
+        from app.ingest import BUSINESS_HOURS_CSV, STORE_STATUS_CSV, TIMEZONES_CSV
+
+        with self._write_lock():
+            manifest = self._manifest()
+            if restart:
+                for name in os.listdir(self.path):
+                    path = os.path.join(self.path, name)
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    elif name != '.lock':
+                        os.remove(path)
+                # The generation keeps counting, so reports of the dropped data stay stale
+                manifest = dict(self._manifest(), generation=manifest['generation'])
+            stale, codes = self._load_status(STORE_STATUS_CSV, manifest)
+            self._load_business_hours(BUSINESS_HOURS_CSV)
+            self._load_timezones(TIMEZONES_CSV)
+            manifest['generation'] += 1
+            self._save_manifest(manifest)
+            self._mark_generations(codes, manifest['generation'])
+            self._remove_segments(stale)
+        invalidate_schedules()
+        print("Data loaded successfully into the columnar store!")
+
+    def _load_status(self, csv_path, manifest):
+        """
+        Streams the polls CSV into staged parts per day, then merges each
+        touched day, and compacts the other days with segments. Returns the
+        merged segment files and the codes of the loaded stores.
+        """
+        stores = self._stores()
+        store_codes = {store_id: code for code, store_id in enumerate(stores.tolist())}
+        new_stores = []
+        staging = os.path.join(self.path, 'store_status', '_staging')
+        shutil.rmtree(staging, ignore_errors=True)
+
+        loaded = np.zeros(len(stores), dtype=bool)
+        part = 0
+        staged_rows = 0
+        reader = pd.read_csv(csv_path, usecols=['store_id', 'timestamp_utc', 'status'], dtype=str,
+                             chunksize=COLUMNAR_CHUNK_SIZE)
+        for chunk in reader:
+            codes = np.empty(len(chunk), dtype=np.int32)
+            for i, store_id in enumerate(chunk['store_id']):
+                code = store_codes.get(store_id)
+                if code is None:
+                    code = store_codes[store_id] = len(store_codes)
+                    new_stores.append(store_id)
+                codes[i] = code
+            if len(store_codes) > len(loaded):
+                loaded = np.concatenate([loaded, np.zeros(len(store_codes) - len(loaded), dtype=bool)])
+            loaded[codes] = True
+            ts_us = pd.to_datetime(chunk['timestamp_utc'].str.replace(' UTC', ''), format='ISO8601') \
+                .to_numpy(dtype='datetime64[us]').astype(np.int64)
+            active = (chunk['status'] == 'active').to_numpy()
+
+            days = ts_us // DAY_US
+            for day in np.unique(days):
+                rows = days == day
+                day_dir = os.path.join(staging, str(day))
+                os.makedirs(day_dir, exist_ok=True)
+                np.savez(os.path.join(day_dir, f'part-{part:05d}.npz'),
+                         code=codes[rows], ts_us=ts_us[rows], active=active[rows])
+            part += 1
+            staged_rows += len(chunk)
+            print(f"store_status: {staged_rows} rows staged")
+
+        if new_stores:
+            self._save_stores(np.concatenate([stores, np.array(new_stores, dtype=str)]))
+
+        stale = []
+        if os.path.isdir(staging):
+            for day_number in sorted(os.listdir(staging)):
+                day = pd.Timestamp(int(day_number) * DAY_US, unit='us').strftime('%Y-%m-%d')
+                parts = []
+                for name in sorted(os.listdir(os.path.join(staging, day_number))):
+                    with np.load(os.path.join(staging, day_number, name)) as staged:
+                        parts.append({column: staged[column] for column in STATUS_COLUMNS})
+                stale += self._merge_day(manifest, day, parts)
+            shutil.rmtree(staging)
+        for day in list(manifest['segments']):
+            stale += self._merge_day(manifest, day)
+
+        self._set_latest(manifest)
+        return stale, np.flatnonzero(loaded)
+
+    def _set_latest(self, manifest):
+        latest = [int(np.max(np.load(os.path.join(self._status_dir(day), 'ts_us.npy'), mmap_mode='r')))
+                  for day in manifest['days'][-1:]]
+        manifest['latest_us'] = latest[0] if latest else None
+
+    def insert_status(self, store_status):
+        """
+        Appends streamed polls as one segment file per day they touch,
+        compacting days whose segments have grown. Returns the generation the
+        write committed.
+        """
+        with self._write_lock():
+            manifest = self._manifest()
+            stores = self._stores()
+            store_codes = {store_id: code for code, store_id in enumerate(stores.tolist())}
+            new_stores = [store_id for store_id in pd.unique(store_status['store_id']) if store_id not in store_codes]
+            if new_stores:
+                store_codes.update((store_id, len(stores) + i) for i, store_id in enumerate(new_stores))
+                self._save_stores(np.concatenate([stores, np.array(new_stores, dtype=str)]))
+
+            codes = store_status['store_id'].map(store_codes).to_numpy(dtype=np.int32)
+            ts_us = store_status['timestamp_utc'].dt.tz_convert('UTC').dt.tz_localize(None) \
+                .to_numpy(dtype='datetime64[us]').astype(np.int64)
+            active = (store_status['status'] == 'active').to_numpy()
+            stale = []
+            day_numbers = ts_us // DAY_US
+            for day_number in np.unique(day_numbers):
+                rows = day_numbers == day_number
+                day = pd.Timestamp(int(day_number) * DAY_US, unit='us').strftime('%Y-%m-%d')
+                polls = {'code': codes[rows], 'ts_us': ts_us[rows], 'active': active[rows]}
+                if day not in manifest['days']:
+                    stale += self._merge_day(manifest, day, [polls])
+                    continue
+                self._append_segment(manifest, day, _merge_columns([polls]))
+                if self._needs_compaction(manifest, day):
+                    stale += self._merge_day(manifest, day)
+            if len(ts_us):
+                manifest['latest_us'] = max(manifest['latest_us'] or 0, int(ts_us.max()))
+            manifest['generation'] += 1
+            self._save_manifest(manifest)
+            self._mark_generations(codes, manifest['generation'])
+            self._remove_segments(stale)
+            return manifest['generation']
+
+    def _append_segment(self, manifest, day, columns):
+        """Writes sorted poll columns as a new segment of day; listed once the manifest is saved."""
+        name = f"{day}-{manifest['next_segment']:08d}.npz"
+        manifest['next_segment'] += 1
+        os.makedirs(os.path.dirname(self._segment_path(name)), exist_ok=True)
+        np.savez(self._segment_path(name), **columns)
+        manifest['segments'].setdefault(day, []).append([name, len(columns['code'])])
+
+    def _needs_compaction(self, manifest, day):
+        segments = manifest['segments'][day]
+        base_rows = np.load(os.path.join(self._status_dir(day), 'code.npy'), mmap_mode='r').shape[0]
+        return len(segments) >= COLUMNAR_MAX_SEGMENTS or 4 * sum(rows for _, rows in segments) >= base_rows
+
+    def _merge_day(self, manifest, day, parts=()):
+        """
+        Rewrites the day's base columns with its segments and parts merged in;
+        later rows win on the same store and time. Returns the merged segment
+        files, to remove once the saved manifest no longer lists them.
+        """
+        parts = list(parts)
+        if day in manifest['days']:
+            parts.insert(0, self._day_columns(manifest, day))
+        else:
+            manifest['days'] = sorted(manifest['days'] + [day])
+        _save_columns(self._status_dir(day), _merge_columns(parts))
+        return [self._segment_path(name) for name, _ in manifest['segments'].pop(day, [])]
+
+    @staticmethod
+    def _remove_segments(paths):
+        for path in paths:
+            os.remove(path)
+
+    def _merge_table(self, name, frame, key):
+        """Upserts frame into a small column table by key."""
+        directory = os.path.join(self.path, name)
+        if os.path.isdir(directory):
+            existing = pd.DataFrame(_load_columns(directory, frame.columns, mmap_mode=None))
+            frame = pd.concat([existing, frame], ignore_index=True)
+        frame = frame.drop_duplicates(subset=key, keep='last').sort_values(key, kind='stable')
+        # Strings as fixed-width NumPy strings, which load without pickling
+        columns = {
+            column: frame[column].to_numpy(dtype=None if pd.api.types.is_numeric_dtype(frame[column]) else str)
+            for column in frame.columns
+        }
+        _save_columns(directory, columns)
+
+    def _load_business_hours(self, csv_path):
+        csv = pd.read_csv(csv_path, dtype={'store_id': str, 'start_time_local': str, 'end_time_local': str})
+        frame = pd.DataFrame({
+            'store_id': csv['store_id'].to_numpy(dtype=str),
+            'day_of_week': csv['dayOfWeek'].to_numpy(dtype=np.int8),
+            'start_time_local': _time_to_seconds(csv['start_time_local']),
+            'end_time_local': _time_to_seconds(csv['end_time_local']),
+        })
+        self._merge_table('business_hours', frame, ['store_id', 'day_of_week', 'start_time_local'])
+
+    def _load_timezones(self, csv_path):
+        csv = pd.read_csv(csv_path, dtype=str)
+        frame = pd.DataFrame({
+            'store_id': csv['store_id'].to_numpy(dtype=str),
+            'timezone_str': csv['timezone_str'].to_numpy(dtype=str),
+        })
+        self._merge_table('timezones', frame, ['store_id'])
@@ -1,37 +1,16 @@
-import os
-from dotenv import load_dotenv
-import mysql.connector
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Fetch MySQL credentials from environment variables
-DB_USER = os.getenv('DB_USER')
-DB_PASSWORD = os.getenv('DB_PASSWORD')
-DB_HOST = os.getenv('DB_HOST')
-DB_PORT = os.getenv('DB_PORT')
-DB_NAME = os.getenv('DB_NAME')
-
-# Connect to MySQL database
-connection = mysql.connector.connect(
-    user=DB_USER,
-    password=DB_PASSWORD,
-    host=DB_HOST,
-    port=DB_PORT,
-    database=DB_NAME
-)
-
-cursor = connection.cursor()
+from app.db import close_pool, get_connection
 
 # Create tables for store_status, business_hours, and timezones
-def create_tables():
+def create_tables(connection):
+    cursor = connection.cursor()
     # Create store_status table with store_id as VARCHAR
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS store_status (
             store_id VARCHAR(255) NOT NULL,
-            timestamp_utc VARCHAR(50) NOT NULL,
+            timestamp_utc DATETIME(6) NOT NULL,
             status VARCHAR(10) NOT NULL,
-            PRIMARY KEY (store_id, timestamp_utc)
+            PRIMARY KEY (store_id, timestamp_utc),
+            INDEX idx_timestamp_store (timestamp_utc, store_id)
         )
     """)
 
@@ -42,7 +21,7 @@ def create_tables():
             day_of_week INT NOT NULL,
             start_time_local TIME NOT NULL,
             end_time_local TIME NOT NULL,
-            PRIMARY KEY (store_id, day_of_week)
+            PRIMARY KEY (store_id, day_of_week, start_time_local)
         )
     """)
 
@@ -55,14 +34,131 @@ def create_tables():
         )
     """)
 
+    # Store dictionary: an int code per store_id, maintained by the loaders (app.stores)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stores (
+            store_code INT NOT NULL AUTO_INCREMENT,
+            store_id VARCHAR(255) NOT NULL,
+            PRIMARY KEY (store_code),
+            UNIQUE KEY uq_store_id (store_id)
+        )
+    """)
+
+    # Hourly rollups of business-hours polls, maintained by app.rollup
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS store_status_hourly (
+            store_id VARCHAR(255) NOT NULL,
+            hour_start DATETIME NOT NULL,
+            poll_count INT NOT NULL,
+            first_ts DATETIME(6) NOT NULL,
+            first_active TINYINT NOT NULL,
+            last_ts DATETIME(6) NOT NULL,
+            last_active TINYINT NOT NULL,
+            inner_up_us BIGINT NOT NULL,
+            inner_down_us BIGINT NOT NULL,
+            PRIMARY KEY (store_id, hour_start),
+            INDEX idx_hour_start (hour_start)
+        )
+    """)
+
+    # Store-hours whose rollups streamed polls made stale, with the generation
+    # that last marked them, refreshed in the background by app.rollup
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS store_status_hourly_dirty (
+            store_id VARCHAR(255) NOT NULL,
+            hour_start DATETIME NOT NULL,
+            generation BIGINT NOT NULL,
+            PRIMARY KEY (store_id, hour_start)
+        )
+    """)
+
+    # Generation of the last load that wrote each store's polls, which
+    # validates the per-store uptime cache (app.store_uptime)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS store_generations (
+            store_id VARCHAR(255) NOT NULL,
+            generation BIGINT NOT NULL,
+            PRIMARY KEY (store_id)
+        )
+    """)
+
+    # Generation counter bumped by every ingest commit, part of the report cache key
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_state (
+            id INT NOT NULL,
+            generation BIGINT NOT NULL,
+            PRIMARY KEY (id)
+        )
+    """)
+
     connection.commit()
     print("Tables created successfully!")
 
+# Allow several business-hours intervals on the same day
+def migrate_business_hours_key(connection):
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.key_column_usage
+        WHERE table_schema = DATABASE() AND table_name = 'business_hours' AND constraint_name = 'PRIMARY'
+    """)
+    if cursor.fetchone()[0] == 2:
+        cursor.execute("""
+            ALTER TABLE business_hours
+            DROP PRIMARY KEY,
+            ADD PRIMARY KEY (store_id, day_of_week, start_time_local)
+        """)
+        connection.commit()
+        print("business_hours primary key migrated!")
+
+# Convert VARCHAR 'YYYY-MM-DD HH:MM:SS.ffffff UTC' timestamps to DATETIME(6)
+# and index them, so reports can filter on time inside MySQL
+def migrate_timestamp_column(connection):
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT DATA_TYPE FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = 'store_status' AND column_name = 'timestamp_utc'
+    """)
+    if cursor.fetchone()[0].lower() != 'datetime':
+        cursor.execute("UPDATE store_status SET timestamp_utc = REPLACE(timestamp_utc, ' UTC', '')")
+        cursor.execute("""
+            ALTER TABLE store_status
+            MODIFY timestamp_utc DATETIME(6) NOT NULL,
+            ADD INDEX idx_timestamp_store (timestamp_utc, store_id)
+        """)
+        connection.commit()
+        print("store_status.timestamp_utc migrated to DATETIME(6)!")
+
+# Fill the store dictionary with the stores loaded before it existed
+def migrate_store_dictionary(connection):
+    cursor = connection.cursor()
+    cursor.execute("""
+        INSERT IGNORE INTO stores (store_id)
+        SELECT store_id FROM store_status
+        UNION SELECT store_id FROM business_hours
+        UNION SELECT store_id FROM timezones
+        ORDER BY store_id
+    """)
+    if cursor.rowcount > 0:
+        print(f"{cursor.rowcount} stores added to the store dictionary!")
+    connection.commit()
+
+# Give the stores loaded before store_generations existed a generation
+def migrate_store_generations(connection):
+    cursor = connection.cursor()
+    cursor.execute("INSERT IGNORE INTO store_generations (store_id, generation) SELECT DISTINCT store_id, 0 FROM store_status")
+    if cursor.rowcount > 0:
+        print(f"{cursor.rowcount} stores added to store_generations!")
+    connection.commit()
+
 # Run the function to create tables
 if __name__ == "__main__":
-    create_tables()
+    with get_connection() as connection:
+        create_tables(connection)
+        migrate_business_hours_key(connection)
+        migrate_timestamp_column(connection)
+        migrate_store_dictionary(connection)
+        migrate_store_generations(connection)
 
-# Close connection
+# Close pooled connections
 def close_connection():
-    cursor.close()
-    connection.close()
\ No newline at end of file
+    close_pool()
\ No newline at end of file
@@ -0,0 +1,115 @@
+"""
+Shared MySQL connection pool.
+
+The pool is created on first use, so importing a module doesn't open
+connections. Code borrows a connection with get_connection(), which checks
+it is still alive before handing it out and returns it to the pool
+afterwards.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import mysql.connector
+from dotenv import load_dotenv
+from mysql.connector import pooling
+
+# Load environment variables from .env file
+load_dotenv()
+
+DB_POOL_NAME = 'store_monitoring'
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+# Seconds to wait for a free connection when the pool is exhausted
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+# Reconnect attempts for a pooled connection the server has closed
+DB_RECONNECT_ATTEMPTS = int(os.getenv('DB_RECONNECT_ATTEMPTS', 3))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def connection_config():
+    """MySQL connection settings from the DB_* environment variables."""
+    config = {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'database': os.getenv('DB_NAME'),
+    }
+    if os.getenv('DB_PORT'):
+        config['port'] = int(os.getenv('DB_PORT'))
+    return config
+
+
+def get_pool():
+    """Returns the process-wide pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name=DB_POOL_NAME,
+                    pool_size=DB_POOL_SIZE,
+                    pool_reset_session=True,
+                    **connection_config()
+                )
+    return _pool
+
+
+def use_pool(pool):
+    """
+    Replaces the process-wide pool with any object whose get_connection()
+    returns a MySQL-compatible connection, e.g. a stand-in backend for
+    benchmarks.
+    """
+    global _pool
+    with _pool_lock:
+        _pool = pool
+
+
+def _checkout(timeout):
+    """Takes a connection from the pool, waiting up to timeout seconds for one to be returned."""
+    deadline = time.monotonic() + timeout
+    delay = 0.01
+    while True:
+        try:
+            return get_pool().get_connection()
+        except pooling.PoolError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+
+@contextmanager
+def get_connection(timeout=None):
+    """
+    Borrows a validated connection from the pool for the duration of the block.
+
+    Uncommitted work is rolled back when the connection goes back to the pool.
+    """
+    connection = _checkout(DB_POOL_TIMEOUT if timeout is None else timeout)
+    try:
+        # The server may have closed an idle pooled connection
+        connection.ping(reconnect=True, attempts=DB_RECONNECT_ATTEMPTS, delay=1)
+        yield connection
+    finally:
+        try:
+            if connection.unread_result:
+                connection.consume_results()
+            if connection.in_transaction:
+                connection.rollback()
+        except mysql.connector.Error:
+            pass
+        # Returns the connection to the pool
+        connection.close()
+
+
+def close_pool():
+    """Closes the idle pooled connections; the next get_connection() starts a new pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool._remove_connections()
+            _pool = None
@@ -0,0 +1,259 @@
+import numpy as np
+import pandas as pd
+import pytz
+from datetime import timedelta
+
+from app.metrics import count, stage
+from app.schedule import build_schedule_index
+
+DEFAULT_TIMEZONE = 'America/Chicago'
+# Polls handled at a time by the business-hours lookup and the window sums,
+# which bounds their temporaries
+CHUNK_ROWS = 1 << 16
+
+# Column order matches the rows built by calculate_uptime_downtime
+METRIC_COLUMNS = [
+    'uptime_last_hour', 'downtime_last_hour',
+    'uptime_last_day', 'downtime_last_day',
+    'uptime_last_week', 'downtime_last_week',
+]
+
+WINDOWS = [
+    ('last_hour', timedelta(hours=1)),
+    ('last_day', timedelta(days=1)),
+    ('last_week', timedelta(weeks=1)),
+]
+
+def to_epoch_us(timestamps):
+    """Convert a tz-aware UTC timestamp Series to int64 epoch microseconds, without a copy when already in us."""
+    return timestamps.to_numpy(dtype='datetime64[us]').view(np.int64)
+
+
+def timestamp_to_us(value):
+    """Convert a single timestamp (naive values are taken as UTC) to epoch microseconds."""
+    value = pd.Timestamp(value)
+    if value.tzinfo is not None:
+        value = value.tz_convert('UTC').tz_localize(None)
+    return int(value.to_datetime64().astype('datetime64[us]').astype(np.int64))
+
+
+def factorize_stores(store_ids):
+    """
+    Codes of a store_id column and its distinct store_ids in order of first
+    appearance. A Categorical column from storage is recoded from its
+    category codes, so only the distinct store_ids are turned into strings.
+    """
+    if not isinstance(store_ids.dtype, pd.CategoricalDtype):
+        codes, uniques = pd.factorize(store_ids)
+        return codes, pd.Index(np.asarray(uniques, dtype=object), dtype=str)
+
+    categories = store_ids.cat.categories
+    # The codes array itself; .cat.codes would copy it
+    raw = store_ids.array.codes
+    # Polls come grouped by store, so first appearances are among the few run starts
+    starts = np.ones(len(raw), dtype=bool)
+    starts[1:] = raw[1:] != raw[:-1]
+    used = pd.unique(raw[starts])
+    used = used[used >= 0]
+    # Same width as the category codes. One slot past the categories, so
+    # missing values (code -1) stay -1
+    positions = np.full(len(categories) + 1, -1, dtype=raw.dtype)
+    positions[used] = np.arange(len(used))
+    return positions[raw], pd.Index(categories[used], dtype=str)
+
+
+def resolve_store_timezones(store_ids, timezones):
+    """Returns a timezone name for every store, falling back to the default for missing or invalid ones."""
+    if timezones.empty:
+        count('default_timezone_stores', len(store_ids))
+        return pd.Series(DEFAULT_TIMEZONE, index=store_ids)
+
+    lookup = timezones.drop_duplicates('store_id', keep='first').set_index('store_id')['timezone_str']
+    store_tz = lookup.reindex(store_ids)
+    missing = store_tz.isna()
+    store_tz = store_tz.fillna(DEFAULT_TIMEZONE)
+
+    valid = {name: name in pytz.all_timezones_set for name in store_tz.unique()}
+    is_valid = store_tz.map(valid).astype(bool)
+    count('default_timezone_stores', missing.sum())
+    count('invalid_timezone_stores', (~is_valid).sum())
+    return store_tz.where(is_valid, DEFAULT_TIMEZONE)
+
+
+def store_chunks(codes, rows=None):
+    """(lo, hi) ranges of about rows polls each, cut only between two stores' polls."""
+    rows = rows or CHUNK_ROWS
+    boundaries = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+    at = np.searchsorted(boundaries, np.arange(rows, len(codes), rows))
+    edges = np.concatenate(([0], np.unique(boundaries[at[at < len(boundaries)]]), [len(codes)]))
+    return zip(edges[:-1], edges[1:])
+
+
+def window_totals(codes, ts_us, active, has_polls, n_stores, start_us, end_us):
+    """
+    Sums uptime/downtime microseconds per store inside [start_us, end_us].
+
+    Same interval rules as calculate_time: each poll closes the interval since
+    the previous poll (or the window start) with its own status, the tail up to
+    the window end takes the last status, and a store with filtered polls but
+    none in the window is down for the whole window. Polls must be grouped by
+    store; they are summed a chunk of stores at a time.
+    """
+    uptime = np.zeros(n_stores, dtype=np.float64)
+    downtime = np.zeros(n_stores, dtype=np.float64)
+    in_window = np.zeros(n_stores, dtype=bool)
+    for lo, hi in store_chunks(codes):
+        sel = (ts_us[lo:hi] >= start_us) & (ts_us[lo:hi] <= end_us)
+        c = codes[lo:hi][sel]
+        if not len(c):
+            continue
+        t = ts_us[lo:hi][sel]
+        a = active[lo:hi][sel]
+        in_window[c] = True
+
+        first = np.ones(len(c), dtype=bool)
+        first[1:] = c[1:] != c[:-1]
+        last = np.ones(len(c), dtype=bool)
+        last[:-1] = first[1:]
+
+        # Gap to the previous poll, or to the window start for a store's first
+        interval = np.empty(len(t), dtype=np.float64)
+        np.subtract(t[1:], t[:-1], out=interval[1:], casting='unsafe')
+        interval[first] = t[first] - start_us
+
+        # Microsecond sums are whole numbers, so reusing one weights buffer
+        # for the down intervals is exact
+        weights = interval * a
+        uptime += np.bincount(c, weights=weights, minlength=n_stores)
+        np.subtract(interval, weights, out=weights)
+        downtime += np.bincount(c, weights=weights, minlength=n_stores)
+
+        tail = (end_us - t[last]).astype(np.float64)
+        tail_active = a[last]
+        np.add.at(uptime, c[last][tail_active], tail[tail_active])
+        np.add.at(downtime, c[last][~tail_active], tail[~tail_active])
+
+    downtime[has_polls & ~in_window] += end_us - start_us
+    return uptime, downtime
+
+
+def to_minutes(values):
+    """Microsecond totals as minutes rounded like calculate_time."""
+    return [round(v / 1e6 / 60, 2) for v in values]
+
+
+def business_hours_polls(store_status, timezones, business_hours, end_us):
+    """
+    The polls inside their store's business hours, grouped by store.
+
+    Returns (store_ids, codes, ts_us, active): store_ids in order of first
+    appearance, and the code, epoch microseconds and active flag of every
+    business-hours poll, ordered by code and keeping the original order within
+    a store.
+    """
+    count('polls', len(store_status))
+    with stage('parse'):
+        codes, store_ids = factorize_stores(store_status['store_id'])
+        ts_us = to_epoch_us(store_status['timestamp_utc'])
+        active = (store_status['status'] == 'active').to_numpy()
+    n_stores = len(store_ids)
+    count('stores', n_stores)
+
+    # Business hours compiled to UTC intervals over the whole poll range, so
+    # older polls still count towards has_polls as in filter_business_hours
+    with stage('schedule'):
+        store_tz = resolve_store_timezones(store_ids, timezones)
+        if business_hours.empty:
+            count('default_business_hours_stores', n_stores)
+        else:
+            count('default_business_hours_stores', (~store_ids.isin(business_hours['store_id'])).sum())
+        schedules = build_schedule_index(
+            store_ids, store_tz, business_hours, int(ts_us.min()), max(end_us, int(ts_us.max()))
+        )
+        mask = np.empty(len(codes), dtype=bool)
+        for lo in range(0, len(codes), CHUNK_ROWS):
+            hi = lo + CHUNK_ROWS
+            mask[lo:hi] = schedules.contains(codes[lo:hi], ts_us[lo:hi])
+
+        # Group polls by store, keeping their original order within the store;
+        # fetched polls already are
+        if len(codes) and (codes[1:] >= codes[:-1]).all():
+            return store_ids, codes[mask], ts_us[mask], active[mask]
+        order = np.argsort(codes, kind='stable')
+        order = order[mask[order]]
+    return store_ids, codes[order], ts_us[order], active[order]
+
+
+def compute_metrics(store_status, timezones, business_hours, current_time):
+    """
+    Calculates the six uptime/downtime metrics for every store in one pass.
+
+    Produces the same rows, in the same store order, as running
+    calculate_uptime_downtime for each store in store_status. Business hours
+    come from the compiled schedule index, which also honours several
+    intervals per day and hours that run past midnight; for stores with one
+    same-day interval per day the results are identical.
+    """
+    if store_status.empty:
+        return pd.DataFrame(columns=['store_id'] + METRIC_COLUMNS)
+
+    end_us = timestamp_to_us(current_time)
+    store_ids, codes, ts_us, active = business_hours_polls(store_status, timezones, business_hours, end_us)
+    n_stores = len(store_ids)
+
+    with stage('compute'):
+        has_polls = np.bincount(codes, minlength=n_stores) > 0
+
+        report = pd.DataFrame({'store_id': store_ids})
+        for timeframe, delta in WINDOWS:
+            start_us = end_us - int(delta / timedelta(microseconds=1))
+            uptime, downtime = window_totals(codes, ts_us, active, has_polls, n_stores, start_us, end_us)
+            report[f'uptime_{timeframe}'] = to_minutes(uptime)
+            report[f'downtime_{timeframe}'] = to_minutes(downtime)
+
+    return report[['store_id'] + METRIC_COLUMNS]
+
+
+def _rows_by_store(table, store_ids):
+    """
+    A function returning the rows of table for the stores with codes in
+    [first, last) of store_ids, as one slice of the table sorted by code.
+    """
+    if table.empty:
+        return lambda first, last: table
+    codes = store_ids.get_indexer(table['store_id'])
+    order = np.argsort(codes, kind='stable')
+    order = order[codes[order] >= 0]
+    table, codes = table.take(order), codes[order]
+
+    def rows(first, last):
+        lo, hi = np.searchsorted(codes, [first, last])
+        return table.iloc[lo:hi]
+    return rows
+
+
+def iter_metrics(store_status, timezones, business_hours, current_time, rows=None):
+    """
+    Yields the rows of compute_metrics one chunk of about rows polls at a
+    time, cut only between two stores, so temporaries and report batches
+    stay the size of a chunk. The chunks together are compute_metrics over
+    the whole frame, in the same store order; each chunk sees only its own
+    stores' timezones and business hours.
+    """
+    if store_status.empty:
+        yield compute_metrics(store_status, timezones, business_hours, current_time)
+        return
+
+    codes, store_ids = factorize_stores(store_status['store_id'])
+    # Codes follow first appearance, so polls grouped by store have ascending codes
+    if not (codes[1:] >= codes[:-1]).all():
+        order = np.argsort(codes, kind='stable')
+        store_status, codes = store_status.take(order), codes[order]
+    store_timezones = _rows_by_store(timezones, store_ids)
+    store_hours = _rows_by_store(business_hours, store_ids)
+
+    for lo, hi in store_chunks(codes, rows):
+        first, last = codes[lo], codes[hi - 1] + 1
+        yield compute_metrics(
+            store_status.iloc[lo:hi], store_timezones(first, last), store_hours(first, last), current_time
+        )
@@ -0,0 +1,245 @@
+"""
+Batched, column-oriented reads from MySQL.
+
+Polls come from an unbuffered cursor with fetchmany, so at most one batch of
+raw tuples is alive at a time. Each batch is decoded straight into NumPy
+columns without building a dict per row. Stores are read as their codes in
+the store dictionary and statuses as 0/1, so a decoded poll is an int32
+store position, an int64 timestamp and a bool.
+"""
+import os
+from datetime import time, timedelta
+
+import numpy as np
+import pandas as pd
+
+from app.metrics import stage
+from app.stores import store_dictionary
+
+# History fetched before the one-week report window. Older polls only matter
+# for stores with no business-hours poll inside the window.
+FETCH_LOOKBACK = timedelta(hours=int(os.getenv('FETCH_LOOKBACK_HOURS', 24)))
+REPORT_WINDOW = timedelta(weeks=1)
+
+FETCH_BATCH_SIZE = int(os.getenv('FETCH_BATCH_SIZE', 50000))
+# Upper bound for the polls held by one store chunk
+FETCH_MEMORY_LIMIT_MB = int(os.getenv('FETCH_MEMORY_LIMIT_MB', 256))
+# Approximate in-memory size of one decoded poll (store code, timestamp, status)
+POLL_BYTES = 16
+
+STATUS_COLUMNS = ['store_id', 'timestamp_utc', 'status']
+STATUS_VALUES = ['inactive', 'active']
+
+
+def convert_timedelta_to_time(td):
+    """Convert timedelta to time object."""
+    seconds = td.total_seconds()
+    hours = int(seconds // 3600)
+    minutes = int((seconds % 3600) // 60)
+    seconds = int(seconds % 60)
+    return time(hours, minutes, seconds)
+
+
+def convert_timedelta_column(values):
+    """convert_timedelta_to_time over a column, once per distinct value."""
+    codes, uniques = pd.factorize(values)
+    times = np.array([convert_timedelta_to_time(td) for td in uniques], dtype=object)
+    return times[codes]
+
+
+def fetch_latest_timestamp(db):
+    """Returns the newest poll time (naive UTC), or None without polls."""
+    cursor = db.cursor()
+    cursor.execute("SELECT MAX(timestamp_utc) FROM store_status")
+    latest = cursor.fetchone()[0]
+    cursor.close()
+    return latest
+
+
+def fetch_data_version(db):
+    """
+    Identifies the data a report is computed from: the ingest generation
+    counter, which every load bumps in the transaction that writes its rows.
+    One primary-key read, so it stays cheap however large the tables grow.
+    """
+    return str(fetch_generation(db))
+
+
+def fetch_generation(db):
+    """The ingest generation counter, bumped by every load."""
+    cursor = db.cursor()
+    cursor.execute("SELECT generation FROM ingest_state WHERE id = 1")
+    row = cursor.fetchone()
+    cursor.close()
+    return row[0] if row else 0
+
+
+def fetch_store_generations(db, store_ids):
+    """
+    Returns {store_id: generation of the last load that wrote its polls} for
+    the given stores that have polls; one primary-key read per store,
+    however long their history.
+    """
+    if not store_ids:
+        return {}
+    cursor = db.cursor()
+    cursor.execute(
+        f"SELECT store_id, generation FROM store_generations WHERE store_id IN ({', '.join(['%s'] * len(store_ids))})",
+        tuple(store_ids)
+    )
+    generations = {store_id: int(generation) for store_id, generation in cursor.fetchall()}
+    cursor.close()
+    return generations
+
+
+def fetch_store_count(db, start, end):
+    """Number of stores with polls in [start, end], read from the timestamp index."""
+    cursor = db.cursor()
+    cursor.execute(
+        "SELECT COUNT(DISTINCT store_id) FROM store_status WHERE timestamp_utc BETWEEN %s AND %s",
+        (start, end)
+    )
+    stores = cursor.fetchone()[0]
+    cursor.close()
+    return stores
+
+
+def report_window(latest):
+    """The poll range needed for a report ending at latest."""
+    return latest - REPORT_WINDOW - FETCH_LOOKBACK, latest
+
+
+def decode_batch(db, rows):
+    """Turns (store_code, timestamp_utc, active) tuples into typed columns of store positions."""
+    with stage('parse'):
+        store_codes, timestamps, active = zip(*rows)
+        return (
+            store_dictionary.positions(db, store_codes),
+            np.array(timestamps, dtype='datetime64[us]'),
+            np.array(active, dtype=bool),
+        )
+
+
+def stream_status_columns(db, start, end, batch_size=None, store_ids=None):
+    """
+    Yields (store position, timestamp_utc, active) column batches for polls in [start, end].
+
+    Rows arrive ordered by store_id and time from an unbuffered cursor. With
+    store_ids only those stores are read, through the primary key.
+    """
+    batch_size = batch_size or FETCH_BATCH_SIZE
+    query = """
+        SELECT d.store_code, s.timestamp_utc, s.status = 'active' FROM store_status s
+        JOIN stores d ON d.store_id = s.store_id
+        WHERE s.timestamp_utc BETWEEN %s AND %s
+    """
+    params = (start, end)
+    if store_ids is not None:
+        if not store_ids:
+            return
+        query += f" AND s.store_id IN ({', '.join(['%s'] * len(store_ids))})"
+        params += tuple(store_ids)
+    cursor = db.cursor(buffered=False)
+    try:
+        cursor.execute(query + " ORDER BY s.store_id, s.timestamp_utc", params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield decode_batch(db, rows)
+    finally:
+        # An abandoned unbuffered result would block the next query
+        if db.unread_result:
+            db.consume_results()
+        cursor.close()
+
+
+def columns_to_frame(positions, timestamps, active, stores=None):
+    """
+    Builds the store_status DataFrame the report engines expect.
+
+    store_id is a Categorical whose codes are the positions in stores, the
+    store dictionary by default, so the UUIDs aren't repeated per poll.
+    Timestamps and statuses, and positions already in the code dtype pandas
+    picks for that many stores, are used without a copy.
+    """
+    stores = store_dictionary.categories() if stores is None else stores
+    return pd.DataFrame({
+        'store_id': pd.Categorical.from_codes(positions, categories=stores),
+        # Epoch values taken as UTC, which unlike tz_localize keeps the array
+        'timestamp_utc': pd.DatetimeIndex(timestamps.view(np.int64), dtype='datetime64[us, UTC]', copy=False),
+        'status': pd.Categorical.from_codes(active.view(np.int8), STATUS_VALUES),
+    }, copy=False)
+
+
+def empty_status_frame():
+    return columns_to_frame(
+        np.empty(0, dtype=np.int32), np.empty(0, dtype='datetime64[us]'), np.empty(0, dtype=bool),
+        pd.Index([], dtype=str),
+    )
+
+
+def fetch_status(db, start, end, store_ids=None):
+    """Fetches the polls in [start, end], of all stores or only store_ids, as one DataFrame."""
+    columns = [list(column) for column in zip(*stream_status_columns(db, start, end, store_ids=store_ids))]
+    if not columns:
+        return empty_status_frame()
+    # One column at a time, so its batches are freed before the next is joined
+    for i, batches in enumerate(columns):
+        columns[i] = np.concatenate(batches)
+        batches.clear()
+    return columns_to_frame(*columns)
+
+
+def iter_store_chunks(db, start, end, memory_limit_mb=None):
+    """
+    Yields store_status DataFrames holding complete stores, ordered by store.
+
+    A chunk is cut at the last store boundary once the buffered polls reach
+    the memory limit, so a chunk only grows past it when one store alone
+    does.
+    """
+    memory_limit_mb = memory_limit_mb or FETCH_MEMORY_LIMIT_MB
+    max_rows = max(1, memory_limit_mb * 1024 * 1024 // POLL_BYTES)
+
+    pending = []
+    pending_rows = 0
+    for batch in stream_status_columns(db, start, end):
+        pending.append(batch)
+        pending_rows += len(batch[0])
+        if pending_rows < max_rows:
+            continue
+
+        store_ids, timestamps, active = (np.concatenate(column) for column in zip(*pending))
+        # Keep the last (possibly incomplete) store for the next chunk
+        cut = np.flatnonzero(store_ids != store_ids[-1])
+        if not len(cut):
+            pending = [(store_ids, timestamps, active)]
+            continue
+        cut = cut[-1] + 1
+        yield columns_to_frame(store_ids[:cut], timestamps[:cut], active[:cut])
+        pending = [(store_ids[cut:], timestamps[cut:], active[cut:])]
+        pending_rows = len(pending[0][0])
+
+    if pending_rows:
+        yield columns_to_frame(*(np.concatenate(column) for column in zip(*pending)))
+
+
+def fetch_store_tables(db, store_ids=None):
+    """Fetches timezones and business hours, of all stores or only store_ids."""
+    where, params = "", ()
+    if store_ids is not None:
+        # IN () is not valid SQL; no ids match no rows
+        where = f" WHERE store_id IN ({', '.join(['%s'] * len(store_ids)) or 'NULL'})"
+        params = tuple(store_ids)
+    # Plain tuples rather than a dict per row
+    cursor = db.cursor()
+    cursor.execute("SELECT * FROM timezones" + where, params)
+    timezones = pd.DataFrame.from_records(cursor.fetchall(), columns=[column[0] for column in cursor.description])
+    cursor.execute("SELECT * FROM business_hours" + where, params)
+    business_hours = pd.DataFrame.from_records(cursor.fetchall(), columns=[column[0] for column in cursor.description])
+    cursor.close()
+    if not business_hours.empty:
+        business_hours['start_time_local'] = convert_timedelta_column(business_hours['start_time_local'])
+        business_hours['end_time_local'] = convert_timedelta_column(business_hours['end_time_local'])
+    return timezones, business_hours
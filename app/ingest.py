@@ -1,75 +1,260 @@
 import os
+import sys
+import csv
+import json
+import time
 import pandas as pd
-import mysql.connector
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Fetch MySQL credentials from environment variables
-DB_USER = os.getenv('DB_USER')
-DB_PASSWORD = os.getenv('DB_PASSWORD')
-DB_HOST = os.getenv('DB_HOST')
-DB_PORT = os.getenv('DB_PORT')
-DB_NAME = os.getenv('DB_NAME')
-
-# Connect to MySQL database
-connection = mysql.connector.connect(
-    user=DB_USER,
-    password=DB_PASSWORD,
-    host=DB_HOST,
-    port=DB_PORT,
-    database=DB_NAME
-)
-
-cursor = connection.cursor()
+from app.db import close_pool, get_connection
+from app.fetch import fetch_generation
+from app.schedule import invalidate_schedules
+from app.stores import store_dictionary
+from app.rollup import mark_stale_hours, refresh_rollups
 
 # Define the path to your CSV files
-BASE_PATH = "data"
+BASE_PATH = os.getenv('INGEST_DATA_DIR', "data")
 STORE_STATUS_CSV = os.path.join(BASE_PATH, "store_status.csv")
 BUSINESS_HOURS_CSV = os.path.join(BASE_PATH, "menu_hours.csv")
 TIMEZONES_CSV = os.path.join(BASE_PATH, "timezones.csv")
 
-# Load CSV files into Pandas DataFrames
-store_status_df = pd.read_csv(STORE_STATUS_CSV)
-business_hours_df = pd.read_csv(BUSINESS_HOURS_CSV)
-timezones_df = pd.read_csv(TIMEZONES_CSV)
+# Bulk ingest settings
+CHECKPOINT_FILE = os.path.join(BASE_PATH, ".ingest_checkpoint.json")
+CHUNK_SIZE = int(os.getenv('INGEST_CHUNK_SIZE', 100000))
+BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 1000))
+
+# CSV file, target table, CSV column -> table column, columns refreshed on duplicate keys
+BULK_SOURCES = [
+    (STORE_STATUS_CSV, 'store_status',
+     {'store_id': 'store_id', 'timestamp_utc': 'timestamp_utc', 'status': 'status'},
+     ['status']),
+    (BUSINESS_HOURS_CSV, 'business_hours',
+     {'store_id': 'store_id', 'dayOfWeek': 'day_of_week',
+      'start_time_local': 'start_time_local', 'end_time_local': 'end_time_local'},
+     ['end_time_local']),
+    (TIMEZONES_CSV, 'timezones',
+     {'store_id': 'store_id', 'timezone_str': 'timezone_str'},
+     ['timezone_str']),
+]
 
 # Function to insert data into MySQL
 def insert_data():
-    # Insert store_status data
-    for _, row in store_status_df.iterrows():
-        cursor.execute("""
-            INSERT INTO store_status (store_id, timestamp_utc, status)
-            VALUES (%s, %s, %s)
-            ON DUPLICATE KEY UPDATE status=%s
-        """, (row['store_id'], row['timestamp_utc'], row['status'], row['status']))
-
-    # Insert business_hours data
-    for _, row in business_hours_df.iterrows():
-        cursor.execute("""
-            INSERT INTO business_hours (store_id, day_of_week, start_time_local, end_time_local)
-            VALUES (%s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE start_time_local=%s, end_time_local=%s
-        """, (row['store_id'], row['dayOfWeek'], row['start_time_local'], row['end_time_local'],
-              row['start_time_local'], row['end_time_local']))
-
-    # Insert timezones data
-    for _, row in timezones_df.iterrows():
-        cursor.execute("""
-            INSERT INTO timezones (store_id, timezone_str)
-            VALUES (%s, %s)
-            ON DUPLICATE KEY UPDATE timezone_str=%s
-        """, (row['store_id'], row['timezone_str'], row['timezone_str']))
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        # Load CSV files into Pandas DataFrames
+        store_status_df = pd.read_csv(STORE_STATUS_CSV)
+        business_hours_df = pd.read_csv(BUSINESS_HOURS_CSV)
+        timezones_df = pd.read_csv(TIMEZONES_CSV)
+        # timestamp_utc is DATETIME(6), which doesn't accept the ' UTC' suffix
+        store_status_df['timestamp_utc'] = store_status_df['timestamp_utc'].str.replace(' UTC', '')
+
+        # Give every store a code in the store dictionary
+        store_dictionary.register(connection, pd.concat([
+            store_status_df['store_id'], business_hours_df['store_id'], timezones_df['store_id']
+        ]))
+
+        # Insert store_status data
+        for _, row in store_status_df.iterrows():
+            cursor.execute("""
+                INSERT INTO store_status (store_id, timestamp_utc, status)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE status=%s
+            """, (row['store_id'], row['timestamp_utc'], row['status'], row['status']))
+
+        # Insert business_hours data
+        for _, row in business_hours_df.iterrows():
+            cursor.execute("""
+                INSERT INTO business_hours (store_id, day_of_week, start_time_local, end_time_local)
+                VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE start_time_local=%s, end_time_local=%s
+            """, (row['store_id'], row['dayOfWeek'], row['start_time_local'], row['end_time_local'],
+                  row['start_time_local'], row['end_time_local']))
+
+        # Insert timezones data
+        for _, row in timezones_df.iterrows():
+            cursor.execute("""
+                INSERT INTO timezones (store_id, timezone_str)
+                VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE timezone_str=%s
+            """, (row['store_id'], row['timezone_str'], row['timezone_str']))
+
+        bump_generation(cursor)
+        mark_store_generations(cursor, store_status_df['store_id'], fetch_generation(connection))
+        connection.commit()
+        # Business hours or timezones may have changed
+        invalidate_schedules()
+        refresh_rollups(connection)
+        print("Data loaded successfully into MySQL!")
 
+def bump_generation(cursor):
+    """Marks the data as changed for the report cache; committed with the rows it covers."""
+    cursor.execute("""
+        INSERT INTO ingest_state (id, generation) VALUES (1, 1)
+        ON DUPLICATE KEY UPDATE generation = generation + 1
+    """)
+
+def mark_store_generations(cursor, store_ids, generation):
+    """Records generation as the last load of these stores' polls, in the load's transaction."""
+    rows = [(store_id, generation) for store_id in pd.unique(pd.Series(store_ids, dtype=object))]
+    upsert_rows(cursor, 'store_generations', ['store_id', 'generation'], ['generation'], rows)
+
+def insert_status(connection, store_status):
+    """
+    Upserts streamed polls with batched multi-row statements, marking
+    their rollup hours stale in the same transaction.
+
+    Returns the generation the write committed, so callers can tell whether
+    anything else was written since the generation they last saw.
+    """
+    timestamps = store_status['timestamp_utc'].dt.tz_convert('UTC').dt.tz_localize(None)
+    rows = list(zip(store_status['store_id'], timestamps.dt.to_pydatetime(), store_status['status']))
+    store_dictionary.register(connection, store_status['store_id'])
+    cursor = connection.cursor()
+    upsert_rows(cursor, 'store_status', ['store_id', 'timestamp_utc', 'status'], ['status'], rows)
+    bump_generation(cursor)
+    generation = fetch_generation(connection)
+    mark_stale_hours(cursor, store_status, generation)
+    mark_store_generations(cursor, store_status['store_id'], generation)
     connection.commit()
+    cursor.close()
+    return generation
+
+def load_checkpoint():
+    """Returns the saved bulk ingest progress, keyed by CSV path."""
+    if not os.path.exists(CHECKPOINT_FILE):
+        return {}
+    with open(CHECKPOINT_FILE) as f:
+        return json.load(f)
+
+def save_checkpoint(checkpoint):
+    """Writes the bulk ingest progress atomically."""
+    tmp_path = CHECKPOINT_FILE + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, CHECKPOINT_FILE)
+
+def file_signature(path):
+    """Size and modification time, so a replaced CSV is not resumed halfway."""
+    stat = os.stat(path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+def upsert_rows(cursor, table, columns, update_columns, rows):
+    """Writes rows with multi-row INSERT ... ON DUPLICATE KEY UPDATE statements."""
+    placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    updates = ", ".join(f"{col}=VALUES({col})" for col in update_columns)
+    for start in range(0, len(rows), BATCH_SIZE):
+        batch = rows[start:start + BATCH_SIZE]
+        cursor.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+            + ", ".join([placeholders] * len(batch))
+            + f" ON DUPLICATE KEY UPDATE {updates}",
+            [value for row in batch for value in row]
+        )
+
+def skip_records(f, records):
+    """
+    Moves f past its next records CSV records. Blank lines aren't records, as
+    for read_csv, and csv.reader only reads the lines a record needs, so the
+    file is left at the start of the next one.
+    """
+    reader = csv.reader(f)
+    while records > 0:
+        record = next(reader, None)
+        if record is None:
+            return
+        if record:
+            records -= 1
+
+def bulk_insert_file(connection, csv_path, table, column_map, update_columns, checkpoint):
+    """Streams one CSV into its table in chunks, committing and checkpointing after each."""
+    signature = file_signature(csv_path)
+    progress = checkpoint.get(csv_path)
+    if progress is None or progress['signature'] != signature:
+        progress = {'signature': signature, 'rows_done': 0, 'complete': False}
+    if progress['complete']:
+        print(f"{table}: already loaded, skipping")
+        return
+    if progress['rows_done']:
+        print(f"{table}: resuming after {progress['rows_done']} rows")
+
+    cursor = connection.cursor()
+    rows_done = progress['rows_done']
+    started = time.time()
+    loaded = 0
+    with open(csv_path, newline='') as f:
+        header = next(csv.reader([f.readline()]))
+        # Skip what an earlier run already committed; quoted fields may span lines
+        skip_records(f, rows_done)
+        reader = pd.read_csv(
+            f,
+            header=None,
+            names=header,
+            usecols=list(column_map),
+            dtype=str,
+            chunksize=CHUNK_SIZE,
+        )
+        for chunk in reader:
+            chunk = chunk[list(column_map)].astype(object).where(chunk.notna(), None)
+            if 'timestamp_utc' in chunk:
+                # timestamp_utc is DATETIME(6), which doesn't accept the ' UTC' suffix
+                chunk['timestamp_utc'] = chunk['timestamp_utc'].str.replace(' UTC', '')
+            store_dictionary.register(connection, chunk['store_id'])
+            upsert_rows(cursor, table, list(column_map.values()), update_columns,
+                        list(chunk.itertuples(index=False, name=None)))
+            bump_generation(cursor)
+            if table == 'store_status':
+                mark_store_generations(cursor, chunk['store_id'], fetch_generation(connection))
+            connection.commit()
+
+            rows_done += len(chunk)
+            loaded += len(chunk)
+            progress['rows_done'] = rows_done
+            checkpoint[csv_path] = progress
+            # Remember which rollup hours the new rows invalidate
+            if table == 'store_status':
+                chunk_min = chunk['timestamp_utc'].min()
+                checkpoint['rollup_since'] = min(checkpoint.get('rollup_since') or chunk_min, chunk_min)
+            else:
+                checkpoint['rollup_full'] = True
+            save_checkpoint(checkpoint)
+
+            elapsed = max(time.time() - started, 1e-9)
+            print(f"{table}: {rows_done} rows loaded ({loaded / elapsed:,.0f} rows/sec)")
+
+    progress['complete'] = True
+    checkpoint[csv_path] = progress
+    save_checkpoint(checkpoint)
+
+def bulk_insert_data(restart=False):
+    """
+    Loads the CSV files in chunks with batched upserts.
+
+    Progress is checkpointed after every committed chunk, so an interrupted
+    run picks up where it stopped. Pass restart=True to ignore the checkpoint.
+    """
+    checkpoint = {} if restart else load_checkpoint()
+    with get_connection() as connection:
+        for csv_path, table, column_map, update_columns in BULK_SOURCES:
+            bulk_insert_file(connection, csv_path, table, column_map, update_columns, checkpoint)
+
+        # Business hours or timezones may have changed
+        invalidate_schedules()
+        if checkpoint.pop('rollup_full', False):
+            refresh_rollups(connection)
+        elif checkpoint.get('rollup_since'):
+            refresh_rollups(connection, since=checkpoint['rollup_since'])
+    checkpoint.pop('rollup_since', None)
+    save_checkpoint(checkpoint)
     print("Data loaded successfully into MySQL!")
 
 # Run the function to insert data
 if __name__ == "__main__":
-    insert_data()
+    from app.storage import STORAGE_BACKEND, get_storage_backend
+    if STORAGE_BACKEND != 'mysql':
+        get_storage_backend().insert_data(restart="--restart" in sys.argv)
+    elif "--bulk" in sys.argv:
+        bulk_insert_data(restart="--restart" in sys.argv)
+    else:
+        insert_data()
 
-# Close connection
+# Close pooled connections
 def close_connection():
-    cursor.close()
-    connection.close()
\ No newline at end of file
+    close_pool()
\ No newline at end of file
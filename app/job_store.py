@@ -0,0 +1,148 @@
+"""
+Report job registry.
+
+MemoryJobStore keeps jobs in a dict of one process. SQLiteJobStore keeps them
+in a SQLite file in WAL mode, so every uvicorn worker on the host sees the
+same jobs and finished reports survive restarts.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from app.sqlite_db import SQLiteDatabase
+
+JOB_STORE = os.getenv('REPORT_JOB_STORE', 'sqlite')
+JOB_STORE_PATH = os.getenv('REPORT_JOB_STORE_PATH', os.path.join('reports', 'jobs.sqlite3'))
+
+ACTIVE_STATUSES = ("Queued", "Running")
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS report_jobs (
+        report_id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        owner INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_report_jobs_status ON report_jobs (status)",
+]
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot store {type(value).__name__} in the job store")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """Interface of the job registry; job records are plain dicts with at least a status."""
+
+    def create(self, report_id, **fields):
+        raise NotImplementedError
+
+    def get(self, report_id):
+        """Returns the job record, or None for an unknown report_id."""
+        raise NotImplementedError
+
+    def update(self, report_id, **fields):
+        """Merges fields into an existing record; unknown report_ids are ignored."""
+        raise NotImplementedError
+
+    def __contains__(self, report_id):
+        return self.get(report_id) is not None
+
+
+class MemoryJobStore(JobStore):
+    """Jobs in a dict, visible only to the current process."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, report_id, **fields):
+        with self._lock:
+            self._jobs[report_id] = dict(fields)
+
+    def get(self, report_id):
+        with self._lock:
+            job = self._jobs.get(report_id)
+            return dict(job) if job is not None else None
+
+    def update(self, report_id, **fields):
+        with self._lock:
+            if report_id in self._jobs:
+                self._jobs[report_id].update(fields)
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Jobs in a SQLite database in WAL mode, shared by all processes on the host.
+
+    Lookups are a primary-key read on a per-thread connection. Each record
+    also stores the pid of the process that owns the job, so a worker that
+    starts can fail the active jobs of workers that are gone.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = SQLiteDatabase(path, SCHEMA)
+
+    def create(self, report_id, **fields):
+        self._db.connection().execute(
+            "INSERT OR REPLACE INTO report_jobs (report_id, status, owner, data, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (report_id, fields.get('status', 'Queued'), os.getpid(),
+             json.dumps(fields, default=_json_default), time.time())
+        )
+
+    def get(self, report_id):
+        row = self._db.connection().execute(
+            "SELECT data FROM report_jobs WHERE report_id = ?", (report_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, report_id, **fields):
+        # Read-modify-write under the database write lock so concurrent updates don't get lost
+        with self._db.transaction() as conn:
+            row = conn.execute("SELECT data FROM report_jobs WHERE report_id = ?", (report_id,)).fetchone()
+            if row is not None:
+                data = json.loads(row[0])
+                data.update(fields)
+                conn.execute(
+                    "UPDATE report_jobs SET status = ?, data = ?, updated_at = ? WHERE report_id = ?",
+                    (data.get('status'), json.dumps(data, default=_json_default), time.time(), report_id)
+                )
+
+    def fail_orphaned_jobs(self):
+        """Marks queued or running jobs whose owning process has exited as failed."""
+        rows = self._db.connection().execute(
+            f"SELECT report_id, owner FROM report_jobs WHERE status IN ({', '.join('?' * len(ACTIVE_STATUSES))})",
+            ACTIVE_STATUSES
+        ).fetchall()
+        for report_id, owner in rows:
+            if not _pid_alive(owner):
+                self.update(report_id, status="Failed", error="Interrupted by a server restart")
+
+
+def create_job_store():
+    """Builds the job store selected by REPORT_JOB_STORE ('sqlite' or 'memory')."""
+    if JOB_STORE == 'memory':
+        return MemoryJobStore()
+    if JOB_STORE == 'sqlite':
+        store = SQLiteJobStore(JOB_STORE_PATH)
+        store.fail_orphaned_jobs()
+        return store
+    raise ValueError(f"Unknown job store: {JOB_STORE}")
@@ -0,0 +1,156 @@
+"""
+Report job execution off the event loop.
+
+Jobs run in a bounded thread pool; triggers beyond the pool size wait in its
+queue. Triggers made while a job over the same data snapshot is queued or
+running join that job instead of starting another full scan, and every
+report_id attached to it gets the same result and progress updates.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app.progress import ReportCancelled
+
+REPORT_CONCURRENCY = int(os.getenv('REPORT_CONCURRENCY', 2))
+
+
+class ReportJob:
+    """One report computation shared by all report_ids triggered on the same snapshot."""
+
+    def __init__(self, snapshot, options):
+        self.snapshot = snapshot
+        self.options = options
+        self.report_ids = []
+        self.state = "Queued"
+        self.cancelled = False
+        self.future = None
+
+
+class ReportExecutor:
+    """
+    Runs report jobs in a bounded worker pool.
+
+    run(report_id, snapshot, options, progress, cancelled) computes and saves
+    a report and returns the fields of its finished status, including
+    file_path; options are the report options, which must be part of the
+    snapshot, progress(**fields) adds fields to the status of every report_id
+    attached to the job while it runs, and run should check cancelled()
+    between batches and raise ReportCancelled once it is true.
+    update_status(report_id, **fields) records status changes, and
+    is_cancelled(report_id), if given, tells whether a report_id was
+    cancelled outside this executor, such as by another worker.
+    """
+
+    def __init__(self, run, update_status, max_workers=None, is_cancelled=None):
+        self._run = run
+        self._update_status = update_status
+        self._is_cancelled = is_cancelled
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or REPORT_CONCURRENCY)
+        self._lock = threading.Lock()
+        # snapshot -> queued or running job
+        self._active = {}
+        # report_id -> job
+        self._jobs = {}
+
+    def submit(self, report_id, snapshot, options=None):
+        """Attaches report_id to the job for snapshot, starting one if none is queued or running."""
+        with self._lock:
+            job = self._active.get(snapshot)
+            if job is None:
+                job = ReportJob(snapshot, options or {})
+                self._active[snapshot] = job
+                job.future = self._pool.submit(self._execute, job)
+            job.report_ids.append(report_id)
+            self._jobs[report_id] = job
+            state = job.state
+        self._update_status(report_id, status=state)
+        return job
+
+    def cancel(self, report_id):
+        """
+        Detaches report_id from its job. Returns False if it already finished.
+
+        A job left without report_ids is dropped from the queue, or stops at
+        its next batch if it is already running.
+        """
+        with self._lock:
+            job = self._jobs.pop(report_id, None)
+            if job is None or report_id not in job.report_ids:
+                return False
+            job.report_ids.remove(report_id)
+            if not job.report_ids:
+                job.cancelled = True
+                job.future.cancel()
+                self._active.pop(job.snapshot, None)
+        self._update_status(report_id, status="Cancelled")
+        return True
+
+    def _finish(self, job):
+        """Removes a finished job and returns the report_ids it still serves."""
+        with self._lock:
+            if self._active.get(job.snapshot) is job:
+                del self._active[job.snapshot]
+            for report_id in job.report_ids:
+                self._jobs.pop(report_id, None)
+            return list(job.report_ids)
+
+    def _cancelled(self, job):
+        """Whether job should stop: cancelled here, or all its report_ids cancelled elsewhere."""
+        with self._lock:
+            if job.cancelled:
+                return True
+            report_ids = list(job.report_ids)
+        if self._is_cancelled is None or not all(self._is_cancelled(report_id) for report_id in report_ids):
+            return False
+        with self._lock:
+            job.cancelled = True
+            if self._active.get(job.snapshot) is job:
+                del self._active[job.snapshot]
+        return True
+
+    def _progress(self, job, fields):
+        with self._lock:
+            if job.cancelled:
+                return
+            report_ids = list(job.report_ids)
+        for report_id in report_ids:
+            self._update_status(report_id, **fields)
+
+    def _execute(self, job):
+        with self._lock:
+            if job.cancelled:
+                return
+            job.state = "Running"
+            report_ids = list(job.report_ids)
+        for report_id in report_ids:
+            self._update_status(report_id, status="Running")
+
+        try:
+            result = self._run(report_ids[0], job.snapshot, job.options,
+                               lambda **fields: self._progress(job, fields),
+                               lambda: self._cancelled(job))
+        except ReportCancelled:
+            job.state = "Cancelled"
+            # Only report_ids cancelled by another worker are left
+            for report_id in self._finish(job):
+                self._update_status(report_id, status="Cancelled")
+            return
+        except Exception as e:
+            job.state = "Failed"
+            for report_id in self._finish(job):
+                self._update_status(report_id, status="Failed", error=str(e))
+            return
+
+        report_ids = self._finish(job)
+        # Cancelled after its last batch: the file stays in the report store,
+        # which may share it with other reports and evicts it like any other
+        if job.cancelled:
+            job.state = "Cancelled"
+            return
+        job.state = "Complete"
+        for report_id in report_ids:
+            self._update_status(report_id, status="Complete", **result)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
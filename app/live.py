@@ -0,0 +1,301 @@
+"""
+Report state kept in memory and updated by streamed polls.
+
+LiveState holds the business-hours polls of the report window for every
+store, with each store's newest poll. Polls posted to /status are written
+to storage and folded into the state by the same call, so the 'live' report
+engine works from running totals instead of fetching, parsing and filtering
+the whole window again.
+
+Polls sit in an append-only log. Each entry links to the store's next poll
+in time and carries the store's running uptime/downtime up to it, so a
+window is the totals at its first and last poll plus the two edges, as in
+TimelineIndex. Per store the state keeps its last entry and, for every
+window, a pointer to its first poll inside the window; a report moves the
+pointers forward past the polls the windows slid over. A poll newer than
+its store's last one is appended with the running totals carried on; a late
+or repeated one rebuilds only its store's entries. The log drops the polls
+before the report window once it has doubled.
+
+The state is per process. It trusts itself only while the ingest generation
+moved by exactly its own writes; anything else (a bulk load, another worker
+streaming polls) makes the next report reload it from storage.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from app.engine import WINDOWS, business_hours_polls, factorize_stores, to_minutes
+from app.fetch import FETCH_LOOKBACK, REPORT_WINDOW, report_window
+from app.storage import get_storage_backend
+from app.timeline import us
+
+_state = None
+_state_lock = threading.Lock()
+
+# How far back each pointer's window starts: the report windows, then the
+# fetch window, whose polls decide whether a store without polls in a
+# window counts as down for all of it
+POINTER_SPANS = [us(delta) for _, delta in WINDOWS] + [us(REPORT_WINDOW + FETCH_LOOKBACK)]
+NO_POLL = np.iinfo(np.int64).min
+
+
+def _group_starts(codes):
+    starts = np.ones(len(codes), dtype=bool)
+    starts[1:] = codes[1:] != codes[:-1]
+    return starts
+
+
+def _renumber(entries, positions):
+    """Entries moved to their positions; -1 stays -1."""
+    return np.where(entries >= 0, positions[np.maximum(entries, 0)], -1)
+
+
+class LiveState:
+    """Business-hours polls of the report window, in memory, for one storage backend."""
+
+    def __init__(self, storage=None):
+        self.storage = storage or get_storage_backend()
+        self._lock = threading.Lock()
+        # Generation the state matches; None until loaded or after a foreign write
+        self.generation = None
+
+    def _reset(self):
+        self._codes = {}
+        self._store_ids = []
+        self.latest_us = None
+        # Per store: newest poll of any kind, last log entry, first entry in each pointer's window
+        self._last_poll_us = np.empty(0, dtype=np.int64)
+        self._tail = np.empty(0, dtype=np.int64)
+        self._pointers = np.empty((len(POINTER_SPANS), 0), dtype=np.int64)
+        # The log; entries of dropped or rebuilt stores stay until the next compaction, not alive
+        self._size = 0
+        self._compacted_size = 0
+        self._log = {
+            'code': np.empty(0, dtype=np.int64),
+            'ts_us': np.empty(0, dtype=np.int64),
+            'active': np.empty(0, dtype=bool),
+            'cum_up': np.empty(0, dtype=np.int64),
+            'cum_down': np.empty(0, dtype=np.int64),
+            'next': np.empty(0, dtype=np.int64),
+            'alive': np.empty(0, dtype=bool),
+        }
+
+    def _reload(self):
+        generation = self.storage.generation()
+        self._reset()
+        self.timezones, self.business_hours = self.storage.fetch_store_tables()
+        latest = self.storage.latest_timestamp()
+        if latest is not None:
+            self._add(self.storage.fetch_status(*report_window(latest)))
+        self.generation = generation
+
+    def _add(self, store_status):
+        """Folds polls into the state."""
+        if store_status.empty:
+            return
+        batch_codes, batch_ids = factorize_stores(store_status['store_id'])
+        new_ids = [store_id for store_id in batch_ids if store_id not in self._codes]
+        for store_id in new_ids:
+            self._codes[store_id] = len(self._store_ids)
+            self._store_ids.append(store_id)
+        self._last_poll_us = np.append(self._last_poll_us, np.full(len(new_ids), NO_POLL))
+        self._tail = np.append(self._tail, np.full(len(new_ids), -1))
+        self._pointers = np.hstack([self._pointers, np.full((len(POINTER_SPANS), len(new_ids)), -1)])
+
+        codes = np.array([self._codes[store_id] for store_id in batch_ids], dtype=np.int64)[batch_codes]
+        ts_us = store_status['timestamp_utc'].dt.tz_convert('UTC').dt.tz_localize(None) \
+            .to_numpy(dtype='datetime64[us]').astype(np.int64)
+        np.maximum.at(self._last_poll_us, codes, ts_us)
+        self.latest_us = int(ts_us.max()) if self.latest_us is None else max(self.latest_us, int(ts_us.max()))
+
+        ids, bh_codes, bh_ts_us, bh_active = business_hours_polls(
+            store_status, self.timezones, self.business_hours, int(ts_us.max())
+        )
+        state_codes = np.array([self._codes[store_id] for store_id in ids], dtype=np.int64)[bh_codes]
+        # lexsort is stable, so the later of two polls with the same key comes last
+        order = np.lexsort((bh_ts_us, state_codes))
+        codes, ts_us, active = state_codes[order], bh_ts_us[order], bh_active[order]
+
+        # A store whose polls don't all come after its last entry, each newer than the one before, is rebuilt
+        starts = _group_starts(codes)
+        previous = np.empty(len(ts_us), dtype=np.int64)
+        previous[1:] = ts_us[:-1]
+        previous[starts] = self._tail_values('ts_us', codes[starts], NO_POLL)
+        late = np.zeros(len(self._store_ids), dtype=bool)
+        late[codes[ts_us <= previous]] = True
+        rebuild = late[codes]
+        self._append(codes[~rebuild], ts_us[~rebuild], active[~rebuild])
+        if rebuild.any():
+            self._rebuild(np.flatnonzero(late), codes[rebuild], ts_us[rebuild], active[rebuild])
+
+    def _tail_values(self, name, codes, default):
+        """A log column at the stores' last entries; default for stores without one."""
+        tail = self._tail[codes]
+        values = np.full(len(codes), default, dtype=self._log[name].dtype)
+        values[tail >= 0] = self._log[name][tail[tail >= 0]]
+        return values
+
+    def _append(self, codes, ts_us, active):
+        """
+        Appends polls grouped by store, each newer than the one before and
+        than its store's last entry, carrying the running totals on.
+        """
+        n = len(codes)
+        if not n:
+            return
+        self._reserve(n)
+        log = self._log
+        entries = np.arange(self._size, self._size + n)
+        self._size += n
+
+        starts = _group_starts(codes)
+        first = np.flatnonzero(starts)
+        group_rows = np.diff(np.append(first, n))
+        stores = codes[first]
+        tail = self._tail[stores]
+        # Interval since the previous poll, counted towards this poll's status; none before a store's first
+        interval = np.zeros(n, dtype=np.int64)
+        interval[1:] = ts_us[1:] - ts_us[:-1]
+        interval[first] = np.where(tail >= 0, ts_us[first] - self._tail_values('ts_us', stores, 0), 0)
+        for name, part in (('cum_up', np.where(active, interval, 0)), ('cum_down', np.where(active, 0, interval))):
+            running = np.cumsum(part)
+            base = self._tail_values(name, stores, 0) - (running[first] - part[first])
+            log[name][entries] = running + np.repeat(base, group_rows)
+        log['code'][entries] = codes
+        log['ts_us'][entries] = ts_us
+        log['active'][entries] = active
+        log['alive'][entries] = True
+        last = first + group_rows - 1
+        log['next'][entries] = entries + 1
+        log['next'][entries[last]] = -1
+        log['next'][tail[tail >= 0]] = entries[first][tail >= 0]
+        self._tail[stores] = entries[last]
+
+        # A store without an entry in a window gets its first new poll inside it, if any
+        for pointers, span in zip(self._pointers, POINTER_SPANS):
+            inside = np.where(ts_us >= self.latest_us - span, np.arange(n), n)
+            position = np.minimum.reduceat(inside, first)
+            empty = pointers[stores] < 0
+            pointers[stores[empty]] = np.where(position <= last, entries[np.minimum(position, n - 1)], -1)[empty]
+
+    def _rebuild(self, stores, codes, ts_us, active):
+        """Replaces the entries of stores with their alive entries and the polls, merged and deduplicated."""
+        log = self._log
+        rebuilt = np.zeros(len(self._store_ids), dtype=bool)
+        rebuilt[stores] = True
+        old = np.flatnonzero(log['alive'][:self._size] & rebuilt[log['code'][:self._size]])
+        log['alive'][old] = False
+        codes = np.concatenate([log['code'][old], codes])
+        ts_us = np.concatenate([log['ts_us'][old], ts_us])
+        active = np.concatenate([log['active'][old], active])
+        order = np.lexsort((ts_us, codes))
+        codes, ts_us, active = codes[order], ts_us[order], active[order]
+        last = np.ones(len(codes), dtype=bool)
+        last[:-1] = (codes[1:] != codes[:-1]) | (ts_us[1:] != ts_us[:-1])
+        self._tail[stores] = -1
+        self._pointers[:, stores] = -1
+        self._append(codes[last], ts_us[last], active[last])
+
+    def _reserve(self, n):
+        capacity = len(self._log['code'])
+        if self._size + n <= capacity:
+            return
+        capacity = max(2 * capacity, self._size + n, 1024)
+        for name, values in self._log.items():
+            grown = np.empty(capacity, dtype=values.dtype)
+            grown[:self._size] = values[:self._size]
+            self._log[name] = grown
+
+    def _advance(self):
+        """Moves every pointer past the polls its window slid over."""
+        log = self._log
+        for pointers, span in zip(self._pointers, POINTER_SPANS):
+            start_us = self.latest_us - span
+            behind = np.flatnonzero(pointers >= 0)
+            behind = behind[log['ts_us'][pointers[behind]] < start_us]
+            while len(behind):
+                pointers[behind] = log['next'][pointers[behind]]
+                behind = behind[pointers[behind] >= 0]
+                behind = behind[log['ts_us'][pointers[behind]] < start_us]
+
+    def _compact(self):
+        """
+        Drops dead entries and those before the fetch window, keeping each
+        store's last for the running totals. What is left of a store is the
+        end of its list, so the links and pointers only need renumbering.
+        """
+        log = self._log
+        keep = log['alive'][:self._size] & (log['ts_us'][:self._size] >= self.latest_us - POINTER_SPANS[-1])
+        keep[self._tail[self._tail >= 0]] = True
+        positions = np.cumsum(keep) - 1
+        size = int(keep.sum())
+        for values in log.values():
+            values[:size] = values[:self._size][keep]
+        log['next'][:size] = _renumber(log['next'][:size], positions)
+        self._tail = _renumber(self._tail, positions)
+        self._pointers = _renumber(self._pointers, positions)
+        self._size = self._compacted_size = size
+
+    def ingest(self, store_status):
+        """Writes polls to storage and folds them into the state; returns the write's generation."""
+        with self._lock:
+            generation = self.storage.insert_status(store_status)
+            if self.generation is not None and generation == self.generation + 1:
+                self._add(store_status)
+                self.generation = generation
+            else:
+                self.generation = None
+            return generation
+
+    def report(self):
+        """The fixed report as of the newest poll, from the state."""
+        with self._lock:
+            if self.generation is None or self.storage.generation() != self.generation:
+                self._reload()
+            if self.latest_us is None:
+                raise ValueError("No store status data available")
+
+            self._advance()
+            if self._size > 2 * max(self._compacted_size, 1024):
+                self._compact()
+
+            # Stores with any poll in the fetch window, ordered by store_id like a fetch
+            end_us = self.latest_us
+            included = np.flatnonzero(self._last_poll_us >= end_us - POINTER_SPANS[-1])
+            store_ids = np.asarray(self._store_ids, dtype=object)[included].astype(str)
+            order = np.argsort(store_ids, kind='stable')
+            included, store_ids = included[order], store_ids[order]
+
+            log = self._log
+            last = self._tail[included]
+            has_polls = self._pointers[-1][included] >= 0
+            columns = {'store_id': store_ids}
+            for (label, _), pointers, span in zip(WINDOWS, self._pointers, POINTER_SPANS):
+                first = pointers[included]
+                found = first >= 0
+                first, tail = first[found], last[found]
+                head = log['ts_us'][first] - (end_us - span)
+                rest = end_us - log['ts_us'][tail]
+                first_active, last_active = log['active'][first], log['active'][tail]
+                uptime = np.zeros(len(included), dtype=np.int64)
+                downtime = np.zeros(len(included), dtype=np.int64)
+                uptime[found] = (np.where(first_active, head, 0) + log['cum_up'][tail] - log['cum_up'][first]
+                                 + np.where(last_active, rest, 0))
+                downtime[found] = (np.where(first_active, 0, head) + log['cum_down'][tail] - log['cum_down'][first]
+                                   + np.where(last_active, 0, rest))
+                downtime[~found & has_polls] = span
+                columns[f'uptime_{label}'] = to_minutes(uptime)
+                columns[f'downtime_{label}'] = to_minutes(downtime)
+        return pd.DataFrame(columns)
+
+
+def get_live_state():
+    """The process-wide state over the backend selected by STORAGE_BACKEND."""
+    global _state
+    if _state is None:
+        with _state_lock:
+            if _state is None:
+                _state = LiveState()
+    return _state
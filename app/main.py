@@ -2,57 +2,46 @@ import pytz
 import pandas as pd
 from datetime import datetime, timedelta, time
 import uuid
-import csv
-# Database connection setup
-import mysql.connector
+import os
+import logging
+from app.db import get_connection
+from app.engine import DEFAULT_TIMEZONE, METRIC_COLUMNS, compute_metrics, iter_metrics
+from app.live import get_live_state
+from app.fetch import report_window
+from app.metrics import count, log_event, stage
+from app.parallel import iter_metrics_parallel
+from app.progress import check_cancelled, finish_rows, start_stores
+from app.report_store import create_report_store
+from app.rollup import rollup_report
+from app.sinks import CSVSink, DataFrameSink, create_sink
+from app.snapshot import REPORT_SNAPSHOTS, get_snapshot_store
+from app.storage import MySQLBackend, get_storage_backend
+from app.timeline import timeline_report
 
-DEFAULT_TIMEZONE = 'America/Chicago'
-
-db = mysql.connector.connect(
-    host="localhost",
-    user="root",
-    password="1234",
-    database="store_monitoring"
-)
-
-def convert_timedelta_to_time(td):
-    """Convert timedelta to time object."""
-    seconds = td.total_seconds()
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    seconds = int(seconds % 60)
-    return time(hours, minutes, seconds)
+# 'vectorized' runs the columnar engine, 'legacy' the per-store loop below,
+# 'rollup' assembles the report from the store_status_hourly rollups and
+# 'streaming' runs the columnar engine over store chunks as they are fetched,
+# 'parallel' runs it on hash-partitioned store shards in REPORT_WORKERS processes,
+# 'live' reads the in-memory state kept current by POST /status
+REPORT_ENGINE = os.getenv('REPORT_ENGINE', 'vectorized')
+# Stores the legacy loop yields per batch of report rows
+LEGACY_BATCH_STORES = 100
 
 def fetch_data():
-    """Fetches store data from the database."""
-    cursor = db.cursor(dictionary=True)
-    
-    # Fetch store status data
-    cursor.execute("SELECT * FROM store_status limit 4000")
-    store_status = pd.DataFrame(cursor.fetchall())
-    if not store_status.empty:
-        store_status['timestamp_utc'] = pd.to_datetime(store_status['timestamp_utc'].str.replace(' UTC', ''))
-        store_status['timestamp_utc'] = store_status['timestamp_utc'].dt.tz_localize('UTC')
-    
-    # Fetch timezone data
-    cursor.execute("SELECT * FROM timezones")
-    timezones = pd.DataFrame(cursor.fetchall())
-    
-    # Fetch business hours
-    cursor.execute("SELECT * FROM business_hours")
-    business_hours = pd.DataFrame(cursor.fetchall())
-    
-    if not business_hours.empty:
-        business_hours['start_time_local'] = business_hours['start_time_local'].apply(convert_timedelta_to_time)
-        business_hours['end_time_local'] = business_hours['end_time_local'].apply(convert_timedelta_to_time)
-    
-    return store_status, timezones, business_hours
+    """Fetches store data from the storage backend."""
+    # Only the polls of the report window ending at the newest poll, with timezones and business hours
+    with stage('fetch'):
+        if REPORT_SNAPSHOTS:
+            # Mapped from the snapshot of the current data version, shared with the other workers
+            return get_snapshot_store().load()
+        return get_storage_backend().fetch_data()
 
 def get_store_timezone(store_id, timezones):
     """Get timezone for a store with default handling."""
     timezone_data = timezones[timezones['store_id'] == store_id]
     if timezone_data.empty:
-        print(f"No timezone found for store {store_id}. Using default: {DEFAULT_TIMEZONE}")
+        count('default_timezone_stores')
+        log_event('default_timezone', store_id=store_id, timezone=DEFAULT_TIMEZONE)
         return DEFAULT_TIMEZONE
     return timezone_data['timezone_str'].iloc[0]
 
@@ -70,7 +59,7 @@ def get_default_business_hours():
 def calculate_uptime_downtime(store_id, store_status, timezone, business_hours, current_time):
     """Calculates uptime and downtime for a given store."""
     if store_status.empty:
-        print(f"Warning: No status data found for store {store_id}")
+        log_event('no_status_data', level=logging.WARNING, store_id=store_id)
         return {
             'uptime_last_hour': 0,
             'uptime_last_day': 0,
@@ -87,7 +76,9 @@ def calculate_uptime_downtime(store_id, store_status, timezone, business_hours,
         tz = pytz.timezone(timezone)
         df.loc[:, 'timestamp_local'] = df['timestamp_utc'].dt.tz_convert(tz)
     except pytz.exceptions.UnknownTimeZoneError:
-        print(f"Warning: Invalid timezone {timezone} for store {store_id}. Using {DEFAULT_TIMEZONE}.")
+        count('invalid_timezone_stores')
+        log_event('invalid_timezone', level=logging.WARNING, store_id=store_id, timezone=timezone,
+                  fallback=DEFAULT_TIMEZONE)
         tz = pytz.timezone(DEFAULT_TIMEZONE)
         df.loc[:, 'timestamp_local'] = df['timestamp_utc'].dt.tz_convert(tz)
     
@@ -98,7 +89,8 @@ def calculate_uptime_downtime(store_id, store_status, timezone, business_hours,
     # Use default business hours if none are provided
     if business_hours.empty:
         business_hours = get_default_business_hours()
-        print(f"Using default business hours for store {store_id}")
+        count('default_business_hours_stores')
+        log_event('default_business_hours', store_id=store_id)
     
     # Filter by business hours
     filtered_status = filter_business_hours(df, business_hours)
@@ -175,94 +167,185 @@ def calculate_time(filtered_status, start_time, end_time):
     
     return round(uptime / 60, 2), round(downtime / 60, 2)  # Return minutes
 
-def generate_report():
-    """Processes all stores and generates a report."""
-    store_status, timezones, business_hours = fetch_data()
-    
-    if store_status.empty:
-        raise ValueError("No store status data available")
-        
-    current_time = store_status['timestamp_utc'].max()
-    report_id = str(uuid.uuid4())
-    results = []
+def iter_report_legacy(store_status, timezones, business_hours, current_time):
+    """Processes stores one at a time with calculate_uptime_downtime, yielding LEGACY_BATCH_STORES at a time."""
+    store_ids = store_status['store_id'].unique()
+    start_stores(len(store_ids))
 
-    # Print some debug information
-    print(f"Total number of stores in status data: {len(store_status['store_id'].unique())}")
-    print(f"Total number of stores in timezone data: {len(timezones['store_id'].unique())}")
-    print(f"Total number of stores in business hours data: {len(business_hours['store_id'].unique())}")
+    for start in range(0, len(store_ids), LEGACY_BATCH_STORES):
+        results = []
+        with stage('compute'):
+            for store_id in store_ids[start:start + LEGACY_BATCH_STORES]:
+                store_timezone = get_store_timezone(store_id, timezones)
+                store_hours = business_hours[business_hours['store_id'] == store_id]
+                store_data = store_status[store_status['store_id'] == store_id]
 
-    for store_id in store_status['store_id'].unique():
-        store_timezone = get_store_timezone(store_id, timezones)
-        store_hours = business_hours[business_hours['store_id'] == store_id]
-        store_data = store_status[store_status['store_id'] == store_id]
-        
-        try:
-            metrics = calculate_uptime_downtime(store_id, store_data, store_timezone, store_hours, current_time)
-            results.append({"store_id": store_id, **metrics})
-        except Exception as e:
-            print(f"Error processing store {store_id}: {str(e)}")
-            # Add default values for this store
-            results.append({
-                "store_id": store_id,
-                "uptime_last_hour": 0,
-                "uptime_last_day": 0,
-                "uptime_last_week": 0,
-                "downtime_last_hour": 0,
-                "downtime_last_day": 0,
-                "downtime_last_week": 0
-            })
-    
-    # Save to CSV
-    csv_filename = f"report_{report_id}.csv"
-    with open(csv_filename, 'w', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=results[0].keys())
-        writer.writeheader()
-        writer.writerows(results)
-    
-    return report_id, csv_filename
+                try:
+                    metrics = calculate_uptime_downtime(store_id, store_data, store_timezone, store_hours, current_time)
+                    results.append({"store_id": store_id, **metrics})
+                except Exception as e:
+                    count('failed_stores')
+                    log_event('store_failed', level=logging.ERROR, store_id=store_id, error=repr(str(e)))
+                    # Add default values for this store
+                    results.append({
+                        "store_id": store_id,
+                        "uptime_last_hour": 0,
+                        "uptime_last_day": 0,
+                        "uptime_last_week": 0,
+                        "downtime_last_hour": 0,
+                        "downtime_last_day": 0,
+                        "downtime_last_week": 0
+                    })
+        # Same columns and types in every batch, whichever stores failed
+        yield pd.DataFrame(results, columns=['store_id'] + METRIC_COLUMNS).astype(
+            {column: float for column in METRIC_COLUMNS})
+
+def iter_report_fixed(store_status, timezones, business_hours, current_time, engine=None):
+    """Yields the report rows of the fixed columns from the selected engine."""
+    engine = engine or REPORT_ENGINE
+    if engine == 'legacy':
+        count('polls', len(store_status))
+        count('stores', store_status['store_id'].nunique())
+        yield from iter_report_legacy(store_status, timezones, business_hours, current_time)
+    elif engine == 'vectorized':
+        start_stores(store_status['store_id'].nunique())
+        # A chunk of stores at a time; times its schedule and compute stages itself
+        yield from iter_metrics(store_status, timezones, business_hours, current_time)
+    elif engine == 'parallel':
+        yield from iter_metrics_parallel(store_status, timezones, business_hours, current_time)
+    else:
+        raise ValueError(f"Unknown report engine: {engine}")
+
+def iter_report_streaming():
+    """Yields the report chunk by chunk, holding only one chunk of polls at a time."""
+    storage = get_storage_backend()
+    with stage('fetch'):
+        latest = storage.latest_timestamp()
+        if latest is None:
+            raise ValueError("No store status data available")
+        timezones, business_hours = storage.fetch_store_tables()
+        # Only counted for the progress; the chunks don't know the total
+        start_stores(storage.count_stores(*report_window(latest)))
+    current_time = pytz.utc.localize(latest)
+
+    chunks = storage.iter_store_chunks(*report_window(latest))
+    while True:
+        with stage('fetch'):
+            chunk = next(chunks, None)
+        if chunk is None:
+            break
+        yield compute_metrics(chunk, timezones, business_hours, current_time)
+
+def iter_report(engine=None, windows=None, bucket=None, as_of=None):
+    """
+    Yields the report rows of all stores, one DataFrame per batch of stores.
+
+    windows, bucket and as_of replace the six fixed columns with custom
+    windows, a bucket series or historical anchors (see timeline_report);
+    those reports always come from the timeline index, whatever the engine.
+    The rollup and live engines and timeline reports compute every store at
+    once and yield a single batch.
+    """
+    if windows or bucket or as_of:
+        report = timeline_report(get_storage_backend(), windows, bucket, as_of)
+        # Timeline reports with anchors have a row per store and anchor
+        start_stores(report['store_id'].nunique())
+        yield report
+        return
+    engine = engine or REPORT_ENGINE
+    if engine == 'rollup':
+        # The rollup table only exists in MySQL
+        if not isinstance(get_storage_backend(), MySQLBackend):
+            raise ValueError("The rollup engine needs the mysql storage backend")
+        # Reads rollups and the partial edge hours instead of every poll
+        with stage('rollup'), get_connection() as db:
+            report = rollup_report(db)
+        start_stores(len(report))
+        yield report
+        return
+    if engine == 'streaming':
+        yield from iter_report_streaming()
+        return
+    if engine == 'live':
+        # Only polls streamed since the last report are merged in
+        with stage('compute'):
+            report = get_live_state().report()
+        start_stores(len(report))
+        yield report
+        return
 
-def generate_report_df():
-    """Processes all stores and generates a report as a DataFrame."""
     store_status, timezones, business_hours = fetch_data()
-    
+
     if store_status.empty:
         raise ValueError("No store status data available")
-        
+
     current_time = store_status['timestamp_utc'].max()
-    results = []
 
-    # Print some debug information
-    print(f"Total number of stores in status data: {len(store_status['store_id'].unique())}")
-    print(f"Total number of stores in timezone data: {len(timezones['store_id'].unique())}")
-    print(f"Total number of stores in business hours data: {len(business_hours['store_id'].unique())}")
+    log_event(
+        'report_input',
+        status_stores=store_status['store_id'].nunique(),
+        timezone_stores=timezones['store_id'].nunique() if not timezones.empty else 0,
+        business_hours_stores=business_hours['store_id'].nunique() if not business_hours.empty else 0,
+    )
 
-    for store_id in store_status['store_id'].unique():
-        store_timezone = get_store_timezone(store_id, timezones)
-        store_hours = business_hours[business_hours['store_id'] == store_id]
-        store_data = store_status[store_status['store_id'] == store_id]
-        
-        try:
-            metrics = calculate_uptime_downtime(store_id, store_data, store_timezone, store_hours, current_time)
-            results.append({"store_id": store_id, **metrics})
-        except Exception as e:
-            print(f"Error processing store {store_id}: {str(e)}")
-            # Add default values for this store
-            results.append({
-                "store_id": store_id,
-                "uptime_last_hour": 0,
-                "uptime_last_day": 0,
-                "uptime_last_week": 0,
-                "downtime_last_hour": 0,
-                "downtime_last_day": 0,
-                "downtime_last_week": 0
-            })
-    
-    return pd.DataFrame(results)
+    yield from iter_report_fixed(store_status, timezones, business_hours, current_time, engine)
+
+def run_report(sinks, batches=None, **options):
+    """
+    Writes every batch of report rows to each of sinks as it is computed and
+    returns what the sinks made, in order (see app.sinks).
+
+    batches defaults to iter_report(**options). Each row is written once per
+    sink, and only the batch being written is held, so file sinks run in
+    memory that doesn't grow with the number of stores. A cancelled job
+    raises ReportCancelled before the next batch is computed.
+    """
+    if batches is None:
+        batches = iter_report(**options)
+    try:
+        for rows in batches:
+            with stage('write'):
+                for sink in sinks:
+                    sink.write(rows)
+            finish_rows(rows)
+            check_cancelled()
+    finally:
+        # Lets an engine stopped early release what it holds, such as queued shards
+        if hasattr(batches, 'close'):
+            batches.close()
+        results = [sink.close() for sink in sinks]
+    return results
+
+def generate_report_df(engine=None, windows=None, bucket=None, as_of=None):
+    """Processes all stores and generates a report as a DataFrame (see iter_report)."""
+    return run_report([DataFrameSink()], engine=engine, windows=windows, bucket=bucket, as_of=as_of)[0]
+
+def generate_report(engine=None, output_format='csv'):
+    """
+    Processes all stores and writes the report to the reports directory.
+
+    A CSV report is saved to the report store, under its size and age
+    limits; 'csv.gz' and 'parquet' reports are written next to it.
+    """
+    report_id = str(uuid.uuid4())
+    store = create_report_store()
+    if output_format != 'csv':
+        path = os.path.join(store.directory, f"report_{report_id}.{output_format}")
+        return report_id, run_report([create_sink(output_format, path)], engine=engine)[0]
+
+    partial_path = os.path.join(store.directory, f"report_{report_id}.partial.csv")
+    try:
+        run_report([CSVSink(partial_path)], engine=engine)
+        csv_filename = store.add(partial_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return report_id, csv_filename
 
 
 if __name__ == "__main__":
     try:
-        report_id, csv_file = generate_report()
+        report_id, csv_file = generate_report(output_format=os.getenv('REPORT_FORMAT', 'csv'))
         print(f"Report generated successfully!")
         print(f"Report ID: {report_id}")
         print(f"File: {csv_file}")
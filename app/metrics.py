@@ -0,0 +1,192 @@
+"""
+Report instrumentation: stage timings, counters and rate-limited logging.
+
+stage() and count() record into the process-wide registry rendered by
+/metrics, and into the ReportProfile of the report being computed in the
+current context, which ends up in the job status. Stages nest: 'parse' time
+is also part of the 'fetch' stage it happens in.
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+# At most LOG_RATE_LIMIT messages per event every LOG_RATE_INTERVAL seconds
+LOG_RATE_LIMIT = int(os.getenv('LOG_RATE_LIMIT', 10))
+LOG_RATE_INTERVAL = float(os.getenv('LOG_RATE_INTERVAL', 60))
+
+METRIC_PREFIX = 'store_monitoring'
+
+logger = logging.getLogger('store_monitoring')
+if not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+_current_profile = contextvars.ContextVar('report_profile', default=None)
+
+
+class ReportProfile:
+    """Stage timings and counters of one report computation."""
+
+    def __init__(self):
+        self.stages = defaultdict(float)
+        self.counters = defaultdict(int)
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] += seconds
+
+    def add_count(self, name, value):
+        with self._lock:
+            self.counters[name] += value
+
+    @contextmanager
+    def activate(self):
+        """Makes stage() and count() in this context record into the profile."""
+        token = _current_profile.set(self)
+        try:
+            yield self
+        finally:
+            _current_profile.reset(token)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'total_seconds': round(time.perf_counter() - self._started, 4),
+                'stages': {name: round(seconds, 4) for name, seconds in self.stages.items()},
+                'counters': dict(self.counters),
+            }
+
+
+class MetricsRegistry:
+    """Process-wide stage summaries and counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stage_seconds = defaultdict(float)
+        self.stage_count = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.jobs = defaultdict(int)
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stage_seconds[name] += seconds
+            self.stage_count[name] += 1
+
+    def add_count(self, name, value):
+        with self._lock:
+            self.counters[name] += value
+
+    def add_job(self, status):
+        with self._lock:
+            self.jobs[status] += 1
+
+    def render(self, gauges=None):
+        """The registry in the Prometheus text exposition format."""
+        with self._lock:
+            stage_seconds = dict(self.stage_seconds)
+            stage_count = dict(self.stage_count)
+            counters = dict(self.counters)
+            jobs = dict(self.jobs)
+
+        lines = [
+            f"# HELP {METRIC_PREFIX}_report_stage_seconds Time spent in report stages",
+            f"# TYPE {METRIC_PREFIX}_report_stage_seconds summary",
+        ]
+        for name in sorted(stage_seconds):
+            lines.append(f'{METRIC_PREFIX}_report_stage_seconds_sum{{stage="{name}"}} {stage_seconds[name]:.6f}')
+            lines.append(f'{METRIC_PREFIX}_report_stage_seconds_count{{stage="{name}"}} {stage_count[name]}')
+
+        lines += [
+            f"# HELP {METRIC_PREFIX}_report_jobs_total Finished report jobs by status",
+            f"# TYPE {METRIC_PREFIX}_report_jobs_total counter",
+        ]
+        for status in sorted(jobs):
+            lines.append(f'{METRIC_PREFIX}_report_jobs_total{{status="{status}"}} {jobs[status]}')
+
+        for name in sorted(counters):
+            metric = f"{METRIC_PREFIX}_report_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {counters[name]}"]
+
+        for name, value in sorted((gauges or {}).items()):
+            metric = f"{METRIC_PREFIX}_{name}"
+            lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+@contextmanager
+def stage(name):
+    """Times a block as report stage name."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        registry.add_stage(name, seconds)
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.add_stage(name, seconds)
+
+
+def count(name, value=1):
+    """Adds value to counter name, e.g. 'polls' or 'default_timezone_stores'."""
+    value = int(value)
+    if not value:
+        return
+    registry.add_count(name, value)
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.add_count(name, value)
+
+
+class _RateLimiter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # event -> [window start, emitted, suppressed]
+        self._events = {}
+
+    def allow(self, event):
+        """Returns (allowed, messages suppressed since the last allowed one)."""
+        now = time.monotonic()
+        with self._lock:
+            state = self._events.get(event)
+            if state is None or now - state[0] >= LOG_RATE_INTERVAL:
+                suppressed = state[2] if state else 0
+                self._events[event] = [now, 1, 0]
+                return True, suppressed
+            if state[1] < LOG_RATE_LIMIT:
+                state[1] += 1
+                return True, 0
+            state[2] += 1
+            return False, 0
+
+
+_rate_limiter = _RateLimiter()
+
+
+def log_event(event, level=logging.INFO, **fields):
+    """
+    Logs 'event key=value ...', at most LOG_RATE_LIMIT times per event and
+    interval; the next message after a quiet period reports how many were
+    dropped.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    allowed, suppressed = _rate_limiter.allow(event)
+    if not allowed:
+        return
+    if suppressed:
+        fields['suppressed'] = suppressed
+    logger.log(level, " ".join([event] + [f"{key}={value}" for key, value in fields.items()]))
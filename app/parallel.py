@@ -0,0 +1,141 @@
+"""
+Sharded report generation across processes.
+
+Stores are split into shards by a hash of their store_id and every shard is
+computed by compute_metrics in a worker process. The workers belong to one
+pool per process, started on first use and kept for later reports.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+from app.engine import METRIC_COLUMNS, compute_metrics, factorize_stores
+from app.metrics import count, log_event, stage
+from app.progress import start_stores
+
+REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', os.cpu_count() or 1))
+# Workers never fork the API process, whose other threads may hold locks:
+# forkserver forks them from a single-threaded server, spawn starts them fresh
+REPORT_POOL_START_METHOD = os.getenv(
+    'REPORT_POOL_START_METHOD', 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def get_process_pool(workers):
+    """
+    Returns the process-wide worker pool, starting it on first use. A report
+    that wants more workers than the pool has replaces it; reports still
+    running on the old pool finish there.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers < workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context(REPORT_POOL_START_METHOD)
+            )
+            _pool_workers = workers
+        return _pool
+
+
+def discard_process_pool(pool):
+    """Drops a pool whose worker died, so the next report starts a new one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def shutdown_process_pool():
+    """Stops the worker pool, waiting for running shards; called on app shutdown."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def shard_of(store_ids, shards):
+    """Stable shard number for every store_id, the same in every process."""
+    if isinstance(store_ids.dtype, pd.CategoricalDtype):
+        # Hash each store once and look the shards up by code
+        shards_by_code = pd.util.hash_array(np.asarray(store_ids.cat.categories, dtype=object)) % shards
+        return shards_by_code[store_ids.array.codes]
+    return pd.util.hash_array(np.asarray(store_ids, dtype=object)) % shards
+
+
+def zero_rows(store_ids):
+    """Report rows with all metrics at 0, used for stores whose shard failed."""
+    report = pd.DataFrame({'store_id': store_ids})
+    for column in METRIC_COLUMNS:
+        report[column] = 0.0
+    return report
+
+
+def iter_metrics_parallel(store_status, timezones, business_hours, current_time, workers=None):
+    """
+    Calculates the report with one shard of stores per worker process,
+    yielding the rows of every shard in shard order as the workers finish.
+
+    The rows and columns are those of compute_metrics, with the stores
+    grouped by shard. If a shard fails, its stores get zero rows, like a
+    failing store in the per-store loop.
+    """
+    workers = workers or REPORT_WORKERS
+    store_ids = factorize_stores(store_status['store_id'])[1]
+    start_stores(len(store_ids))
+    if workers <= 1 or len(store_ids) < workers:
+        yield compute_metrics(store_status, timezones, business_hours, current_time)
+        return
+
+    # Shards run in other processes, so their stages and fallbacks aren't broken down here
+    count('polls', len(store_status))
+    count('stores', len(store_ids))
+    poll_shard = shard_of(store_status['store_id'], workers)
+    shards = []
+    for shard in range(workers):
+        shard_status = store_status[poll_shard == shard]
+        shard_stores = factorize_stores(shard_status['store_id'])[1]
+        shard_timezones, shard_hours = timezones, business_hours
+        if not timezones.empty:
+            shard_timezones = timezones[timezones['store_id'].isin(shard_stores)]
+        if not business_hours.empty:
+            shard_hours = business_hours[business_hours['store_id'].isin(shard_stores)]
+        shards.append((shard_stores, shard_status, shard_timezones, shard_hours))
+
+    pool = get_process_pool(workers)
+    futures = [
+        (shard, shard_stores, pool.submit(compute_metrics, shard_status, shard_timezones, shard_hours, current_time))
+        for shard, (shard_stores, shard_status, shard_timezones, shard_hours) in enumerate(shards)
+        if len(shard_stores)
+    ]
+    try:
+        for shard, shard_stores, future in futures:
+            # Only the wait is compute; the caller writes the shard between two waits
+            with stage('compute'):
+                try:
+                    report = future.result()
+                except Exception as e:
+                    if isinstance(e, BrokenProcessPool):
+                        discard_process_pool(pool)
+                    count('failed_stores', len(shard_stores))
+                    log_event('shard_failed', level=logging.ERROR, shard=shard, stores=len(shard_stores),
+                              error=repr(str(e)))
+                    report = zero_rows(shard_stores)
+            yield report
+    finally:
+        # A report that stops early leaves the pool to the next one
+        for _, _, future in futures:
+            future.cancel()
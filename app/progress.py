@@ -0,0 +1,121 @@
+"""
+Per-store progress of the report being computed.
+
+Engines call start_stores() once they know how many stores the report has,
+and run_report() calls finish_rows() with every batch of rows it writes.
+Both record into the ReportProgress active in the current context, like
+stage() records into the ReportProfile, and do nothing outside a report job.
+The progress passes stores done, total and ETA to the job status at most
+every REPORT_PROGRESS_INTERVAL seconds.
+
+A cancelled job stops at the next check_cancelled(): when the engine knows
+its stores and after every batch run_report() writes.
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+REPORT_PROGRESS_INTERVAL = float(os.getenv('REPORT_PROGRESS_INTERVAL', 1))
+
+_current_progress = contextvars.ContextVar('report_progress', default=None)
+
+
+class ReportCancelled(Exception):
+    """Raised inside a report whose job was cancelled, to stop it between two batches."""
+
+
+class ReportProgress:
+    """
+    Stores done of one report computation.
+
+    on_update(progress) receives as_dict() as it changes; cancelled() tells
+    whether the job was cancelled.
+    """
+
+    def __init__(self, on_update=None, interval=None, cancelled=None):
+        self.on_update = on_update
+        self.cancelled = cancelled
+        self.interval = REPORT_PROGRESS_INTERVAL if interval is None else interval
+        self.stores_total = None
+        self.stores_done = 0
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._last_update = None
+
+    def start(self, stores):
+        with self._lock:
+            self.stores_total = int(stores)
+        self._update(force=True)
+        self.check_cancelled()
+
+    def add(self, rows):
+        with self._lock:
+            # Timeline reports with anchors have a row per store and anchor
+            self.stores_done += rows['store_id'].nunique()
+        self._update()
+
+    def check_cancelled(self):
+        if self.cancelled is not None and self.cancelled():
+            raise ReportCancelled()
+
+    def _update(self, force=False):
+        if self.on_update is None:
+            return
+        now = time.monotonic()
+        if not force and self._last_update is not None and now - self._last_update < self.interval:
+            return
+        self._last_update = now
+        self.on_update(self.as_dict())
+
+    @contextmanager
+    def activate(self):
+        """Makes start_stores(), finish_rows() and check_cancelled() in this context use the progress."""
+        token = _current_progress.set(self)
+        try:
+            yield self
+        finally:
+            _current_progress.reset(token)
+
+    def close(self):
+        """Passes on the final counts."""
+        self._update(force=True)
+
+    def as_dict(self):
+        with self._lock:
+            done, total = self.stores_done, self.stores_total
+        elapsed = time.monotonic() - self._started
+        eta = None
+        if total is not None and done:
+            # At the average rate so far, which includes the fetch
+            eta = round(elapsed / done * max(total - done, 0), 1)
+        return {
+            'stores_done': done,
+            'stores_total': total,
+            'percent': round(100 * done / total, 1) if total else None,
+            'elapsed_seconds': round(elapsed, 1),
+            'eta_seconds': eta,
+        }
+
+
+def start_stores(stores):
+    """Sets the number of stores the current report computes."""
+    progress = _current_progress.get()
+    if progress is not None:
+        progress.start(stores)
+
+
+def finish_rows(rows):
+    """Records the report rows of stores that are finished."""
+    progress = _current_progress.get()
+    if progress is not None:
+        progress.add(rows)
+
+
+
+def check_cancelled():
+    """Raises ReportCancelled if the job of the current report was cancelled."""
+    progress = _current_progress.get()
+    if progress is not None:
+        progress.check_cancelled()
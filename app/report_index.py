@@ -0,0 +1,256 @@
+"""
+Indexed, columnar copies of finished reports.
+
+Next to every report CSV a directory of .npy files holds each report
+column with its sort permutation and its values in sorted order, and a
+manifest lists the columns. Queries memory-map these files, resolve filters with binary searches
+on the sorted values and slice pages out of the sort permutation, so a page
+never reads or parses the CSV.
+"""
+import base64
+import csv
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COLUMNS_SUFFIX = '.columns'
+MANIFEST = 'columns.json'
+# Open report indexes kept per process
+REPORT_INDEX_CACHE_SIZE = int(os.getenv('REPORT_INDEX_CACHE_SIZE', 8))
+MAX_PAGE_SIZE = 1000
+
+FILTER_PATTERN = re.compile(r'^\s*(\w+)\s*(>=|<=|!=|>|<|=)\s*(-?[0-9.]+)\s*$')
+
+# Content-Encoding -> suffix of the precompressed download
+COMPRESSED_SUFFIXES = {'zstd': '.zst', 'gzip': '.gz'}
+
+_open_indexes = OrderedDict()
+_open_indexes_lock = threading.Lock()
+
+
+def columns_path(file_path):
+    return os.path.splitext(file_path)[0] + COLUMNS_SUFFIX
+
+
+def write_report_columns(file_path, source=None):
+    """
+    Writes the columnar copy of the report CSV at file_path, reading it from
+    source, a CSV with the same content, when given. The CSV is read one
+    column at a time, so only one column of the report is held.
+    """
+    source = source or file_path
+    target = columns_path(file_path)
+    tmp = target + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    with open(source, newline='') as f:
+        columns = next(csv.reader(f), [])
+    # Metrics are numbers; store_id and the timestamps of series reports are
+    # kept as text, which sorts the ISO timestamps in time order
+    numeric = []
+    for position, column in enumerate(columns):
+        series = pd.read_csv(source, usecols=[position], dtype=str if column == 'store_id' else None).iloc[:, 0]
+        if column != 'store_id' and pd.api.types.is_numeric_dtype(series):
+            values = series.to_numpy(dtype=np.float64)
+            numeric.append(column)
+        else:
+            values = np.asarray(series.astype(str), dtype=str)
+        order = np.argsort(values, kind='stable')
+        np.save(os.path.join(tmp, f'{position}.npy'), values)
+        np.save(os.path.join(tmp, f'order_{position}.npy'), order)
+        np.save(os.path.join(tmp, f'sorted_{position}.npy'), values[order])
+    with open(os.path.join(tmp, MANIFEST), 'w') as f:
+        json.dump({'columns': columns, 'numeric': numeric}, f)
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp, target)
+
+
+def remove_report_files(file_path):
+    """Deletes a report CSV with its columnar copy and compressed downloads."""
+    with _open_indexes_lock:
+        _open_indexes.pop(file_path, None)
+    for path in [file_path] + [file_path + suffix for suffix in COMPRESSED_SUFFIXES.values()]:
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(columns_path(file_path), ignore_errors=True)
+
+
+def parse_filter(expression):
+    """Parses 'column op number', e.g. 'downtime_last_day>30'."""
+    match = FILTER_PATTERN.match(expression)
+    if not match:
+        raise ValueError(f"Invalid filter: {expression!r}")
+    return match.group(1), match.group(2), float(match.group(3))
+
+
+def encode_cursor(sort, descending, position):
+    token = f"{sort}:{int(descending)}:{position}"
+    return base64.urlsafe_b64encode(token.encode()).decode()
+
+
+def decode_cursor(cursor, sort, descending):
+    """Returns the sort position a cursor points after; it must come from the same sort."""
+    try:
+        cursor_sort, cursor_descending, position = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        position = int(position)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort or bool(int(cursor_descending)) != descending:
+        raise ValueError("Cursor was issued for a different sort order")
+    return position
+
+
+class ReportIndex:
+    """Memory-mapped columns, sort orders and sorted values of one finished report."""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+        self.names = manifest['columns']
+        self.numeric = set(manifest['numeric'])
+
+        def load(name):
+            return {
+                column: np.load(os.path.join(directory, name.format(position)), mmap_mode='r')
+                for position, column in enumerate(self.names)
+            }
+        self.columns = load('{}.npy')
+        self.orders = load('order_{}.npy')
+        self.sorted = load('sorted_{}.npy')
+        self.size = len(self.columns['store_id'])
+
+    def _range_rows(self, column, lo, hi):
+        """Rows whose value sits in positions [lo, hi) of the column's sort order."""
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.orders[column][lo:hi]] = True
+        return mask
+
+    def match(self, filters=(), store_id_prefix=None):
+        """Boolean row mask for all filters combined."""
+        mask = np.ones(self.size, dtype=bool)
+        if store_id_prefix:
+            sorted_ids = self.sorted['store_id']
+            lo = np.searchsorted(sorted_ids, store_id_prefix, side='left')
+            hi = np.searchsorted(sorted_ids, store_id_prefix + '\U0010ffff', side='left')
+            mask &= self._range_rows('store_id', lo, hi)
+        for column, op, value in filters:
+            if column not in self.numeric:
+                raise ValueError(f"Cannot filter on column: {column}")
+            sorted_values = self.sorted[column]
+            left = np.searchsorted(sorted_values, value, side='left')
+            right = np.searchsorted(sorted_values, value, side='right')
+            if op == '>':
+                mask &= self._range_rows(column, right, self.size)
+            elif op == '>=':
+                mask &= self._range_rows(column, left, self.size)
+            elif op == '<':
+                mask &= self._range_rows(column, 0, left)
+            elif op == '<=':
+                mask &= self._range_rows(column, 0, right)
+            elif op == '=':
+                mask &= self._range_rows(column, left, right)
+            else:
+                mask &= ~self._range_rows(column, left, right)
+        return mask
+
+    def query(self, filters=(), store_id_prefix=None, sort='store_id', descending=False,
+              offset=0, limit=50, cursor=None):
+        """
+        Returns (total matches, page rows, next cursor).
+
+        Rows are ordered by the sort column with ties in report order, reversed
+        as a whole when descending. A cursor continues after the last row of
+        the page it came from; otherwise offset skips that many matches.
+        """
+        if sort not in self.columns:
+            raise ValueError(f"Unknown sort column: {sort}")
+        order = self.orders[sort]
+        if descending:
+            order = order[::-1]
+        # Sort positions of the matching rows
+        positions = np.flatnonzero(self.match(filters, store_id_prefix)[order])
+
+        if cursor is not None:
+            start = np.searchsorted(positions, decode_cursor(cursor, sort, descending), side='right')
+        else:
+            start = offset
+        page = positions[start:start + limit]
+        rows = order[page]
+
+        records = pd.DataFrame({column: np.asarray(self.columns[column][rows]) for column in self.names})
+        next_cursor = None
+        if len(page) and start + len(page) < len(positions):
+            next_cursor = encode_cursor(sort, descending, int(page[-1]))
+        return len(positions), records.to_dict(orient='records'), next_cursor
+
+
+def load_report_index(file_path):
+    """Opens the index of a report CSV, building the columnar copy for reports saved without one."""
+    with _open_indexes_lock:
+        index = _open_indexes.get(file_path)
+        if index is not None:
+            _open_indexes.move_to_end(file_path)
+            return index
+
+    directory = columns_path(file_path)
+    # Copies written before the manifest are rebuilt
+    if not os.path.exists(os.path.join(directory, MANIFEST)):
+        write_report_columns(file_path)
+    index = ReportIndex(directory)
+
+    with _open_indexes_lock:
+        _open_indexes[file_path] = index
+        while len(_open_indexes) > REPORT_INDEX_CACHE_SIZE:
+            _open_indexes.popitem(last=False)
+    return index
+
+
+def negotiate_encoding(accept_encoding):
+    """Picks zstd or gzip from an Accept-Encoding header, or None for the plain CSV."""
+    accepted = {
+        part.split(';')[0].strip().lower()
+        for part in (accept_encoding or '').split(',')
+        if not part.strip().endswith(';q=0')
+    }
+    if 'zstd' in accepted and zstandard is not None:
+        return 'zstd'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compressed_report(file_path, encoding):
+    """Path of the report compressed with encoding, compressing it on first request."""
+    target = file_path + COMPRESSED_SUFFIXES[encoding]
+    if os.path.exists(target):
+        return target
+    # A temp file of its own, so concurrent first requests don't write into each other's file
+    tmp = tempfile.NamedTemporaryFile(dir=os.path.dirname(target) or '.',
+                                      prefix=os.path.basename(target) + '.', suffix='.tmp', delete=False)
+    try:
+        with tmp, open(file_path, 'rb') as source:
+            if encoding == 'zstd':
+                zstandard.ZstdCompressor(level=3).copy_stream(source, tmp)
+            else:
+                with gzip.GzipFile(filename='', mode='wb', compresslevel=6, fileobj=tmp) as out:
+                    shutil.copyfileobj(source, out)
+        os.replace(tmp.name, target)
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+    return target
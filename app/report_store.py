@@ -0,0 +1,200 @@
+"""
+Report files in the reports directory and their index.
+
+ReportStore owns every finished report file: the CSV, its columnar copy and
+its compressed downloads. A report is stored under the hash of its CSV, so
+reports with identical content share one file whatever report_ids and data
+versions point to it. The index lives in SQLite next to the job store, so
+all workers share it and lookups never touch the filesystem. Files are
+evicted when they are older than REPORT_MAX_AGE_HOURS, and least recently
+fetched first while the directory is over REPORT_STORE_MAX_MB.
+"""
+import hashlib
+import os
+import shutil
+import time
+
+from app.report_index import COMPRESSED_SUFFIXES, columns_path, remove_report_files, write_report_columns
+from app.sqlite_db import SQLiteDatabase
+
+REPORTS_DIR = os.getenv('REPORTS_DIR', 'reports')
+REPORT_STORE_PATH = os.getenv('REPORT_STORE_PATH', os.path.join(REPORTS_DIR, 'jobs.sqlite3'))
+# Falls back to the limit of the report cache, which used to own the files
+REPORT_STORE_MAX_MB = int(os.getenv('REPORT_STORE_MAX_MB', os.getenv('REPORT_CACHE_MAX_MB', 500)))
+REPORT_MAX_AGE_HOURS = float(os.getenv('REPORT_MAX_AGE_HOURS', 24 * 7))
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS report_files (
+        file_path TEXT PRIMARY KEY,
+        content_hash TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        encodings TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        accessed_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_report_files_hash ON report_files (content_hash)",
+    "CREATE INDEX IF NOT EXISTS idx_report_files_accessed ON report_files (accessed_at)",
+]
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _report_size(file_path):
+    """Bytes of a report CSV with its columnar copy and compressed downloads."""
+    size = 0
+    for path in [file_path] + [file_path + suffix for suffix in COMPRESSED_SUFFIXES.values()]:
+        if os.path.exists(path):
+            size += os.path.getsize(path)
+    directory = columns_path(file_path)
+    if os.path.isdir(directory):
+        size += sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+    return size
+
+
+class ReportStore:
+    """Content-addressed report files with an index of their sizes, encodings and last fetch."""
+
+    def __init__(self, path=None, directory=None, max_bytes=None, max_age_hours=None):
+        self.path = path or REPORT_STORE_PATH
+        self.directory = directory or REPORTS_DIR
+        self.max_bytes = max_bytes or REPORT_STORE_MAX_MB * 1024 * 1024
+        self.max_age = (max_age_hours or REPORT_MAX_AGE_HOURS) * 3600
+        os.makedirs(self.directory, exist_ok=True)
+        self._db = SQLiteDatabase(self.path, SCHEMA)
+
+    def add(self, csv_path):
+        """
+        Moves a finished report CSV into the store and returns its file path.
+
+        If a stored report has the same content, csv_path is left in place
+        and the stored one is returned. The columnar copy served by
+        /reports/{report_id}/rows is written from csv_path, outside the
+        transaction that indexes the report.
+        """
+        content_hash = _file_hash(csv_path)
+        file_path = os.path.join(self.directory, f"report_{content_hash[:32]}.csv")
+        row = self._db.connection().execute(
+            "SELECT file_path FROM report_files WHERE content_hash = ? LIMIT 1", (content_hash,)
+        ).fetchone()
+        if row is not None:
+            file_path = row[0]
+        # Indexed columnar copy served by /reports/{report_id}/rows, built
+        # before the write lock so the other workers' updates don't wait on it
+        if not os.path.isdir(columns_path(file_path)):
+            write_report_columns(file_path, csv_path)
+
+        # Under the write lock, so two workers adding the same report store it once
+        with self._db.transaction() as conn:
+            now = time.time()
+            row = conn.execute(
+                "SELECT file_path FROM report_files WHERE content_hash = ? LIMIT 1", (content_hash,)
+            ).fetchone()
+            if row is not None:
+                file_path = row[0]
+                conn.execute(
+                    "UPDATE report_files SET accessed_at = ?, size = ? WHERE file_path = ?",
+                    (now, _report_size(file_path), file_path)
+                )
+            else:
+                os.replace(csv_path, file_path)
+                conn.execute(
+                    "INSERT INTO report_files (file_path, content_hash, size, encodings, created_at, accessed_at)"
+                    " VALUES (?, ?, ?, '', ?, ?)",
+                    (file_path, content_hash, _report_size(file_path), now, now)
+                )
+        self.evict()
+        return file_path
+
+    def get(self, file_path, touch=True):
+        """
+        Returns {'size', 'encodings'} of a stored report, or None once it is
+        evicted; touch marks it as fetched for the LRU order.
+        """
+        conn = self._db.connection()
+        row = conn.execute("SELECT size, encodings FROM report_files WHERE file_path = ?", (file_path,)).fetchone()
+        if row is None:
+            return None
+        if touch:
+            conn.execute("UPDATE report_files SET accessed_at = ? WHERE file_path = ?", (time.time(), file_path))
+        return {'size': row[0], 'encodings': set(filter(None, row[1].split(',')))}
+
+    def add_encoding(self, file_path, encoding):
+        """Records a compressed download written next to a stored report."""
+        with self._db.transaction() as conn:
+            row = conn.execute("SELECT encodings FROM report_files WHERE file_path = ?", (file_path,)).fetchone()
+            if row is not None:
+                encodings = set(filter(None, row[0].split(','))) | {encoding}
+                conn.execute(
+                    "UPDATE report_files SET encodings = ?, size = ? WHERE file_path = ?",
+                    (','.join(sorted(encodings)), _report_size(file_path), file_path)
+                )
+
+    def evict(self):
+        """Removes reports past the age limit, then the least recently fetched until the size limit holds."""
+        conn = self._db.connection()
+        rows = conn.execute(
+            "SELECT file_path, size, created_at FROM report_files ORDER BY accessed_at DESC"
+        ).fetchall()
+        oldest = time.time() - self.max_age
+        kept, kept_bytes = 0, 0
+        for file_path, size, created_at in rows:
+            # The most recently fetched report is kept even when it alone is over the size limit
+            if created_at >= oldest and (kept == 0 or kept_bytes + size <= self.max_bytes):
+                kept += 1
+                kept_bytes += size
+                continue
+            # Out of the index first, so nobody is handed a file that is going away
+            conn.execute("DELETE FROM report_files WHERE file_path = ?", (file_path,))
+            remove_report_files(file_path)
+
+    def adopt(self):
+        """
+        Indexes report CSVs in the directory that were written before the
+        store managed it, and removes stale partial and temporary ones.
+        """
+        conn = self._db.connection()
+        known = {row[0] for row in conn.execute("SELECT file_path FROM report_files")}
+        oldest = time.time() - self.max_age
+        for entry in os.scandir(self.directory):
+            file_path = os.path.join(self.directory, entry.name)
+            name = entry.name
+            if not (name.startswith('report_') and name.endswith(('.csv', '.tmp'))) or file_path in known:
+                continue
+            if name.endswith(('.tmp', '.tmp.csv', '.partial.csv')):
+                # Left behind by a worker that died while writing; columnar copies are directories
+                if entry.stat().st_mtime < oldest:
+                    if entry.is_dir():
+                        shutil.rmtree(file_path, ignore_errors=True)
+                    else:
+                        os.remove(file_path)
+                continue
+            encodings = [encoding for encoding, suffix in COMPRESSED_SUFFIXES.items()
+                         if os.path.exists(file_path + suffix)]
+            modified = entry.stat().st_mtime
+            conn.execute(
+                "INSERT OR IGNORE INTO report_files (file_path, content_hash, size, encodings, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (file_path, _file_hash(file_path), _report_size(file_path), ','.join(encodings), modified, modified)
+            )
+        self.evict()
+
+    def stats(self):
+        files, size = self._db.connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM report_files"
+        ).fetchone()
+        return {"files": files, "size_bytes": size}
+
+
+def create_report_store():
+    """Builds the store of REPORTS_DIR and indexes the reports already in it."""
+    store = ReportStore()
+    store.adopt()
+    return store
@@ -0,0 +1,534 @@
+"""
+Hourly uptime/downtime rollups per store.
+
+Each row of store_status_hourly summarises the business-hours polls of one
+store in one UTC hour: the first and last poll with their status, and the
+uptime/downtime between consecutive polls inside the hour. That is enough to
+rebuild the report windows exactly with the calculate_time rules, because the
+only intervals that cross an hour boundary run from the last poll of one
+segment to the first poll of the next.
+
+Streamed polls don't touch the rollups when they are written: insert_status
+marks their store-hours in store_status_hourly_dirty in the same
+transaction, and a background RollupRefresher recomputes the marked hours
+from raw polls every ROLLUP_REFRESH_INTERVAL_MS. Refreshes hold a named
+database lock, so one worker's older recomputation never overwrites
+another's newer one; rollup_report refreshes what is still marked first.
+"""
+import logging
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from app.db import get_connection
+from app.engine import (
+    METRIC_COLUMNS, WINDOWS, factorize_stores, resolve_store_timezones, timestamp_to_us, to_epoch_us,
+)
+from app.fetch import (
+    columns_to_frame, decode_batch, empty_status_frame, fetch_status, fetch_store_tables, report_window,
+)
+from app.metrics import count, log_event
+from app.schedule import build_schedule_index
+
+HOUR_US = 3_600_000_000
+DAY_US = 24 * HOUR_US
+INSERT_BATCH_SIZE = 1000
+# Marked store-hours claimed by one step of a refresh
+REFRESH_BATCH_SIZE = 1000
+ROLLUP_REFRESH_INTERVAL_MS = int(os.getenv('ROLLUP_REFRESH_INTERVAL_MS', 1000))
+# Seconds a full refresh or a report waits for a running refresh
+ROLLUP_LOCK_TIMEOUT = int(os.getenv('ROLLUP_LOCK_TIMEOUT', 300))
+ROLLUP_LOCK_NAME = 'store_status_hourly_refresh'
+
+SEGMENT_COLUMNS = [
+    'code', 'hour_start', 'poll_count', 'first_ts', 'first_active',
+    'last_ts', 'last_active', 'inner_up', 'inner_down',
+]
+
+
+def us_to_datetime(values):
+    """Epoch microseconds to naive UTC datetimes for MySQL."""
+    return pd.to_datetime(np.asarray(values, dtype=np.int64), unit='us').to_pydatetime()
+
+
+def hourly_segments(codes, ts_us, active):
+    """
+    Aggregates polls into one segment per store and UTC hour.
+
+    Polls must be grouped by store code and sorted by time within a store.
+    inner_up/inner_down hold the microseconds between consecutive polls of
+    the same segment, attributed to the status of the later poll.
+    """
+    if not len(codes):
+        return pd.DataFrame({col: np.empty(0, dtype=np.int64) for col in SEGMENT_COLUMNS})
+
+    hours = ts_us // HOUR_US
+    starts = np.ones(len(codes), dtype=bool)
+    starts[1:] = (codes[1:] != codes[:-1]) | (hours[1:] != hours[:-1])
+    segment = np.cumsum(starts) - 1
+    n_segments = segment[-1] + 1
+    first = np.flatnonzero(starts)
+    last = np.append(first[1:] - 1, len(codes) - 1)
+
+    interval = np.zeros(len(codes), dtype=np.int64)
+    interval[1:] = ts_us[1:] - ts_us[:-1]
+    interval[starts] = 0
+    inner_up = np.bincount(segment, weights=interval * active, minlength=n_segments)
+    inner_down = np.bincount(segment, weights=interval * ~active, minlength=n_segments)
+
+    return pd.DataFrame({
+        'code': codes[first],
+        'hour_start': hours[first] * HOUR_US,
+        'poll_count': np.diff(np.append(first, len(codes))),
+        'first_ts': ts_us[first],
+        'first_active': active[first],
+        'last_ts': ts_us[last],
+        'last_active': active[last],
+        'inner_up': inner_up.astype(np.int64),
+        'inner_down': inner_down.astype(np.int64),
+    })
+
+
+def segment_totals(segments, has_polls, n_stores, start_us, end_us):
+    """
+    Uptime/downtime microseconds per store inside [start_us, end_us] from segments.
+
+    Segments must lie inside the window and be sorted by store and time. The
+    gap before each segment goes to the status of its first poll (the first
+    gap starts at the window start), the tail after the last segment to the
+    status of its last poll, and stores without any segment in the window are
+    down for the whole window when they have polls at all.
+    """
+    uptime = np.zeros(n_stores, dtype=np.float64)
+    downtime = np.zeros(n_stores, dtype=np.float64)
+    c = segments['code'].to_numpy(dtype=np.int64)
+    if len(c):
+        first_ts = segments['first_ts'].to_numpy(dtype=np.int64)
+        last_ts = segments['last_ts'].to_numpy(dtype=np.int64)
+        first_active = segments['first_active'].to_numpy(dtype=bool)
+        last_active = segments['last_active'].to_numpy(dtype=bool)
+
+        first = np.ones(len(c), dtype=bool)
+        first[1:] = c[1:] != c[:-1]
+        last = np.ones(len(c), dtype=bool)
+        last[:-1] = first[1:]
+
+        previous = np.empty_like(last_ts)
+        previous[1:] = last_ts[:-1]
+        previous[first] = start_us
+        gap = (first_ts - previous).astype(np.float64)
+
+        uptime += np.bincount(c, weights=gap * first_active, minlength=n_stores)
+        downtime += np.bincount(c, weights=gap * ~first_active, minlength=n_stores)
+        uptime += np.bincount(c, weights=segments['inner_up'].to_numpy(dtype=np.float64), minlength=n_stores)
+        downtime += np.bincount(c, weights=segments['inner_down'].to_numpy(dtype=np.float64), minlength=n_stores)
+
+        tail = (end_us - last_ts[last]).astype(np.float64)
+        tail_active = last_active[last]
+        np.add.at(uptime, c[last][tail_active], tail[tail_active])
+        np.add.at(downtime, c[last][~tail_active], tail[~tail_active])
+
+    in_window = np.zeros(n_stores, dtype=bool)
+    in_window[c] = True
+    downtime[has_polls & ~in_window] += end_us - start_us
+    return uptime, downtime
+
+
+def fetch_polls(db, start_us, end_us):
+    """Fetches the polls with start_us <= timestamp < end_us."""
+    cursor = db.cursor()
+    cursor.execute(
+        "SELECT d.store_code, s.timestamp_utc, s.status = 'active' FROM store_status s"
+        " JOIN stores d ON d.store_id = s.store_id WHERE s.timestamp_utc >= %s AND s.timestamp_utc < %s",
+        tuple(us_to_datetime([start_us, end_us]))
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    return columns_to_frame(*decode_batch(db, rows)) if rows else empty_status_frame()
+
+
+def business_hours_polls(polls, store_ids, timezones, business_hours):
+    """Polls inside business hours as (codes, ts_us, active), coded by store_ids and sorted by store and time."""
+    if polls.empty:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=bool)
+
+    present_codes, present = factorize_stores(polls['store_id'])
+    codes = store_ids.get_indexer(present)[present_codes]
+    ts_us = to_epoch_us(polls['timestamp_utc'])
+    active = (polls['status'] == 'active').to_numpy()
+
+    store_tz = resolve_store_timezones(present, timezones)
+    schedules = build_schedule_index(present, store_tz, business_hours, int(ts_us.min()), int(ts_us.max()))
+    mask = schedules.contains(present_codes, ts_us) & (codes >= 0)
+
+    order = np.lexsort((ts_us, codes))
+    order = order[mask[order]]
+    return codes[order], ts_us[order], active[order]
+
+
+def poll_segments(codes, ts_us, active):
+    """One segment per poll, so a window can start or end between any two polls."""
+    return pd.DataFrame({
+        'code': codes,
+        'hour_start': ts_us // HOUR_US * HOUR_US,
+        'poll_count': np.ones(len(codes), dtype=np.int64),
+        'first_ts': ts_us,
+        'first_active': active,
+        'last_ts': ts_us,
+        'last_active': active,
+        'inner_up': np.zeros(len(codes), dtype=np.int64),
+        'inner_down': np.zeros(len(codes), dtype=np.int64),
+    })
+
+
+def write_segments(db, segments, store_ids):
+    """Replaces rollup rows with the given segments."""
+    if segments.empty:
+        return
+    cursor = db.cursor()
+    rows = list(zip(
+        store_ids[segments['code'].to_numpy()],
+        us_to_datetime(segments['hour_start']),
+        segments['poll_count'].astype(int),
+        us_to_datetime(segments['first_ts']),
+        segments['first_active'].astype(int),
+        us_to_datetime(segments['last_ts']),
+        segments['last_active'].astype(int),
+        segments['inner_up'].astype(int),
+        segments['inner_down'].astype(int),
+    ))
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        batch = rows[start:start + INSERT_BATCH_SIZE]
+        cursor.execute(
+            "REPLACE INTO store_status_hourly (store_id, hour_start, poll_count, first_ts, first_active,"
+            " last_ts, last_active, inner_up_us, inner_down_us) VALUES "
+            + ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(batch)),
+            [value for row in batch for value in row]
+        )
+
+
+def refresh_rollups(db, since=None):
+    """
+    Recomputes the hourly rollups from raw polls.
+
+    With since (any timestamp), only the hours from the one containing since
+    onwards are rebuilt, which is all that new polls can change. Without it
+    every hour is rebuilt, as needed after business hours or timezones change.
+    Raw polls are read one day at a time.
+    """
+    with rollup_lock(db, ROLLUP_LOCK_TIMEOUT) as locked:
+        if not locked:
+            raise RuntimeError("Timed out waiting for a running rollup refresh")
+        _refresh_rollups(db, since)
+    print("Hourly rollups refreshed!")
+
+
+def _refresh_rollups(db, since):
+    cursor = db.cursor()
+    cursor.execute("SELECT MIN(timestamp_utc), MAX(timestamp_utc) FROM store_status")
+    min_ts, max_ts = cursor.fetchone()
+    if min_ts is None:
+        return
+
+    first_us = timestamp_to_us(min_ts)
+    last_us = timestamp_to_us(max_ts)
+    if since is not None:
+        first_us = max(first_us, timestamp_to_us(since))
+    first_hour = first_us // HOUR_US * HOUR_US
+
+    timezones, business_hours = fetch_store_tables(db)
+    delete = "DELETE FROM store_status_hourly WHERE hour_start >= %s AND hour_start < %s"
+    day_start = first_hour
+    while day_start <= last_us:
+        polls = fetch_polls(db, day_start, day_start + DAY_US)
+        store_ids = factorize_stores(polls['store_id'])[1]
+        segments = hourly_segments(*business_hours_polls(polls, store_ids, timezones, business_hours))
+        # A day's old hours are replaced in the transaction that writes its
+        # new ones, so readers see either
+        cursor.execute(delete, tuple(us_to_datetime([day_start, day_start + DAY_US])))
+        write_segments(db, segments, store_ids)
+        db.commit()
+        day_start += DAY_US
+    # Hours past the newest poll, left by polls that no longer exist
+    cursor.execute("DELETE FROM store_status_hourly WHERE hour_start >= %s", (us_to_datetime([day_start])[0],))
+    db.commit()
+
+
+@contextmanager
+def rollup_lock(db, timeout=0):
+    """Holds the named rollup refresh lock on db's session; yields whether it was acquired within timeout seconds."""
+    cursor = db.cursor()
+    cursor.execute("SELECT GET_LOCK(%s, %s)", (ROLLUP_LOCK_NAME, timeout))
+    locked = bool(cursor.fetchone()[0])
+    try:
+        yield locked
+    finally:
+        if locked:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (ROLLUP_LOCK_NAME,))
+            cursor.fetchone()
+        cursor.close()
+
+
+def mark_stale_hours(cursor, polls, generation):
+    """
+    Marks the store-hours of polls written by generation for the next
+    refresh; part of the caller's transaction.
+    """
+    keys = pd.DataFrame({
+        'store_id': polls['store_id'].to_numpy(),
+        'hour_start': to_epoch_us(polls['timestamp_utc']) // HOUR_US * HOUR_US,
+    }).drop_duplicates()
+    rows = list(zip(keys['store_id'], us_to_datetime(keys['hour_start']), [generation] * len(keys)))
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        batch = rows[start:start + INSERT_BATCH_SIZE]
+        cursor.execute(
+            "INSERT INTO store_status_hourly_dirty (store_id, hour_start, generation) VALUES "
+            + ", ".join(["(%s, %s, %s)"] * len(batch))
+            + " ON DUPLICATE KEY UPDATE generation = VALUES(generation)",
+            [value for row in batch for value in row]
+        )
+
+
+def refresh_stale_rollups(db, timeout=0):
+    """
+    Recomputes the rollups of the store-hours marked by insert_status.
+    Returns False when another refresh held the lock for longer than
+    timeout seconds.
+    """
+    with rollup_lock(db, timeout) as locked:
+        if not locked:
+            return False
+        _refresh_stale_rollups(db)
+    return True
+
+
+def _refresh_stale_rollups(db):
+    """
+    Marks are removed in the transaction that writes their rebuilt hours,
+    and only if no write marked the hour again since they were read, so a
+    crash or a poll written meanwhile leaves the hour marked.
+    """
+    cursor = db.cursor()
+    while True:
+        cursor.execute(
+            "SELECT store_id, hour_start, generation FROM store_status_hourly_dirty"
+            " ORDER BY hour_start, store_id LIMIT %s",
+            (REFRESH_BATCH_SIZE,)
+        )
+        marks = cursor.fetchall()
+        if not marks:
+            break
+        stale = [(store_id, hour_start) for store_id, hour_start, _ in marks]
+
+        # Read before writing, so the write transaction stays short; hours
+        # without business-hours polls keep no row
+        segments, store_ids = stale_segments(db, stale)
+        keys = ", ".join(["(%s, %s)"] * len(stale))
+        cursor.execute(
+            f"DELETE FROM store_status_hourly WHERE (store_id, hour_start) IN ({keys})",
+            [value for row in stale for value in row]
+        )
+        write_segments(db, segments, store_ids)
+        cursor.execute(
+            f"DELETE FROM store_status_hourly_dirty WHERE (store_id, hour_start, generation) IN"
+            f" ({', '.join(['(%s, %s, %s)'] * len(marks))})",
+            [value for row in marks for value in row]
+        )
+        db.commit()
+        count('rollup_hours_refreshed', len(stale))
+    cursor.close()
+
+
+def stale_segments(db, stale):
+    """Rollup segments recomputed from raw polls for (store_id, hour_start) pairs, with their store_ids."""
+    stale = pd.DataFrame(stale, columns=['store_id', 'hour_start'])
+    store_ids = pd.Index(stale['store_id'].unique())
+    timezones, business_hours = fetch_store_tables(db, list(store_ids))
+    segments = []
+    for hour, stores in stale.groupby('hour_start')['store_id']:
+        hour_us = timestamp_to_us(hour)
+        start, end = us_to_datetime([hour_us, hour_us + HOUR_US - 1])
+        raw = fetch_status(db, start, end, list(stores))
+        segments.append(hourly_segments(*business_hours_polls(raw, store_ids, timezones, business_hours)))
+    return pd.concat(segments, ignore_index=True), store_ids
+
+
+class RollupRefresher:
+    """Refreshes stale rollup hours from a background thread, at most every ROLLUP_REFRESH_INTERVAL_MS."""
+
+    def __init__(self, interval_ms=None):
+        self.interval = (interval_ms or ROLLUP_REFRESH_INTERVAL_MS) / 1000
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def notify(self):
+        """Schedules a refresh for hours marked since the last one."""
+        with self._thread_lock:
+            if self._stopped.is_set():
+                return
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='rollup-refresher', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait()
+            # Writes arriving within the interval share one refresh
+            self._stopped.wait(self.interval)
+            self._wake.clear()
+            try:
+                with get_connection() as db:
+                    refreshed = refresh_stale_rollups(db)
+            except Exception as e:
+                log_event('rollup_refresh_failed', level=logging.ERROR, error=repr(str(e)))
+                refreshed = False
+            if not refreshed:
+                # Another worker is refreshing; the marks wait for the next round
+                self._wake.set()
+
+    def shutdown(self):
+        with self._thread_lock:
+            self._stopped.set()
+            self._wake.set()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+
+rollup_refresher = RollupRefresher()
+
+
+def fetch_rollup_segments(db, store_ids, start_us, end_us, only=None):
+    """Rollup segments for the hours in [start_us, end_us), coded by store_ids, of all stores or only some."""
+    query = (
+        "SELECT store_id, hour_start, poll_count, first_ts, first_active, last_ts, last_active,"
+        " inner_up_us, inner_down_us FROM store_status_hourly WHERE hour_start >= %s AND hour_start < %s"
+    )
+    params = tuple(us_to_datetime([start_us, end_us]))
+    if only is not None:
+        query += f" AND store_id IN ({', '.join(['%s'] * len(only))})"
+        params += tuple(only)
+    cursor = db.cursor()
+    cursor.execute(query, params)
+    rows = pd.DataFrame(cursor.fetchall(), columns=['store_id'] + SEGMENT_COLUMNS[1:])
+    if rows.empty:
+        return poll_segments(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=bool))
+
+    segments = pd.DataFrame({
+        'code': store_ids.get_indexer(rows['store_id']),
+        'hour_start': pd.to_datetime(rows['hour_start']).to_numpy(dtype='datetime64[us]').astype(np.int64),
+        'poll_count': rows['poll_count'].astype(np.int64),
+        'first_ts': pd.to_datetime(rows['first_ts']).to_numpy(dtype='datetime64[us]').astype(np.int64),
+        'first_active': rows['first_active'].astype(bool),
+        'last_ts': pd.to_datetime(rows['last_ts']).to_numpy(dtype='datetime64[us]').astype(np.int64),
+        'last_active': rows['last_active'].astype(bool),
+        'inner_up': rows['inner_up'].astype(np.int64),
+        'inner_down': rows['inner_down'].astype(np.int64),
+    })
+    return segments[segments['code'] >= 0]
+
+
+def window_segments(rollups, edge_segments, start_us, end_us):
+    """
+    Segments covering [start_us, end_us]: rollup rows for the whole hours and
+    per-poll segments for the partial hours at both ends.
+    """
+    full_from = -(-start_us // HOUR_US) * HOUR_US
+    full_to = max(end_us // HOUR_US * HOUR_US, full_from)
+
+    hours = rollups['hour_start'].to_numpy()
+    ts = edge_segments['first_ts'].to_numpy()
+    segments = pd.concat([
+        edge_segments[(ts >= start_us) & (ts < full_from)],
+        rollups[(hours >= full_from) & (hours < full_to)],
+        edge_segments[(ts >= full_to) & (ts <= end_us)],
+    ], ignore_index=True)
+    return segments.sort_values(['code', 'first_ts'], kind='stable')
+
+
+def rollup_report(db):
+    """
+    Builds the report from hourly rollups.
+
+    Only up to 168 rollup rows per store and the raw polls of the partial
+    hours at the window edges are read, instead of the whole store_status
+    table. Rollups must be kept current with refresh_rollups; hours marked
+    by streamed polls are refreshed here first, and the refresh lock is held
+    while the rollups are read, so no refresh is caught halfway.
+    """
+    with rollup_lock(db, ROLLUP_LOCK_TIMEOUT) as locked:
+        if not locked:
+            raise RuntimeError("Timed out waiting for a running rollup refresh")
+        _refresh_stale_rollups(db)
+        return _rollup_report(db)
+
+
+def _rollup_report(db):
+    cursor = db.cursor()
+    cursor.execute("SELECT MAX(timestamp_utc) FROM store_status")
+    latest = cursor.fetchone()[0]
+    if latest is None:
+        raise ValueError("No store status data available")
+    end_us = timestamp_to_us(latest)
+
+    # The stores and polls of the fetch window, as the other engines see them
+    window_start, _ = report_window(pd.Timestamp(latest))
+    window_start_us = timestamp_to_us(window_start)
+    cursor.execute(
+        "SELECT DISTINCT store_id FROM store_status WHERE timestamp_utc BETWEEN %s AND %s ORDER BY store_id",
+        (window_start, latest)
+    )
+    store_ids = pd.Index([row[0] for row in cursor.fetchall()])
+
+    # Stores with business-hours polls in the window; the first hour may
+    # also hold polls from before it
+    cursor.execute(
+        "SELECT DISTINCT store_id FROM store_status_hourly WHERE hour_start >= %s AND last_ts >= %s",
+        tuple(us_to_datetime([window_start_us // HOUR_US * HOUR_US, window_start_us]))
+    )
+    has_polls = np.zeros(len(store_ids), dtype=bool)
+    codes = store_ids.get_indexer([row[0] for row in cursor.fetchall()])
+    has_polls[codes[codes >= 0]] = True
+
+    timezones, business_hours = fetch_store_tables(db)
+
+    week_start = end_us - int(WINDOWS[-1][1].total_seconds() * 1_000_000)
+    rollups = fetch_rollup_segments(db, store_ids, week_start // HOUR_US * HOUR_US, end_us)
+
+    # Raw polls only for the partial hours at the window edges
+    edge_ranges = {(end_us // HOUR_US * HOUR_US, end_us + 1)}
+    for _, delta in WINDOWS:
+        start_us = end_us - int(delta.total_seconds() * 1_000_000)
+        edge_ranges.add((start_us, -(-start_us // HOUR_US) * HOUR_US))
+    edge_polls = pd.concat(
+        [fetch_polls(db, lo, hi) for lo, hi in sorted(edge_ranges) if hi > lo], ignore_index=True
+    ).drop_duplicates(['store_id', 'timestamp_utc'])
+    edge_segments = poll_segments(*business_hours_polls(edge_polls, store_ids, timezones, business_hours))
+
+    return assemble_report(store_ids, has_polls, rollups, edge_segments, end_us)
+
+
+def assemble_report(store_ids, has_polls, rollups, edge_segments, end_us):
+    """Report rows from rollup segments plus per-poll segments for the partial hours."""
+    report = pd.DataFrame({'store_id': store_ids})
+    for timeframe, delta in WINDOWS:
+        start_us = end_us - int(delta.total_seconds() * 1_000_000)
+        segments = window_segments(rollups, edge_segments, start_us, end_us)
+        uptime, downtime = segment_totals(segments, has_polls, len(store_ids), start_us, end_us)
+        report[f'uptime_{timeframe}'] = [round(v / 1e6 / 60, 2) for v in uptime]
+        report[f'downtime_{timeframe}'] = [round(v / 1e6 / 60, 2) for v in downtime]
+
+    return report[['store_id'] + METRIC_COLUMNS]
+
+
+if __name__ == "__main__":
+    from app.db import get_connection
+    with get_connection() as connection:
+        refresh_rollups(connection, since=sys.argv[1] if len(sys.argv) > 1 else None)
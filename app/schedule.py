@@ -0,0 +1,263 @@
+import threading
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+DAY_US = 86_400_000_000
+
+# Default business hours are 00:00:00 - 23:59:59 local, same as get_default_business_hours
+DEFAULT_OPEN_US = 0
+DEFAULT_CLOSE_US = (23 * 3600 + 59 * 60 + 59) * 1_000_000
+
+# Compiled schedules reach this far past the requested window end, so the
+# hourly reports that follow can reuse them without recompiling
+SCHEDULE_PADDING = timedelta(days=1)
+
+# store_id -> CompiledSchedule
+_schedule_cache = {}
+_cache_lock = threading.Lock()
+
+
+def time_to_us(t):
+    """Convert a datetime.time to microseconds since midnight."""
+    return ((t.hour * 60 + t.minute) * 60 + t.second) * 1_000_000 + t.microsecond
+
+
+class CompiledSchedule:
+    """Sorted, non-overlapping UTC open/close intervals of one store."""
+
+    def __init__(self, fingerprint, start_us, end_us, opens, closes):
+        self.fingerprint = fingerprint
+        self.start_us = start_us
+        self.end_us = end_us
+        self.opens = opens
+        self.closes = closes
+
+    def covers(self, start_us, end_us):
+        return self.start_us <= start_us and end_us <= self.end_us
+
+
+class ScheduleIndex:
+    """
+    Business hours of many stores as one set of interval arrays.
+
+    Intervals of store i are opens[offsets[i]:offsets[i + 1]] and the matching
+    closes, both inclusive, in epoch microseconds and clipped to
+    [start_us, end_us]. Lookups combine the store code and the time into one
+    sorted key so every poll is a single searchsorted instead of a DataFrame
+    filter.
+    """
+
+    def __init__(self, store_ids, offsets, opens, closes, start_us, end_us):
+        self.store_ids = store_ids
+        self.offsets = offsets
+        self.opens = opens
+        self.closes = closes
+        self.start_us = start_us
+        self.end_us = end_us
+
+        counts = np.diff(offsets)
+        self._codes = np.repeat(np.arange(len(store_ids)), counts)
+        self._span = end_us - start_us + 1
+        self._keyed = len(store_ids) * self._span < 2 ** 62
+        if self._keyed:
+            self._open_keys = self.opens + (self._codes * self._span - start_us)
+        # Open time before each interval within its store, for overlap sums
+        durations = self.closes - self.opens
+        cumulative = np.concatenate([[0], np.cumsum(durations)])
+        self._open_before = cumulative[:-1] - cumulative[offsets[:-1]][self._codes]
+
+    def _locate(self, codes, ts_us):
+        """Index of the last interval of the store opening at or before ts_us, -1 if none."""
+        codes = np.asarray(codes, dtype=np.int64)
+        ts_us = np.asarray(ts_us, dtype=np.int64)
+        if self._keyed:
+            keys = codes * self._span + (np.clip(ts_us, self.start_us, self.end_us) - self.start_us)
+            idx = np.searchsorted(self._open_keys, keys, side='right') - 1
+        else:
+            idx = np.empty(len(codes), dtype=np.int64)
+            for code in np.unique(codes):
+                sel = codes == code
+                lo, hi = self.offsets[code], self.offsets[code + 1]
+                idx[sel] = lo + np.searchsorted(self.opens[lo:hi], ts_us[sel], side='right') - 1
+        found = (idx >= 0) & (idx >= self.offsets[codes])
+        return np.where(found, idx, -1)
+
+    def contains(self, codes, ts_us):
+        """Flags the timestamps that fall inside their store's business hours."""
+        ts_us = np.asarray(ts_us, dtype=np.int64)
+        if not len(self.closes):
+            return np.zeros(len(ts_us), dtype=bool)
+        idx = self._locate(codes, ts_us)
+        safe = np.where(idx >= 0, idx, 0)
+        in_window = (ts_us >= self.start_us) & (ts_us <= self.end_us)
+        return (idx >= 0) & in_window & (ts_us <= self.closes[safe])
+
+    def open_us_before(self, codes, ts_us):
+        """Business-hours microseconds of each store from the index start up to ts_us."""
+        ts_us = np.asarray(ts_us, dtype=np.int64)
+        if not len(self.closes):
+            return np.zeros(len(ts_us), dtype=np.int64)
+        idx = self._locate(codes, ts_us)
+        safe = np.where(idx >= 0, idx, 0)
+        partial = np.clip(ts_us - self.opens[safe], 0, self.closes[safe] - self.opens[safe])
+        return np.where(idx >= 0, self._open_before[safe] + partial, 0)
+
+    def overlap_us(self, codes, start_us, end_us):
+        """Business-hours microseconds of each store inside [start_us, end_us]."""
+        return self.open_us_before(codes, end_us) - self.open_us_before(codes, start_us)
+
+
+def schedule_rows(store_ids, store_tz, business_hours):
+    """
+    One row per (store, day, interval) with local open/close offsets in microseconds.
+
+    Stores without any business_hours rows get the default 24/7 hours.
+    """
+    frames = []
+    if not business_hours.empty:
+        bh = business_hours[business_hours['store_id'].isin(store_ids)]
+        frames.append(pd.DataFrame({
+            'code': store_ids.get_indexer(bh['store_id']),
+            'day': bh['day_of_week'].to_numpy(dtype=np.int64),
+            'open': [time_to_us(t) for t in bh['start_time_local']],
+            'close': [time_to_us(t) for t in bh['end_time_local']],
+        }))
+    with_hours = np.zeros(len(store_ids), dtype=bool)
+    if frames:
+        with_hours[frames[0]['code'].to_numpy()] = True
+    default_codes = np.flatnonzero(~with_hours)
+    frames.append(pd.DataFrame({
+        'code': np.repeat(default_codes, 7),
+        'day': np.tile(np.arange(7), len(default_codes)),
+        'open': DEFAULT_OPEN_US,
+        'close': DEFAULT_CLOSE_US,
+    }))
+    rows = pd.concat(frames, ignore_index=True)
+    rows['tz'] = store_tz.to_numpy()[rows['code'].to_numpy()]
+    return rows
+
+
+def fingerprints(rows, n_stores):
+    """Hash of every store's timezone and business-hours rows."""
+    row_hash = pd.util.hash_pandas_object(rows[['day', 'open', 'close', 'tz']], index=False).to_numpy()
+    result = np.zeros(n_stores, dtype=np.uint64)
+    np.add.at(result, rows['code'].to_numpy(), row_hash)
+    return result
+
+
+def compile_intervals(rows, start_us, end_us):
+    """
+    Expands weekly local rows into merged UTC intervals overlapping [start_us, end_us].
+
+    Hours that end before they start run past midnight into the next day. Wall
+    times skipped by a DST jump move forward, and repeated ones open on the
+    first occurrence and close on the second.
+    """
+    # Local calendar days that can touch the window in any timezone
+    first_day = start_us // DAY_US - 2
+    days = np.arange(first_day, end_us // DAY_US + 2)
+    weekdays = (days + 3) % 7  # 1970-01-01 was a Thursday
+
+    parts = []
+    for day in range(7):
+        matching = days[weekdays == day]
+        sel = rows[rows['day'] == day]
+        if sel.empty or not len(matching):
+            continue
+        parts.append(pd.DataFrame({
+            'code': np.repeat(sel['code'].to_numpy(), len(matching)),
+            'tz': np.repeat(sel['tz'].to_numpy(), len(matching)),
+            'open': np.repeat(sel['open'].to_numpy(), len(matching)) + np.tile(matching * DAY_US, len(sel)),
+            'close': np.repeat(sel['close'].to_numpy(), len(matching)) + np.tile(matching * DAY_US, len(sel)),
+        }))
+    if not parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    local = pd.concat(parts, ignore_index=True)
+    overnight = local['close'] < local['open']
+    local.loc[overnight, 'close'] += DAY_US
+
+    opens = np.empty(len(local), dtype=np.int64)
+    closes = np.empty(len(local), dtype=np.int64)
+    tz_values = local['tz'].to_numpy()
+    for tz_name in pd.unique(tz_values):
+        idx = np.flatnonzero(tz_values == tz_name)
+        wall_open = pd.DatetimeIndex(local['open'].to_numpy()[idx].astype('datetime64[us]'))
+        wall_close = pd.DatetimeIndex(local['close'].to_numpy()[idx].astype('datetime64[us]'))
+        opens[idx] = wall_open.tz_localize(
+            tz_name, ambiguous=np.ones(len(idx), dtype=bool), nonexistent='shift_forward'
+        ).tz_convert('UTC').tz_localize(None).as_unit('us').asi8
+        closes[idx] = wall_close.tz_localize(
+            tz_name, ambiguous=np.zeros(len(idx), dtype=bool), nonexistent='shift_forward'
+        ).tz_convert('UTC').tz_localize(None).as_unit('us').asi8
+
+    codes = local['code'].to_numpy(dtype=np.int64)
+    keep = (closes >= start_us) & (opens <= end_us) & (closes >= opens)
+    codes, opens, closes = codes[keep], opens[keep], closes[keep]
+
+    # Merge overlapping intervals (multi-interval and overnight days) per store
+    order = np.lexsort((opens, codes))
+    codes, opens, closes = codes[order], opens[order], closes[order]
+    if not len(codes):
+        return codes, opens, closes
+    reach = pd.Series(closes).groupby(codes).cummax().to_numpy()
+    starts = np.ones(len(codes), dtype=bool)
+    starts[1:] = (codes[1:] != codes[:-1]) | (opens[1:] > reach[:-1])
+    bounds = np.flatnonzero(starts)
+    return codes[bounds], opens[bounds], np.maximum.reduceat(reach, bounds)
+
+
+def build_schedule_index(store_ids, store_tz, business_hours, start_us, end_us):
+    """
+    Returns a ScheduleIndex for store_ids covering [start_us, end_us].
+
+    Compiled schedules are cached per store and only rebuilt when the store's
+    timezone or business hours change, or the cached window no longer covers
+    the request.
+    """
+    rows = schedule_rows(store_ids, store_tz, business_hours)
+    prints = fingerprints(rows, len(store_ids))
+
+    with _cache_lock:
+        cached = [_schedule_cache.get(store_id) for store_id in store_ids]
+    stale = np.array([
+        entry is None or entry.fingerprint != prints[i] or not entry.covers(start_us, end_us)
+        for i, entry in enumerate(cached)
+    ], dtype=bool)
+
+    if stale.any():
+        compile_end = end_us + int(SCHEDULE_PADDING / timedelta(microseconds=1))
+        stale_rows = rows[stale[rows['code'].to_numpy()]]
+        codes, opens, closes = compile_intervals(stale_rows, start_us, compile_end)
+        bounds = np.searchsorted(codes, np.arange(len(store_ids) + 1))
+        with _cache_lock:
+            for i in np.flatnonzero(stale):
+                entry = CompiledSchedule(
+                    prints[i], start_us, compile_end,
+                    opens[bounds[i]:bounds[i + 1]], closes[bounds[i]:bounds[i + 1]],
+                )
+                _schedule_cache[store_ids[i]] = entry
+                cached[i] = entry
+
+    # Cached schedules may reach past the window, so trim them to it
+    codes = np.repeat(np.arange(len(cached)), [len(entry.opens) for entry in cached])
+    opens = np.concatenate([entry.opens for entry in cached] + [np.empty(0, dtype=np.int64)])
+    closes = np.concatenate([entry.closes for entry in cached] + [np.empty(0, dtype=np.int64)])
+    keep = (closes >= start_us) & (opens <= end_us)
+    codes = codes[keep]
+    opens = np.maximum(opens[keep], start_us)
+    closes = np.minimum(closes[keep], end_us)
+    offsets = np.searchsorted(codes, np.arange(len(store_ids) + 1))
+    return ScheduleIndex(store_ids, offsets, opens, closes, start_us, end_us)
+
+
+def invalidate_schedules(store_ids=None):
+    """Drops cached schedules, for all stores or only the given ones."""
+    with _cache_lock:
+        if store_ids is None:
+            _schedule_cache.clear()
+        else:
+            for store_id in store_ids:
+                _schedule_cache.pop(store_id, None)
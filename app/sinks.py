@@ -0,0 +1,113 @@
+"""
+Outputs of the report pipeline.
+
+A sink receives the report rows one batch of stores at a time, in report
+order, and writes each batch as it arrives, so a file sink holds no more
+than one batch. close() finishes the output and returns what the sink made:
+its path, or the DataFrame for DataFrameSink.
+"""
+import gzip
+
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class ReportSink:
+    """Interface of a report output."""
+
+    def write(self, rows):
+        """Appends a DataFrame of report rows."""
+        raise NotImplementedError
+
+    def close(self):
+        """Finishes the output and returns it."""
+        raise NotImplementedError
+
+
+class CSVSink(ReportSink):
+    """
+    Report rows as CSV at path, with the header written before the first
+    batch. Every batch is flushed, so readers of the file, such as
+    /reports/{report_id}/stream, see it as soon as it is written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = self._open()
+        self._header = True
+
+    def _open(self):
+        return open(self.path, 'w', newline='')
+
+    def write(self, rows):
+        rows.to_csv(self._file, index=False, header=self._header)
+        self._header = False
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+        return self.path
+
+
+class GzipCSVSink(CSVSink):
+    """Report rows as gzip-compressed CSV at path."""
+
+    def _open(self):
+        return gzip.open(self.path, 'wt', newline='', compresslevel=6)
+
+
+class ParquetSink(ReportSink):
+    """Report rows as a Parquet file at path, one row group per batch; needs the optional pyarrow package."""
+
+    def __init__(self, path):
+        if pyarrow is None:
+            raise RuntimeError("Parquet output needs the pyarrow package")
+        self.path = path
+        self._writer = None
+
+    def write(self, rows):
+        table = pyarrow.Table.from_pandas(rows, preserve_index=False)
+        if self._writer is None:
+            self._writer = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+        # Later batches take the types of the first
+        self._writer.write_table(table.cast(self._writer.schema))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        return self.path
+
+
+class DataFrameSink(ReportSink):
+    """Report rows as one in-memory DataFrame."""
+
+    def __init__(self):
+        self._frames = []
+
+    def write(self, rows):
+        self._frames.append(rows)
+
+    def close(self):
+        if not self._frames:
+            return pd.DataFrame()
+        if len(self._frames) == 1:
+            return self._frames[0]
+        return pd.concat(self._frames, ignore_index=True)
+
+
+def create_sink(output_format, path=None):
+    """The sink for output_format: 'csv', 'csv.gz', 'parquet' or 'dataframe'."""
+    if output_format == 'csv':
+        return CSVSink(path)
+    if output_format == 'csv.gz':
+        return GzipCSVSink(path)
+    if output_format == 'parquet':
+        return ParquetSink(path)
+    if output_format == 'dataframe':
+        return DataFrameSink()
+    raise ValueError(f"Unknown report format: {output_format}")
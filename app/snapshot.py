@@ -0,0 +1,185 @@
+"""
+Report inputs as memory-mapped snapshots shared by all workers.
+
+fetch_data() normally makes every worker that runs a report fetch and decode
+its own copy of the report window's polls and both store tables. With
+REPORT_SNAPSHOTS=1 the first worker to need a data version writes those
+decoded columns as .npy files to a directory named after the version, and
+every worker maps them read-only. The poll columns back the store_status
+DataFrame without a copy, so all workers and jobs share the page cache's
+single copy. A snapshot is rebuilt only when the data version moves, and is
+saved only if the version didn't move while its inputs were fetched.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+from app.engine import factorize_stores, to_epoch_us
+from app.fetch import columns_to_frame, convert_timedelta_column
+from app.metrics import count
+from app.storage import get_storage_backend
+
+REPORT_SNAPSHOTS = os.getenv('REPORT_SNAPSHOTS', '0') == '1'
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', os.path.join('reports', 'snapshots'))
+# Older snapshots are kept for workers still reading them
+SNAPSHOT_KEEP = 2
+# Fetches tried before a report falls back to one that isn't snapshotted,
+# when the data version keeps moving while they run
+SNAPSHOT_ATTEMPTS = 3
+MANIFEST = 'snapshot.json'
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _save(directory, name, values):
+    np.save(os.path.join(directory, f'{name}.npy'), values)
+
+
+def _load(directory, name):
+    return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+
+
+def _time_seconds(values):
+    """Seconds since midnight of a column of time objects."""
+    codes, uniques = pd.factorize(values)
+    seconds = np.array([t.hour * 3600 + t.minute * 60 + t.second for t in uniques], dtype=np.int32)
+    return seconds[codes]
+
+
+def write_snapshot(directory, store_status, timezones, business_hours):
+    """Writes the report inputs to directory as .npy columns."""
+    codes, stores = factorize_stores(store_status['store_id'])
+    # In the dtype pandas keeps for that many categories, so loading doesn't recode them
+    _save(directory, 'store_code', pd.Categorical.from_codes(codes, categories=stores).codes)
+    _save(directory, 'stores', np.asarray(stores, dtype=str))
+    _save(directory, 'ts_us', to_epoch_us(store_status['timestamp_utc']))
+    _save(directory, 'active', (store_status['status'] == 'active').to_numpy())
+
+    if not timezones.empty:
+        _save(directory, 'tz_store_id', np.asarray(timezones['store_id'], dtype=str))
+        _save(directory, 'tz_timezone_str', np.asarray(timezones['timezone_str'], dtype=str))
+    if not business_hours.empty:
+        _save(directory, 'bh_store_id', np.asarray(business_hours['store_id'], dtype=str))
+        _save(directory, 'bh_day_of_week', business_hours['day_of_week'].to_numpy(dtype=np.int8))
+        _save(directory, 'bh_start_time_local', _time_seconds(business_hours['start_time_local']))
+        _save(directory, 'bh_end_time_local', _time_seconds(business_hours['end_time_local']))
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump({'polls': len(store_status), 'timezones': not timezones.empty,
+                   'business_hours': not business_hours.empty}, f)
+
+
+def read_snapshot(directory):
+    """The store_status, timezones and business_hours of a snapshot, polls mapped read-only."""
+    with open(os.path.join(directory, MANIFEST)) as f:
+        manifest = json.load(f)
+    store_status = columns_to_frame(
+        _load(directory, 'store_code'),
+        _load(directory, 'ts_us').view('datetime64[us]'),
+        _load(directory, 'active'),
+        pd.Index(np.load(os.path.join(directory, 'stores.npy')), dtype=str),
+    )
+
+    # The store tables are small, so they are plain frames like a fetch returns
+    timezones = pd.DataFrame()
+    if manifest['timezones']:
+        timezones = pd.DataFrame({
+            'store_id': np.asarray(_load(directory, 'tz_store_id')).astype(object),
+            'timezone_str': np.asarray(_load(directory, 'tz_timezone_str')).astype(object),
+        })
+    business_hours = pd.DataFrame()
+    if manifest['business_hours']:
+        business_hours = pd.DataFrame({
+            'store_id': np.asarray(_load(directory, 'bh_store_id')).astype(object),
+            'day_of_week': np.asarray(_load(directory, 'bh_day_of_week')).astype(int),
+            'start_time_local': convert_timedelta_column(
+                pd.to_timedelta(np.asarray(_load(directory, 'bh_start_time_local')), unit='s')),
+            'end_time_local': convert_timedelta_column(
+                pd.to_timedelta(np.asarray(_load(directory, 'bh_end_time_local')), unit='s')),
+        })
+    return store_status, timezones, business_hours
+
+
+class SnapshotStore:
+    """Snapshots of one storage backend's report inputs, by data version."""
+
+    def __init__(self, directory=None, storage=None):
+        self.directory = directory or SNAPSHOT_DIR
+        self.storage = storage or get_storage_backend()
+        self._lock = threading.Lock()
+        # (version, frames) mapped by this process
+        self._current = None
+
+    def _path(self, version):
+        return os.path.join(self.directory, hashlib.sha1(version.encode()).hexdigest()[:16])
+
+    def load(self):
+        """The report inputs of the current data version, building its snapshot if no worker has yet."""
+        for attempt in range(SNAPSHOT_ATTEMPTS):
+            version = self.storage.data_version()
+            with self._lock:
+                if self._current is not None and self._current[0] == version:
+                    return self._current[1]
+                path = self._path(version)
+                if not os.path.exists(os.path.join(path, MANIFEST)):
+                    moved = self._build(path, version)
+                    if moved is not None:
+                        # Writes landed during the fetch, so its frames aren't
+                        # version's; under a steady stream of them, report from
+                        # the last fetch without a snapshot
+                        count('snapshot_version_moved')
+                        if attempt == SNAPSHOT_ATTEMPTS - 1:
+                            return moved
+                        continue
+                frames = read_snapshot(path)
+                self._current = (version, frames)
+                return frames
+
+    def _build(self, path, version):
+        """
+        Writes the snapshot of version to path. Returns the fetched frames
+        instead when the data version moved during the fetch.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        # One builder across workers; the others wait and map its snapshot
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(os.path.join(path, MANIFEST)):
+                return None
+            frames = self.storage.fetch_data()
+            if self.storage.data_version() != version:
+                return frames
+            tmp = path + '.tmp'
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            write_snapshot(tmp, *frames)
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp, path)
+            self._remove_old(path)
+            return None
+
+    def _remove_old(self, newest):
+        """Keeps the SNAPSHOT_KEEP newest snapshots; workers that still map an older one keep its pages."""
+        snapshots = [
+            os.path.join(self.directory, name) for name in os.listdir(self.directory)
+            if not name.startswith('.') and not name.endswith('.tmp')
+        ]
+        snapshots.sort(key=lambda snapshot: (snapshot == newest, os.path.getmtime(snapshot)), reverse=True)
+        for snapshot in snapshots[SNAPSHOT_KEEP:]:
+            shutil.rmtree(snapshot, ignore_errors=True)
+
+
+def get_snapshot_store():
+    """The process-wide snapshot store over the backend selected by STORAGE_BACKEND."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SnapshotStore()
+    return _store
@@ -0,0 +1,51 @@
+"""
+SQLite files shared by the workers on a host.
+
+The job store, the report cache and the report store keep their tables in
+SQLite databases in WAL mode, by default all in one file, so every uvicorn
+worker sees the same jobs, cache entries and report files. SQLiteDatabase
+holds what they share: a connection per thread and the table setup.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class SQLiteDatabase:
+    """One SQLite file in WAL mode with its tables created, and a connection per thread."""
+
+    def __init__(self, path, schema=()):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in schema:
+            conn.execute(statement)
+
+    def connection(self):
+        """The connection of the calling thread, in autocommit mode."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs the block under the database write lock, so read-modify-writes
+        of concurrent workers don't get lost.
+        """
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
@@ -0,0 +1,164 @@
+"""
+Storage backends the report pipeline reads from and ingest loads into.
+
+MySQLBackend is the store_status/business_hours/timezones schema in MySQL.
+ColumnarBackend (app.columnar) keeps the same data in local day-partitioned
+column files, so reports run without the database. STORAGE_BACKEND selects
+one ('mysql' or 'columnar').
+"""
+import os
+import threading
+
+from app.db import get_connection
+from app.fetch import (
+    empty_status_frame, fetch_data_version, fetch_generation, fetch_store_count, fetch_store_generations,
+    fetch_latest_timestamp, fetch_status, fetch_store_tables, iter_store_chunks, report_window,
+)
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'mysql')
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+class StorageBackend:
+    """Interface of the report data source; timestamps are naive UTC datetimes."""
+
+    def latest_timestamp(self):
+        """Returns the newest poll time, or None without polls."""
+        raise NotImplementedError
+
+    def data_version(self):
+        """Identifies the data a report is computed from, for the report cache."""
+        raise NotImplementedError
+
+    def generation(self):
+        """Counter bumped by every load."""
+        raise NotImplementedError
+
+    def store_generations(self, store_ids):
+        """
+        Returns {store_id: generation of the last load that wrote its polls}
+        for the given stores that have polls.
+        """
+        raise NotImplementedError
+
+    def fetch_status(self, start, end, store_ids=None):
+        """
+        Polls in [start, end] as a store_status DataFrame ordered by store and
+        time, of all stores or only store_ids.
+        """
+        raise NotImplementedError
+
+    def iter_store_chunks(self, start, end, memory_limit_mb=None):
+        """Polls in [start, end] as store_status DataFrames holding complete stores."""
+        raise NotImplementedError
+
+    def count_stores(self, start, end):
+        """Number of stores with polls in [start, end]."""
+        raise NotImplementedError
+
+    def fetch_store_tables(self, store_ids=None):
+        """Returns the timezones and business_hours DataFrames, of all stores or only store_ids."""
+        raise NotImplementedError
+
+    def insert_data(self, restart=False):
+        """Loads the CSV files from the ingest data directory."""
+        raise NotImplementedError
+
+    def insert_status(self, store_status):
+        """
+        Upserts polls by (store_id, timestamp_utc) and returns the generation
+        of the write.
+        """
+        raise NotImplementedError
+
+    def fetch_data(self):
+        """Polls of the report window ending at the newest poll, timezones and business hours."""
+        latest = self.latest_timestamp()
+        if latest is None:
+            store_status = empty_status_frame()
+        else:
+            store_status = self.fetch_status(*report_window(latest))
+        timezones, business_hours = self.fetch_store_tables()
+        return store_status, timezones, business_hours
+
+
+class MySQLBackend(StorageBackend):
+    """The MySQL tables, read through the shared connection pool."""
+
+    def latest_timestamp(self):
+        with get_connection() as db:
+            return fetch_latest_timestamp(db)
+
+    def data_version(self):
+        with get_connection() as db:
+            return fetch_data_version(db)
+
+    def generation(self):
+        with get_connection() as db:
+            return fetch_generation(db)
+
+    def store_generations(self, store_ids):
+        with get_connection() as db:
+            return fetch_store_generations(db, store_ids)
+
+    def fetch_status(self, start, end, store_ids=None):
+        with get_connection() as db:
+            return fetch_status(db, start, end, store_ids)
+
+    def iter_store_chunks(self, start, end, memory_limit_mb=None):
+        with get_connection() as db:
+            yield from iter_store_chunks(db, start, end, memory_limit_mb)
+
+    def count_stores(self, start, end):
+        with get_connection() as db:
+            return fetch_store_count(db, start, end)
+
+    def fetch_store_tables(self, store_ids=None):
+        with get_connection() as db:
+            return fetch_store_tables(db, store_ids)
+
+    def insert_data(self, restart=False):
+        from app.ingest import bulk_insert_data
+        bulk_insert_data(restart=restart)
+
+    def insert_status(self, store_status):
+        from app.ingest import insert_status
+        from app.rollup import rollup_refresher
+        with get_connection() as db:
+            generation = insert_status(db, store_status)
+        rollup_refresher.notify()
+        return generation
+
+    def fetch_data(self):
+        # One connection for the whole read
+        with get_connection() as db:
+            latest = fetch_latest_timestamp(db)
+            if latest is None:
+                store_status = empty_status_frame()
+            else:
+                store_status = fetch_status(db, *report_window(latest))
+            timezones, business_hours = fetch_store_tables(db)
+        return store_status, timezones, business_hours
+
+
+def create_storage_backend(name=None):
+    """Builds the backend selected by STORAGE_BACKEND ('mysql' or 'columnar')."""
+    name = name or STORAGE_BACKEND
+    if name == 'mysql':
+        return MySQLBackend()
+    if name == 'columnar':
+        from app.columnar import ColumnarBackend
+        return ColumnarBackend()
+    raise ValueError(f"Unknown storage backend: {name}")
+
+
+def get_storage_backend():
+    """The process-wide backend selected by STORAGE_BACKEND."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_storage_backend()
+    return _backend
@@ -0,0 +1,159 @@
+"""
+Uptime/downtime of single stores and small store sets without a full report.
+
+Only the requested stores' polls, timezones and business hours are read, by
+store_id. The metrics come from a timeline index over those stores with the
+same rules and report time, the newest poll of any store, as the fixed
+report. Each store's business-hours polls are cached per process until a
+load writes polls of the store, newer, late or replaced ones alike, or its
+timezone or business hours change. Loads record a generation per store they
+write, so checking a cached store is one primary-key read however long its
+history; calls at an unchanged report time return the cached row without
+recomputing.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from app.engine import METRIC_COLUMNS, WINDOWS, business_hours_polls, timestamp_to_us
+from app.fetch import report_window
+from app.metrics import count, stage
+from app.storage import get_storage_backend
+from app.timeline import TimelineIndex, timeline_frame
+
+STORE_UPTIME_CACHE_SIZE = int(os.getenv('STORE_UPTIME_CACHE_SIZE', 10000))
+# Store ids accepted by one batch request
+MAX_BATCH_STORES = int(os.getenv('MAX_BATCH_STORES', 1000))
+
+
+class StoreEntry:
+    """Business-hours polls of one store from start_us on, and its last computed row."""
+
+    def __init__(self, validator, start_us, ts_us, active):
+        self.validator = validator
+        self.start_us = start_us
+        self.ts_us = ts_us
+        self.active = active
+        self.anchor_us = None
+        self.row = None
+
+
+def store_validators(store_ids, generations, timezones, business_hours):
+    """What a cached store depends on: the last load of its polls, its timezone and business hours."""
+    tz_rows = {}
+    if not timezones.empty:
+        for store_id, group in timezones.groupby('store_id', sort=False):
+            tz_rows[store_id] = tuple(group['timezone_str'])
+    bh_rows = {}
+    if not business_hours.empty:
+        columns = ['day_of_week', 'start_time_local', 'end_time_local']
+        for store_id, group in business_hours.groupby('store_id', sort=False):
+            bh_rows[store_id] = tuple(sorted(group[columns].itertuples(index=False, name=None)))
+    return {
+        store_id: (generations.get(store_id), tz_rows.get(store_id), bh_rows.get(store_id))
+        for store_id in store_ids
+    }
+
+
+class StoreUptimeCache:
+    """LRU of StoreEntry by store_id, shared by the threads of one worker."""
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or STORE_UPTIME_CACHE_SIZE
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, storage, store_ids, start, end, timezones, business_hours, validators):
+        """Fetches and filters the polls of store_ids in [start, end] into new entries."""
+        start_us, end_us = timestamp_to_us(start), timestamp_to_us(end)
+        entries = {
+            store_id: StoreEntry(validators[store_id], start_us, np.empty(0, dtype=np.int64),
+                                 np.empty(0, dtype=bool))
+            for store_id in store_ids
+        }
+        store_status = storage.fetch_status(start, end, store_ids)
+        if not store_status.empty:
+            ids, codes, ts_us, active = business_hours_polls(store_status, timezones, business_hours, end_us)
+            bounds = np.searchsorted(codes, np.arange(len(ids) + 1))
+            for code, store_id in enumerate(ids):
+                lo, hi = bounds[code], bounds[code + 1]
+                entries[store_id].ts_us = ts_us[lo:hi]
+                entries[store_id].active = active[lo:hi]
+        return entries
+
+    def get(self, store_ids, storage=None):
+        """
+        Returns (report time, {store_id: metrics}, unknown store_ids).
+
+        Stores without polls, timezone or business hours are unknown; known
+        stores without polls in the report window get zeros, as in the
+        per-store report.
+        """
+        storage = storage or get_storage_backend()
+        store_ids = list(dict.fromkeys(store_ids))
+
+        with stage('store_fetch'):
+            latest = storage.latest_timestamp()
+            if latest is None:
+                raise ValueError("No store status data available")
+            generations = storage.store_generations(store_ids)
+            timezones, business_hours = storage.fetch_store_tables(store_ids)
+
+        known_ids = set(generations)
+        for table in (timezones, business_hours):
+            if not table.empty:
+                known_ids.update(table['store_id'])
+        known = [store_id for store_id in store_ids if store_id in known_ids]
+        unknown = [store_id for store_id in store_ids if store_id not in known_ids]
+
+        start, end = report_window(latest)
+        start_us, end_us = timestamp_to_us(start), timestamp_to_us(end)
+        validators = store_validators(known, generations, timezones, business_hours)
+
+        with self._lock:
+            entries = {store_id: self._entries.get(store_id) for store_id in known}
+        stale = [
+            store_id for store_id, entry in entries.items()
+            if entry is None or entry.validator != validators[store_id] or entry.start_us > start_us
+        ]
+        count('store_uptime_hits', len(known) - len(stale))
+        count('store_uptime_misses', len(stale))
+        if stale:
+            with stage('store_fetch'):
+                entries.update(self._load(storage, stale, start, end, timezones, business_hours, validators))
+
+        # Entries computed at an older report time are recomputed from their polls
+        with stage('store_compute'):
+            outdated = [store_id for store_id in known if entries[store_id].anchor_us != end_us]
+            if outdated:
+                polls = [entries[store_id] for store_id in outdated]
+                index = TimelineIndex(
+                    pd.Index(outdated),
+                    np.repeat(np.arange(len(polls)), [len(entry.ts_us) for entry in polls]),
+                    np.concatenate([entry.ts_us for entry in polls]),
+                    np.concatenate([entry.active for entry in polls]),
+                )
+                frame = timeline_frame(index, [latest], WINDOWS)
+                for entry, row in zip(polls, frame[METRIC_COLUMNS].to_dict('records')):
+                    entry.anchor_us = end_us
+                    entry.row = row
+
+        with self._lock:
+            for store_id in known:
+                self._entries[store_id] = entries[store_id]
+                self._entries.move_to_end(store_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return latest, {store_id: entries[store_id].row for store_id in known}, unknown
+
+    def clear(self, store_ids=None):
+        """Drops cached stores, all of them or only the given ones."""
+        with self._lock:
+            if store_ids is None:
+                self._entries.clear()
+            else:
+                for store_id in store_ids:
+                    self._entries.pop(store_id, None)
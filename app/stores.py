@@ -0,0 +1,132 @@
+"""
+Store dictionary: store_id UUIDs to integer codes.
+
+Every store_id a load writes gets an INT store_code in the stores table.
+Polls are read as codes and become a Categorical store_id column over the
+dictionary, so a report holds each UUID once instead of once per poll.
+Codes are never reused or renumbered, so each process keeps the dictionary
+in memory and only reads the codes added since it last looked, plus any
+lower codes that committed late.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from app.db import get_pool
+
+# Store ids per dictionary lookup or insert statement
+REGISTER_BATCH_SIZE = 1000
+
+
+class StoreDictionary:
+    """
+    The stores table of one database, as store_ids in code order.
+
+    Codes from AUTO_INCREMENT can have gaps, so a code maps to a dense
+    position in store_ids, which is what Categorical codes index.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool = None
+        self._reset()
+
+    def _reset(self):
+        self._store_ids = []
+        # store_code -> position in _store_ids, -1 for unused codes
+        self._positions = np.empty(0, dtype=np.int32)
+        self._known = set()
+        self._categories = None
+
+    def _check_pool(self):
+        # A different pool may be a different database (benchmarks swap them)
+        pool = get_pool()
+        if pool is not self._pool:
+            self._pool = pool
+            self._reset()
+
+    def _refresh(self, db, codes):
+        """
+        Reads the codes added since the last refresh, and any of codes still
+        unknown: codes from concurrent loads can commit out of order, so a
+        lower code may appear after higher ones were read.
+        """
+        cursor = db.cursor()
+        cursor.execute(
+            "SELECT store_code, store_id FROM stores WHERE store_code >= %s ORDER BY store_code",
+            (len(self._positions),)
+        )
+        rows = cursor.fetchall()
+        holes = np.unique(codes[codes < len(self._positions)])
+        holes = holes[self._positions[holes] < 0]
+        for start in range(0, len(holes), REGISTER_BATCH_SIZE):
+            batch = [int(code) for code in holes[start:start + REGISTER_BATCH_SIZE]]
+            cursor.execute(
+                f"SELECT store_code, store_id FROM stores WHERE store_code IN ({', '.join(['%s'] * len(batch))})",
+                tuple(batch)
+            )
+            rows.extend(cursor.fetchall())
+        cursor.close()
+        if not rows:
+            return
+        codes, store_ids = zip(*rows)
+        positions = np.full(max(max(codes) + 1, len(self._positions)), -1, dtype=np.int32)
+        positions[:len(self._positions)] = self._positions
+        positions[list(codes)] = np.arange(len(self._store_ids), len(self._store_ids) + len(codes))
+        self._positions = positions
+        self._store_ids.extend(store_ids)
+        self._known.update(store_ids)
+        self._categories = None
+
+    def _unknown(self, codes):
+        return len(codes) and (codes.max() >= len(self._positions) or (self._positions[codes] < 0).any())
+
+    def positions(self, db, codes):
+        """Dense positions of store codes read from the database."""
+        codes = np.asarray(codes, dtype=np.int64)
+        with self._lock:
+            self._check_pool()
+            if self._unknown(codes):
+                self._refresh(db, codes)
+                # A missing code would turn its store's polls into NaN store_ids
+                if self._unknown(codes):
+                    raise RuntimeError("Store codes missing from the stores table")
+            return self._positions[codes]
+
+    def categories(self):
+        """store_ids by position, the categories of fetched store_id columns."""
+        with self._lock:
+            if self._categories is None:
+                self._categories = pd.Index(self._store_ids, dtype=str)
+            return self._categories
+
+    def register(self, db, store_ids):
+        """
+        Adds the store_ids missing from the stores table, in the caller's
+        transaction so they commit with the rows that use them.
+        """
+        with self._lock:
+            self._check_pool()
+            candidates = [store_id for store_id in pd.unique(pd.Series(store_ids, dtype=object))
+                          if store_id is not None and store_id not in self._known]
+        if not candidates:
+            return
+
+        cursor = db.cursor()
+        for start in range(0, len(candidates), REGISTER_BATCH_SIZE):
+            batch = candidates[start:start + REGISTER_BATCH_SIZE]
+            placeholders = ", ".join(["%s"] * len(batch))
+            # Only ids that are really new, so AUTO_INCREMENT isn't spent on duplicates
+            cursor.execute(f"SELECT store_id FROM stores WHERE store_id IN ({placeholders})", tuple(batch))
+            existing = {row[0] for row in cursor.fetchall()}
+            missing = [store_id for store_id in batch if store_id not in existing]
+            if missing:
+                cursor.execute(
+                    "INSERT IGNORE INTO stores (store_id) VALUES " + ", ".join(["(%s)"] * len(missing)),
+                    tuple(missing)
+                )
+        cursor.close()
+
+
+store_dictionary = StoreDictionary()
@@ -0,0 +1,137 @@
+"""
+Streaming ingest of polls posted to /status.
+
+Posted batches are validated and deduplicated on (store_id, timestamp_utc),
+the last poll winning like the upserts of the CSV loaders, then queued for
+one writer thread. The writer group-commits whatever arrived within
+STATUS_FLUSH_INTERVAL_MS (or STATUS_FLUSH_SIZE polls) as one batched upsert
+through LiveState.ingest, which also folds the polls into the in-memory
+report state. Requests wait for the commit that holds their polls.
+Out-of-order polls need no special handling: storage upserts by key, the
+state re-sorts the stores they belong to, and their rollup hours are
+refreshed in the background like any others.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import pandas as pd
+
+from app.fetch import STATUS_COLUMNS, STATUS_VALUES
+from app.live import get_live_state
+from app.metrics import count, log_event, stage
+
+# Polls accepted by one request
+MAX_STATUS_BATCH = int(os.getenv('MAX_STATUS_BATCH', 10000))
+STATUS_FLUSH_SIZE = int(os.getenv('STATUS_FLUSH_SIZE', 5000))
+STATUS_FLUSH_INTERVAL_MS = int(os.getenv('STATUS_FLUSH_INTERVAL_MS', 50))
+
+
+def parse_polls(polls):
+    """
+    Validates posted polls into a store_status DataFrame.
+
+    Returns the frame, with one row per (store_id, timestamp_utc), and the
+    number of duplicates dropped from the batch.
+    """
+    if not polls:
+        raise ValueError("No polls given")
+    if any(not isinstance(poll, dict) for poll in polls):
+        raise ValueError("Polls must be objects with store_id, timestamp_utc and status")
+    frame = pd.DataFrame.from_records(polls, columns=STATUS_COLUMNS)
+    if frame.isna().any().any():
+        raise ValueError("Every poll needs store_id, timestamp_utc and status")
+
+    frame['store_id'] = frame['store_id'].astype(str)
+    invalid = ~frame['status'].isin(STATUS_VALUES)
+    if invalid.any():
+        raise ValueError(f"Invalid status: {frame['status'][invalid].iloc[0]!r}")
+    # Same format as the CSV files, with or without the ' UTC' suffix
+    timestamps = pd.to_datetime(
+        frame['timestamp_utc'].astype(str).str.replace(' UTC', ''), utc=True, format='ISO8601', errors='coerce'
+    )
+    if timestamps.isna().any():
+        raise ValueError(f"Invalid timestamp_utc: {frame['timestamp_utc'][timestamps.isna()].iloc[0]!r}")
+    frame['timestamp_utc'] = timestamps
+
+    unique = frame.drop_duplicates(['store_id', 'timestamp_utc'], keep='last')
+    return unique.reset_index(drop=True), len(frame) - len(unique)
+
+
+class StatusIngestor:
+    """Group-commits posted polls from one writer thread."""
+
+    def __init__(self, live=None, flush_size=None, flush_interval_ms=None):
+        self._live = live
+        self.flush_size = flush_size or STATUS_FLUSH_SIZE
+        self.flush_interval = (flush_interval_ms or STATUS_FLUSH_INTERVAL_MS) / 1000
+        self._cond = threading.Condition()
+        # (frame, future) per request, and when the oldest one arrived
+        self._pending = []
+        self._pending_rows = 0
+        self._first_arrival = None
+        self._stopped = False
+        self._thread = None
+
+    def submit(self, store_status):
+        """Queues polls for the next commit; the future resolves to its generation."""
+        future = Future()
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("Status ingest is shut down")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='status-writer', daemon=True)
+                self._thread.start()
+            if not self._pending:
+                self._first_arrival = time.monotonic()
+            self._pending.append((store_status, future))
+            self._pending_rows += len(store_status)
+            self._cond.notify()
+        return future
+
+    def _take_batch(self):
+        """Waits until a commit is due and takes its requests; None once shut down and drained."""
+        with self._cond:
+            while not self._pending and not self._stopped:
+                self._cond.wait()
+            if not self._pending:
+                return None
+            while self._pending_rows < self.flush_size and not self._stopped:
+                remaining = self._first_arrival + self.flush_interval - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, self._pending, self._pending_rows = self._pending, [], 0
+            return batch
+
+    def _run(self):
+        live = self._live or get_live_state()
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            # Later requests win on polls posted more than once
+            store_status = pd.concat([frame for frame, _ in batch], ignore_index=True) \
+                .drop_duplicates(['store_id', 'timestamp_utc'], keep='last')
+            try:
+                with stage('ingest'):
+                    generation = live.ingest(store_status)
+            except Exception as e:
+                log_event('status_write_failed', level=logging.ERROR, polls=len(store_status), error=repr(str(e)))
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            count('ingested_polls', len(store_status))
+            for _, future in batch:
+                future.set_result(generation)
+
+    def shutdown(self):
+        """Commits what is queued and stops the writer."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
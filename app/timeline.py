@@ -0,0 +1,222 @@
+"""
+Uptime/downtime over arbitrary windows, bucket series and as-of anchors.
+
+A TimelineIndex keeps the business-hours polls of every store in store and
+time order with running uptime/downtime sums over the intervals between
+consecutive polls. The calculate_time rules only look at the polls inside a
+window: the first one closes the interval from the window start, the ones
+after it add the intervals between polls, and the last status runs to the
+window end. So a window is two binary searches for its first and last poll,
+one prefix-sum difference and the two edges, whatever its length, and a
+series or a batch of anchors is the same arithmetic on arrays of windows.
+"""
+import re
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from app.engine import WINDOWS, business_hours_polls, timestamp_to_us, to_minutes
+from app.fetch import FETCH_LOOKBACK
+from app.metrics import stage
+
+WINDOW_PATTERN = re.compile(r'^\s*(\d+)\s*([mhdw])\s*$')
+WINDOW_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+# Rows of one series or anchor report, to keep a typo'd bucket from filling memory
+MAX_REPORT_ROWS = 50_000_000
+
+
+def us(delta):
+    return int(delta / timedelta(microseconds=1))
+
+
+def parse_window(spec):
+    """Parses a duration such as '90m', '3h', '30d' or '2w' into (label, timedelta)."""
+    match = WINDOW_PATTERN.match(spec)
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid window: {spec!r}")
+    value, unit = int(match.group(1)), match.group(2)
+    return f"last_{value}{unit}", timedelta(**{WINDOW_UNITS[unit]: value})
+
+
+def parse_anchor(value):
+    """An as-of time as naive UTC; times without an offset are taken as UTC."""
+    try:
+        anchor = pd.Timestamp(value)
+    except ValueError:
+        raise ValueError(f"Invalid as_of time: {value!r}")
+    if anchor is pd.NaT:
+        raise ValueError(f"Invalid as_of time: {value!r}")
+    if anchor.tzinfo is not None:
+        anchor = anchor.tz_convert('UTC').tz_localize(None)
+    return anchor.to_pydatetime()
+
+
+class TimelineIndex:
+    """
+    Business-hours polls of many stores with per-store prefix sums.
+
+    Polls of store i are at positions offsets[i]:offsets[i + 1], in time
+    order. cum_up[j] and cum_down[j] sum the intervals between consecutive
+    polls of the store up to poll j, each counted towards the status of the
+    poll that closes it. Like ScheduleIndex, lookups search one key that
+    combines the store code and the time.
+    """
+
+    def __init__(self, store_ids, codes, ts_us, active):
+        self.store_ids = store_ids
+        self.ts_us = ts_us
+        self.active = active
+        self.offsets = np.searchsorted(codes, np.arange(len(store_ids) + 1))
+
+        first = np.ones(len(codes), dtype=bool)
+        first[1:] = codes[1:] != codes[:-1]
+        interval = np.zeros(len(ts_us), dtype=np.int64)
+        interval[1:] = ts_us[1:] - ts_us[:-1]
+        interval[first] = 0
+        self.cum_up = np.cumsum(np.where(active, interval, 0))
+        self.cum_down = np.cumsum(np.where(active, 0, interval))
+
+        # Times outside the polls clip to one microsecond past either end
+        self._lo = int(ts_us.min()) - 1 if len(ts_us) else 0
+        self._hi = int(ts_us.max()) + 1 if len(ts_us) else 0
+        self._span = self._hi - self._lo + 1
+        self._keyed = len(store_ids) * self._span < 2 ** 62
+        if self._keyed:
+            self._keys = codes.astype(np.int64) * self._span + (ts_us - self._lo)
+        else:
+            self._codes = codes
+
+    def _position(self, codes, ts_us, side):
+        """Position of the first poll of each store after ts_us ('right') or at or after it ('left')."""
+        codes = np.asarray(codes, dtype=np.int64)
+        ts_us = np.asarray(ts_us, dtype=np.int64)
+        if self._keyed:
+            keys = codes * self._span + (np.clip(ts_us, self._lo, self._hi) - self._lo)
+            return np.searchsorted(self._keys, keys, side=side)
+        position = np.empty(len(codes), dtype=np.int64)
+        for code in np.unique(codes):
+            sel = codes == code
+            lo, hi = self.offsets[code], self.offsets[code + 1]
+            position[sel] = lo + np.searchsorted(self.ts_us[lo:hi], ts_us[sel], side=side)
+        return position
+
+    def has_polls(self, codes, start_us, end_us):
+        """Flags the stores with a business-hours poll inside [start_us, end_us]."""
+        return self._position(codes, end_us, 'right') > self._position(codes, start_us, 'left')
+
+    def window_totals(self, codes, start_us, end_us, has_polls):
+        """
+        Uptime/downtime microseconds of each (store, start, end) query.
+
+        Same rules as engine.window_totals; has_polls marks the stores that
+        count as down for a whole window without any poll inside it.
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        start_us = np.broadcast_to(np.asarray(start_us, dtype=np.int64), codes.shape)
+        end_us = np.broadcast_to(np.asarray(end_us, dtype=np.int64), codes.shape)
+        uptime = np.zeros(len(codes), dtype=np.int64)
+        downtime = np.zeros(len(codes), dtype=np.int64)
+
+        lo = self._position(codes, start_us, 'left')
+        hi = self._position(codes, end_us, 'right')
+        found = hi > lo
+        first, last = lo[found], hi[found] - 1
+        head = self.ts_us[first] - start_us[found]
+        tail = end_us[found] - self.ts_us[last]
+        first_active, last_active = self.active[first], self.active[last]
+        uptime[found] = (
+            np.where(first_active, head, 0) + self.cum_up[last] - self.cum_up[first]
+            + np.where(last_active, tail, 0)
+        )
+        downtime[found] = (
+            np.where(first_active, 0, head) + self.cum_down[last] - self.cum_down[first]
+            + np.where(last_active, 0, tail)
+        )
+
+        empty = ~found & has_polls
+        downtime[empty] = end_us[empty] - start_us[empty]
+        return uptime, downtime
+
+
+def build_timeline(store_status, timezones, business_hours, end_us):
+    """Filters the polls to business hours and indexes them."""
+    store_ids, codes, ts_us, active = business_hours_polls(store_status, timezones, business_hours, end_us)
+    return TimelineIndex(store_ids, codes, ts_us, active)
+
+
+def timeline_frame(index, anchors, windows, bucket=None, with_anchor=False):
+    """
+    Report rows for every store and anchor.
+
+    Without a bucket each row has an uptime/downtime pair per window ending
+    at the anchor. With one, the longest window before each anchor is cut
+    into buckets of that size, aligned to end at the anchor, and each bucket
+    becomes a row with its uptime and downtime. A store counts as down for a
+    window without polls if it has a poll within the longest window plus the
+    fetch lookback before the anchor, as in the fixed report.
+    """
+    n_stores = len(index.store_ids)
+    span_us = us(max(delta for _, delta in windows))
+    anchors_us = np.array([timestamp_to_us(anchor) for anchor in anchors], dtype=np.int64)
+
+    # One query per (store, anchor), stores outermost
+    codes = np.repeat(np.arange(n_stores), len(anchors_us))
+    ends = np.tile(anchors_us, n_stores)
+    has_polls = index.has_polls(codes, ends - span_us - us(FETCH_LOOKBACK), ends)
+
+    columns = {'store_id': np.asarray(index.store_ids)[codes]}
+    if with_anchor:
+        columns['as_of'] = pd.to_datetime(ends, unit='us')
+
+    if bucket is None:
+        for label, delta in windows:
+            uptime, downtime = index.window_totals(codes, ends - us(delta), ends, has_polls)
+            columns[f'uptime_{label}'] = to_minutes(uptime)
+            columns[f'downtime_{label}'] = to_minutes(downtime)
+        return pd.DataFrame(columns)
+
+    bucket_us = us(bucket)
+    n_buckets = -(-span_us // bucket_us)
+    if len(codes) * n_buckets > MAX_REPORT_ROWS:
+        raise ValueError(f"A {n_buckets}-bucket series for {len(codes)} store/anchor pairs is too large")
+    starts = np.repeat(ends, n_buckets) - (n_buckets - np.tile(np.arange(n_buckets), len(ends))) * bucket_us
+    uptime, downtime = index.window_totals(
+        np.repeat(codes, n_buckets), starts, starts + bucket_us, np.repeat(has_polls, n_buckets)
+    )
+    columns = {name: np.repeat(values, n_buckets) for name, values in columns.items()}
+    columns['bucket_start'] = pd.to_datetime(starts, unit='us')
+    columns['uptime'] = to_minutes(uptime)
+    columns['downtime'] = to_minutes(downtime)
+    return pd.DataFrame(columns)
+
+
+def timeline_report(storage, windows=None, bucket=None, as_of=None):
+    """
+    Computes a report for custom windows, a bucket series or as-of anchors.
+
+    windows are duration specs ('3h', '30d', ...) and default to the last
+    hour, day and week of the fixed report. as_of lists anchor times for
+    backfills; without it the report ends at the newest poll. The polls of
+    all anchors are fetched, filtered and indexed once.
+    """
+    windows = list(dict.fromkeys(parse_window(spec) for spec in windows)) if windows else list(WINDOWS)
+    bucket = parse_window(bucket)[1] if bucket else None
+    anchors = sorted({parse_anchor(value) for value in as_of}) if as_of else None
+
+    with stage('fetch'):
+        if anchors is None:
+            latest = storage.latest_timestamp()
+            if latest is None:
+                raise ValueError("No store status data available")
+            anchors = [latest]
+        span = max(delta for _, delta in windows)
+        store_status = storage.fetch_status(anchors[0] - span - FETCH_LOOKBACK, anchors[-1])
+        timezones, business_hours = storage.fetch_store_tables()
+
+    if store_status.empty:
+        raise ValueError("No store status data available")
+
+    index = build_timeline(store_status, timezones, business_hours, timestamp_to_us(anchors[-1]))
+    with stage('compute'):
+        return timeline_frame(index, anchors, windows, bucket, with_anchor=as_of is not None)
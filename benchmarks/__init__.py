@@ -0,0 +1 @@
+"""Synthetic-data benchmarks for ingest, fetch and report generation."""
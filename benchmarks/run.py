@@ -0,0 +1,300 @@
+"""
+Benchmarks ingest, fetch and report generation on synthetic data.
+
+    python -m benchmarks.run --size small --save
+    python -m benchmarks.run --size small --compare
+
+Data comes from benchmarks.synthetic and is loaded into a SQLite stand-in for
+MySQL, so no database server is needed. Every stage runs in a fresh process,
+which makes peak RSS a per-stage number. Report stages count the polls in
+the report window as their rows. ingest:status posts an hour of new polls
+for every store, shuffled and with some late ones, through the /status
+writer from concurrent requests, on a copy of the database.
+
+--save writes the results as a JSON baseline; --compare checks a run against
+one and exits with status 1 when a stage got slower or bigger than the
+tolerance allows.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+DEFAULT_STAGES = [
+    'ingest', 'fetch', 'report:vectorized', 'report:streaming', 'report:parallel', 'report:rollup',
+    'report:timeline', 'ingest:status',
+]
+# Polls per POST /status request and requests in flight in ingest:status
+STATUS_REQUEST_POLLS = 100
+STATUS_CLIENTS = 8
+# The row-by-row loaders and the per-store engine, slow beyond small sizes
+LEGACY_STAGES = ['ingest:legacy', 'report:legacy']
+# The local columnar storage backend instead of the database
+COLUMNAR_STAGES = ['ingest:columnar', 'fetch:columnar', 'report:columnar']
+STAGES = DEFAULT_STAGES + LEGACY_STAGES + COLUMNAR_STAGES
+
+
+def _polls_in_report_window():
+    from app.db import get_connection
+    from app.fetch import fetch_latest_timestamp, report_window
+
+    with get_connection() as db:
+        latest = fetch_latest_timestamp(db)
+        if latest is None:
+            return 0
+        cursor = db.cursor()
+        cursor.execute(
+            "SELECT COUNT(*) FROM store_status WHERE timestamp_utc BETWEEN %s AND %s", report_window(latest)
+        )
+        count = cursor.fetchone()[0]
+        cursor.close()
+    return count
+
+
+def _status_polls(seed):
+    """The polls ingest:status posts, as JSON request bodies hold them."""
+    import numpy as np
+    import pandas as pd
+    from app.db import get_connection
+    from app.fetch import fetch_latest_timestamp
+
+    with get_connection() as db:
+        latest = pd.Timestamp(fetch_latest_timestamp(db))
+        cursor = db.cursor()
+        cursor.execute("SELECT store_id FROM stores")
+        store_ids = np.array([row[0] for row in cursor.fetchall()], dtype=object)
+        cursor.close()
+
+    rng = np.random.default_rng(seed)
+    # Every 5 minutes for the next hour, and a tenth of them late by up to a day
+    offsets = np.tile(np.arange(1, 13) * 300, len(store_ids)).astype(np.int64)
+    late = rng.random(len(offsets)) < 0.1
+    offsets[late] = -rng.integers(60, 86_400, late.sum())
+    polls = [
+        {'store_id': store_id, 'timestamp_utc': str(latest + pd.Timedelta(seconds=int(offset))),
+         'status': 'active' if active else 'inactive'}
+        for store_id, offset, active in zip(np.repeat(store_ids, 12), offsets, rng.random(len(offsets)) < 0.9)
+    ]
+    return [polls[i] for i in rng.permutation(len(polls))]
+
+
+def _post_status(polls):
+    """Posts polls from concurrent requests through the /status writer and waits for their commits."""
+    from app.streaming import StatusIngestor, parse_polls
+
+    ingestor = StatusIngestor()
+
+    def post(start):
+        store_status, _ = parse_polls(polls[start:start + STATUS_REQUEST_POLLS])
+        ingestor.submit(store_status).result()
+
+    with ThreadPoolExecutor(STATUS_CLIENTS) as clients:
+        list(clients.map(post, range(0, len(polls), STATUS_REQUEST_POLLS)))
+    ingestor.shutdown()
+
+
+def _generate(workdir, n_stores, weeks, seed, queue):
+    try:
+        from benchmarks.synthetic import generate
+        queue.put(('ok', generate(os.path.join(workdir, 'data'), n_stores, weeks, seed)))
+    except Exception:
+        queue.put(('error', traceback.format_exc()))
+
+
+def _stage(stage, workdir, seed, queue):
+    """Runs one stage in this process and reports its rows, wall time and peak RSS."""
+    try:
+        os.chdir(workdir)
+        os.environ['INGEST_DATA_DIR'] = os.path.join(workdir, 'data')
+        if stage in COLUMNAR_STAGES:
+            os.environ['STORAGE_BACKEND'] = 'columnar'
+            os.environ['COLUMNAR_STORE_PATH'] = os.path.join(workdir, 'columnar')
+        from app.db import use_pool
+        from benchmarks.sqlite_backend import SQLiteBackend
+
+        database = 'legacy.sqlite3' if stage == 'ingest:legacy' else 'bench.sqlite3'
+        if stage == 'ingest:status':
+            # Leaves the loaded database as it is for the other stages
+            database = 'status.sqlite3'
+            source = sqlite3.connect(os.path.join(workdir, 'bench.sqlite3'))
+            target = sqlite3.connect(os.path.join(workdir, database))
+            source.backup(target)
+            source.close()
+            target.close()
+        use_pool(SQLiteBackend(os.path.join(workdir, database)))
+
+        from app import ingest
+        from app.main import generate_report_df
+        from app.storage import get_storage_backend
+        from app.utils import fetch_data
+
+        if stage.startswith('report:'):
+            rows = _polls_in_report_window()
+        elif stage == 'ingest:status':
+            polls = _status_polls(seed)
+            rows = len(polls)
+
+        started = time.perf_counter()
+        if stage == 'ingest':
+            ingest.bulk_insert_data(restart=True)
+        elif stage == 'ingest:legacy':
+            ingest.insert_data()
+        elif stage == 'ingest:columnar':
+            get_storage_backend().insert_data(restart=True)
+        elif stage == 'ingest:status':
+            _post_status(polls)
+        elif stage in ('fetch', 'fetch:columnar'):
+            store_status, _, _ = fetch_data()
+            rows = len(store_status)
+        elif stage == 'report:columnar':
+            generate_report_df(engine='vectorized')
+        elif stage == 'report:timeline':
+            # Hourly series over the report week from the timeline index
+            generate_report_df(windows=['1w'], bucket='1h')
+        else:
+            generate_report_df(engine=stage.split(':', 1)[1])
+        seconds = time.perf_counter() - started
+
+        if stage in ('ingest', 'ingest:legacy', 'ingest:columnar'):
+            rows = sum(1 for _ in open(ingest.STORE_STATUS_CSV)) - 1
+        # ru_maxrss is in kilobytes on Linux
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        queue.put(('ok', {
+            'seconds': round(seconds, 3),
+            'peak_rss_mb': round(peak_rss_mb, 1),
+            'rows': rows,
+            'rows_per_sec': round(rows / seconds, 1) if seconds > 0 else None,
+        }))
+    except Exception:
+        queue.put(('error', traceback.format_exc()))
+
+
+def _run_child(target, *args):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=target, args=args + (queue,))
+    process.start()
+    status, result = queue.get()
+    process.join()
+    if status != 'ok':
+        raise RuntimeError(result)
+    return result
+
+
+def run(n_stores, weeks, seed=0, stages=None, workdir=None, quiet=False):
+    """Generates the data, runs the stages and returns the results with their config."""
+    from benchmarks.sqlite_backend import SQLiteBackend
+
+    stages = stages or DEFAULT_STAGES
+    keep = workdir is not None
+    workdir = os.path.abspath(workdir or tempfile.mkdtemp(prefix='store_monitoring_bench_'))
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        if not quiet:
+            print(f"Generating {n_stores} stores x {weeks} weeks (seed {seed}) in {workdir}")
+        counts = _run_child(_generate, workdir, n_stores, weeks, seed)
+        for database in ('bench.sqlite3', 'legacy.sqlite3'):
+            path = os.path.join(workdir, database)
+            if os.path.exists(path):
+                os.remove(path)
+            SQLiteBackend(path).create_tables()
+
+        results = {}
+        # Everything else reads what the bulk ingest loaded, or the columnar ingest for columnar stages
+        ingests = ['ingest'] + (['ingest:columnar'] if set(stages) & set(COLUMNAR_STAGES) else [])
+        for stage in ingests + [stage for stage in stages if stage not in ingests]:
+            result = _run_child(_stage, stage, workdir, seed)
+            if stage in stages:
+                results[stage] = result
+                if not quiet:
+                    print(f"  {stage:<20} {result['seconds']:>9.3f} s {result['peak_rss_mb']:>9.1f} MB"
+                          f" {result['rows_per_sec'] or 0:>14,.0f} rows/s")
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'config': {'stores': n_stores, 'weeks': weeks, 'seed': seed, 'rows': counts},
+        'stages': results,
+    }
+
+
+def compare(current, baseline, tolerance=0.25, rss_tolerance=0.25):
+    """Returns a line for every stage whose wall time or peak RSS regressed past the tolerance."""
+    if current['config'] != baseline['config']:
+        raise ValueError(f"Baseline was recorded for {baseline['config']}, not {current['config']}")
+    regressions = []
+    for stage, base in baseline['stages'].items():
+        result = current['stages'].get(stage)
+        if result is None:
+            continue
+        if result['seconds'] > base['seconds'] * (1 + tolerance):
+            regressions.append(f"{stage}: {result['seconds']:.3f} s vs baseline {base['seconds']:.3f} s")
+        if result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + rss_tolerance):
+            regressions.append(f"{stage}: {result['peak_rss_mb']:.1f} MB vs baseline {base['peak_rss_mb']:.1f} MB")
+    return regressions
+
+
+def main(argv=None):
+    from benchmarks.synthetic import SIZES
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', choices=sorted(SIZES), default='small')
+    parser.add_argument('--stores', type=int, help="Overrides the store count of --size")
+    parser.add_argument('--weeks', type=int, help="Overrides the weeks of polls of --size")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', default=','.join(DEFAULT_STAGES),
+                        help=f"Comma-separated subset of: {', '.join(STAGES)}")
+    parser.add_argument('--save', nargs='?', const='', help="Write the results as a baseline")
+    parser.add_argument('--compare', nargs='?', const='', help="Fail if the results regress from a baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed wall time increase (0.25 = 25%%)")
+    parser.add_argument('--rss-tolerance', type=float, default=0.25, help="Allowed peak RSS increase")
+    parser.add_argument('--workdir', help="Keep the generated data and databases here")
+    args = parser.parse_args(argv)
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    n_stores, weeks = SIZES[args.size]
+    n_stores = args.stores or n_stores
+    weeks = args.weeks or weeks
+    label = args.size if (n_stores, weeks) == SIZES[args.size] else f"{n_stores}x{weeks}w"
+    default_path = os.path.join(BASELINE_DIR, f"{label}.json")
+
+    results = run(n_stores, weeks, args.seed, stages, args.workdir)
+
+    if args.save is not None:
+        path = args.save or default_path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {path}")
+
+    if args.compare is not None:
+        path = args.compare or default_path
+        with open(path) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.rss_tolerance)
+        if regressions:
+            print("Regressions against " + path + ":")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"No regressions against {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+"""
+SQLite stand-in for the MySQL connection pool.
+
+Covers the subset of mysql.connector and MySQL SQL the app uses: %s
+placeholders, INSERT ... ON DUPLICATE KEY UPDATE, INSERT IGNORE, REPLACE INTO,
+GET_LOCK/RELEASE_LOCK, dictionary and unbuffered cursors, and DATETIME/TIME
+columns read back as datetime/timedelta.
+"""
+import fcntl
+import re
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS store_status (
+        store_id TEXT NOT NULL,
+        timestamp_utc DATETIME NOT NULL,
+        status TEXT NOT NULL,
+        PRIMARY KEY (store_id, timestamp_utc)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_timestamp_store ON store_status (timestamp_utc, store_id)",
+    """
+    CREATE TABLE IF NOT EXISTS business_hours (
+        store_id TEXT NOT NULL,
+        day_of_week INTEGER NOT NULL,
+        start_time_local TIME NOT NULL,
+        end_time_local TIME NOT NULL,
+        PRIMARY KEY (store_id, day_of_week, start_time_local)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS timezones (
+        store_id TEXT NOT NULL PRIMARY KEY,
+        timezone_str TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stores (
+        store_code INTEGER PRIMARY KEY AUTOINCREMENT,
+        store_id TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS store_status_hourly (
+        store_id TEXT NOT NULL,
+        hour_start DATETIME NOT NULL,
+        poll_count INTEGER NOT NULL,
+        first_ts DATETIME NOT NULL,
+        first_active INTEGER NOT NULL,
+        last_ts DATETIME NOT NULL,
+        last_active INTEGER NOT NULL,
+        inner_up_us INTEGER NOT NULL,
+        inner_down_us INTEGER NOT NULL,
+        PRIMARY KEY (store_id, hour_start)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_hour_start ON store_status_hourly (hour_start)",
+    """
+    CREATE TABLE IF NOT EXISTS store_status_hourly_dirty (
+        store_id TEXT NOT NULL,
+        hour_start DATETIME NOT NULL,
+        generation INTEGER NOT NULL,
+        PRIMARY KEY (store_id, hour_start)
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS store_generations (store_id TEXT NOT NULL PRIMARY KEY, generation INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS ingest_state (id INTEGER NOT NULL PRIMARY KEY, generation INTEGER NOT NULL)",
+]
+
+ON_DUPLICATE = re.compile(r'ON DUPLICATE KEY UPDATE\s+(.*)$', re.S)
+VALUES_REF = re.compile(r'VALUES\((\w+)\)')
+# Aggregates lose their declared type in SQLite; name it in the column alias instead
+TIMESTAMP_AGGREGATE = re.compile(r'\b(MIN|MAX)\((timestamp_utc)\)')
+
+
+def _format_datetime(value):
+    # Fixed width, so text comparisons order like the timestamps
+    return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def _parse_datetime(value):
+    return datetime.fromisoformat(value.decode())
+
+
+def _parse_time(value):
+    hours, minutes, seconds = value.decode().split(':')
+    return timedelta(hours=int(hours), minutes=int(minutes), seconds=float(seconds))
+
+
+sqlite3.register_adapter(datetime, _format_datetime)
+sqlite3.register_adapter(pd.Timestamp, _format_datetime)
+sqlite3.register_adapter(np.int64, int)
+sqlite3.register_adapter(np.int32, int)
+sqlite3.register_adapter(np.bool_, int)
+sqlite3.register_adapter(np.float64, float)
+sqlite3.register_converter('DATETIME', _parse_datetime)
+sqlite3.register_converter('TIME', _parse_time)
+
+
+def translate(query):
+    """Rewrites the MySQL dialect used by the app into SQLite."""
+    query = query.replace('%s', '?').replace('INSERT IGNORE', 'INSERT OR IGNORE')
+    match = ON_DUPLICATE.search(query)
+    if match:
+        updates = VALUES_REF.sub(r'excluded.\1', match.group(1))
+        query = query[:match.start()] + 'ON CONFLICT DO UPDATE SET ' + updates
+    return TIMESTAMP_AGGREGATE.sub(r'\1(\2) AS "\1 [DATETIME]"', query)
+
+
+class SQLiteCursor:
+    def __init__(self, connection, dictionary=False):
+        self._connection = connection
+        self._cursor = connection._conn.cursor()
+        self._dictionary = dictionary
+
+    def execute(self, query, params=()):
+        self._cursor.execute(translate(query), tuple(params or ()))
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def _convert(self, rows):
+        if self._dictionary:
+            names = [column[0] for column in self._cursor.description]
+            return [dict(zip(names, row)) for row in rows]
+        return rows
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return self._convert([row])[0] if row is not None else None
+
+    def fetchall(self):
+        return self._convert(self._cursor.fetchall())
+
+    def fetchmany(self, size):
+        return self._convert(self._cursor.fetchmany(size))
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """The parts of a pooled mysql.connector connection the app uses."""
+
+    unread_result = False
+
+    def __init__(self, path):
+        self._path = path
+        self._conn = sqlite3.connect(
+            path, timeout=60, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+            check_same_thread=False,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Named locks held by this connection, as flocks on files next to the database
+        self._locks = {}
+        self._conn.create_function('GET_LOCK', 2, self._get_lock)
+        self._conn.create_function('RELEASE_LOCK', 1, self._release_lock)
+
+    def _get_lock(self, name, timeout):
+        if name in self._locks:
+            return 1
+        f = open(f"{self._path}.{name}.lock", 'a')
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # A negative timeout waits forever, as in MySQL
+                if 0 <= timeout and deadline <= time.monotonic():
+                    f.close()
+                    return 0
+                time.sleep(0.01)
+                continue
+            self._locks[name] = f
+            return 1
+
+    def _release_lock(self, name):
+        f = self._locks.pop(name, None)
+        if f is None:
+            return None
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+        return 1
+
+    def cursor(self, dictionary=False, buffered=True):
+        return SQLiteCursor(self, dictionary)
+
+    @property
+    def in_transaction(self):
+        return self._conn.in_transaction
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        pass
+
+    def consume_results(self):
+        pass
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        for name in list(self._locks):
+            self._release_lock(name)
+        self._conn.close()
+
+
+class SQLiteBackend:
+    """Pool stand-in for app.db.use_pool; each checkout opens a connection to one database file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def create_tables(self):
+        connection = SQLiteConnection(self.path)
+        for statement in SCHEMA:
+            connection._conn.execute(statement)
+        connection.commit()
+        connection.close()
+
+    def get_connection(self):
+        return SQLiteConnection(self.path)
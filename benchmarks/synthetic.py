@@ -0,0 +1,133 @@
+"""
+Deterministic synthetic input data in the format of the CSV files in data/.
+
+Every store polls about once an hour with some hours missing, a few stores
+lose whole days, and availability differs per store. Timezones mix several
+regions and leave some stores without one (and a few with an invalid name);
+business hours include stores without any, split shifts and overnight
+shifts. The same seed and sizes always produce the same files.
+"""
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+HOUR_US = 3_600_000_000
+DAY_US = 24 * HOUR_US
+
+# Presets: stores, weeks of polls
+SIZES = {
+    'small': (1000, 1),
+    'medium': (10000, 1),
+    'large': (50000, 1),
+}
+
+TIMEZONES = [
+    'America/Chicago', 'America/New_York', 'America/Denver', 'America/Los_Angeles',
+    'America/Boise', 'Asia/Kolkata', 'Europe/London', 'Australia/Sydney',
+]
+
+END_TIME = pd.Timestamp('2023-01-25 18:13:22.479220')
+# Stores generated at once; bounds the memory of the generator
+BLOCK_STORES = 1000
+
+
+def store_ids(rng, n_stores):
+    return [str(uuid.UUID(bytes=rng.bytes(16), version=4)) for _ in range(n_stores)]
+
+
+def format_timestamps(ts_us):
+    """Epoch microseconds as 'YYYY-MM-DD HH:MM:SS.ffffff UTC', like the source data."""
+    text = np.datetime_as_string(ts_us.astype('datetime64[us]'), unit='us')
+    return np.char.add(np.char.replace(text, 'T', ' '), ' UTC')
+
+
+def status_block(rng, ids, weeks, missing_rate):
+    """Polls of a block of stores."""
+    end_us = END_TIME.value // 1000
+    n_hours = weeks * 7 * 24
+    start_us = end_us - n_hours * HOUR_US
+
+    n = len(ids)
+    keep = rng.random((n, n_hours)) >= missing_rate
+    # Some stores go dark for a whole day
+    dark = rng.random(n) < 0.05
+    dark_day = rng.integers(0, weeks * 7, n)
+    hours = np.arange(n_hours)
+    keep &= ~(dark[:, None] & (hours[None, :] // 24 == dark_day[:, None]))
+
+    availability = rng.beta(20, 1.5, n)
+    active = rng.random((n, n_hours)) < availability[:, None]
+    jitter = rng.integers(0, HOUR_US, (n, n_hours))
+    ts_us = start_us + hours[None, :] * HOUR_US + jitter
+
+    store_index, _ = np.nonzero(keep)
+    return pd.DataFrame({
+        'store_id': np.asarray(ids, dtype=object)[store_index],
+        'timestamp_utc': format_timestamps(ts_us[keep]),
+        'status': np.where(active[keep], 'active', 'inactive'),
+    })
+
+
+def business_hours_rows(rng, ids):
+    """menu_hours.csv rows; a fifth of the stores have none and are open 24x7."""
+    rows = []
+    for store_id in ids:
+        kind = rng.random()
+        if kind < 0.2:
+            continue
+        for day in range(7):
+            if rng.random() >= 0.9:
+                continue
+            if kind < 0.3:
+                # Split shift
+                rows.append((store_id, day, '08:00:00', '12:00:00'))
+                rows.append((store_id, day, '14:00:00', '22:00:00'))
+            elif kind < 0.35:
+                # Overnight shift
+                rows.append((store_id, day, '20:00:00', '02:00:00'))
+            else:
+                open_hour = int(rng.integers(6, 12))
+                close_hour = int(rng.integers(17, 24))
+                rows.append((store_id, day, f'{open_hour:02d}:{int(rng.integers(0, 60)):02d}:00', f'{close_hour:02d}:00:00'))
+    return pd.DataFrame(rows, columns=['store_id', 'dayOfWeek', 'start_time_local', 'end_time_local'])
+
+
+def timezone_rows(rng, ids):
+    """timezones.csv rows; a tenth of the stores have none and a few an invalid name."""
+    has_zone = rng.random(len(ids)) >= 0.1
+    zones = rng.choice(TIMEZONES + ['Invalid/Zone'], len(ids), p=[0.99 / len(TIMEZONES)] * len(TIMEZONES) + [0.01])
+    return pd.DataFrame({
+        'store_id': np.asarray(ids, dtype=object)[has_zone],
+        'timezone_str': zones[has_zone],
+    })
+
+
+def generate(data_dir, n_stores, weeks, seed=0, missing_rate=0.1):
+    """
+    Writes store_status.csv, menu_hours.csv and timezones.csv to data_dir.
+
+    Returns the number of rows written per file.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    ids = store_ids(rng, n_stores)
+
+    status_path = os.path.join(data_dir, 'store_status.csv')
+    polls = 0
+    for block_start in range(0, n_stores, BLOCK_STORES):
+        block = status_block(rng, ids[block_start:block_start + BLOCK_STORES], weeks, missing_rate)
+        block.to_csv(status_path, mode='w' if block_start == 0 else 'a', header=block_start == 0, index=False)
+        polls += len(block)
+
+    business_hours = business_hours_rows(rng, ids)
+    business_hours.to_csv(os.path.join(data_dir, 'menu_hours.csv'), index=False)
+    timezones = timezone_rows(rng, ids)
+    timezones.to_csv(os.path.join(data_dir, 'timezones.csv'), index=False)
+
+    return {
+        'store_status': polls,
+        'business_hours': len(business_hours),
+        'timezones': len(timezones),
+    }
@@ -1,11 +1,18 @@
 // Initialize Feather icons
 feather.replace();
 
-// Pagination state
+const API_URL = 'http://127.0.0.1:8000';
+
+// Pagination state; pages are fetched from the server on demand
 let currentPage = 1;
 let totalPages = 1;
+let totalRows = 0;
 const entriesPerPage = 50;
-let allData = [];
+// Page buttons shown around the current page
+const pageWindow = 5;
+let currentReportId = null;
+let sortColumn = 'store_id';
+let sortOrder = 'asc';
 
 // Format time
 function formatTime(value, column) {
@@ -37,35 +44,46 @@ const totalEntries = document.getElementById('totalEntries');
 
 // Update pagination controls
 function updatePaginationControls() {
-    const start = (currentPage - 1) * entriesPerPage + 1;
-    const end = Math.min(currentPage * entriesPerPage, allData.length);
+    const start = totalRows === 0 ? 0 : (currentPage - 1) * entriesPerPage + 1;
+    const end = Math.min(currentPage * entriesPerPage, totalRows);
     startEntry.textContent = start;
     endEntry.textContent = end;
-    totalEntries.textContent = allData.length;
+    totalEntries.textContent = totalRows;
 
     prevPageBtn.disabled = currentPage === 1;
-    nextPageBtn.disabled = currentPage === totalPages;
+    nextPageBtn.disabled = currentPage >= totalPages;
 
     pageNumbers.innerHTML = '';
-    for (let i = 1; i <= totalPages; i++) {
+    const first = Math.max(1, currentPage - pageWindow);
+    const last = Math.min(totalPages, currentPage + pageWindow);
+    for (let i = first; i <= last; i++) {
         const button = document.createElement('button');
         button.textContent = i;
         button.classList.toggle('active', i === currentPage);
-        button.addEventListener('click', () => {
-            currentPage = i;
-            updateTable();
-            updatePaginationControls();
-        });
+        button.addEventListener('click', () => loadPage(i));
         pageNumbers.appendChild(button);
     }
 }
 
-// Update the table
-function updateTable() {
-    const start = (currentPage - 1) * entriesPerPage;
-    const end = start + entriesPerPage;
-    const pageData = allData.slice(start, end);
+// Update the table header; clicking a column sorts the report by it
+function updateTableHeader(headers) {
+    const tableHeader = document.getElementById('tableHeader');
+    tableHeader.innerHTML = headers.map(h => {
+        const arrow = h === sortColumn ? (sortOrder === 'asc' ? ' ▲' : ' ▼') : '';
+        return `<th data-column="${h}">${h.replace(/_/g, ' ')}${arrow}</th>`;
+    }).join('');
+    tableHeader.querySelectorAll('th').forEach(th => {
+        th.addEventListener('click', () => {
+            const column = th.dataset.column;
+            sortOrder = column === sortColumn && sortOrder === 'asc' ? 'desc' : 'asc';
+            sortColumn = column;
+            loadPage(1);
+        });
+    });
+}
 
+// Update the table
+function updateTable(pageData) {
     const tableBody = pageData.map(row => `
         <tr>
             ${Object.entries(row).map(([key, value], i) =>
@@ -92,40 +110,63 @@ function showError(message) {
     error.classList.remove('hidden');
 }
 
-// Update report display
-function updateReportDisplay(data) {
-    allData = data;
-    totalPages = Math.ceil(data.length / entriesPerPage);
-    currentPage = 1;
+// Fetch one page of the report from the server
+async function fetchPage(id, page) {
+    const params = new URLSearchParams({
+        offset: (page - 1) * entriesPerPage,
+        limit: entriesPerPage,
+        sort: sortColumn,
+        order: sortOrder,
+    });
+    const response = await fetch(`${API_URL}/reports/${id}/rows?${params}`);
+    const data = await response.json();
+    if (!response.ok) {
+        throw new Error(data.detail || response.statusText);
+    }
+    return data;
+}
 
-    // Update table headers
-    const headers = Object.keys(data[0]);
-    document.getElementById('tableHeader').innerHTML = headers.map(h => `<th>${h.replace(/_/g, ' ')}</th>`).join('');
+// Update report display
+function updateReportDisplay(data, page) {
+    totalRows = data.total;
+    totalPages = Math.max(1, Math.ceil(totalRows / entriesPerPage));
+    currentPage = page;
 
-    // Update table
-    updateTable();
+    if (data.rows.length > 0) {
+        updateTableHeader(Object.keys(data.rows[0]));
+    }
+    updateTable(data.rows);
     updatePaginationControls();
     reportData.classList.remove('hidden');
 }
 
+// Load and show one page of the current report
+async function loadPage(page) {
+    try {
+        const data = await fetchPage(currentReportId, page);
+        updateReportDisplay(data, page);
+    } catch (err) {
+        showError('Failed to load report page: ' + err.message);
+    }
+}
+
 // Check report status
 async function checkReportStatus(id) {
     try {
-        const response = await fetch(`http://127.0.0.1:8000/get_report/${id}`);
-        const contentType = response.headers.get('content-type');
-        if (contentType.includes('text/csv')) {
-            const text = await response.text();
-            const rows = text.split('\n').map(row => row.split(','));
-            const headers = rows[0];
-            const data = rows.slice(1).map(row => Object.fromEntries(headers.map((h, i) => [h.trim(), row[i]])));
+        const data = await fetchPage(id, 1);
+        if (data.status === 'Complete') {
             statusText.textContent = 'Report generation complete';
             setLoading(false);
-            updateReportDisplay(data);
+            updateReportDisplay(data, 1);
         } else {
-            const data = await response.json();
-            if (data.status === 'Running') {
-                statusText.textContent = 'Report is still generating...';
+            if (data.status === 'Queued' || data.status === 'Running') {
+                statusText.textContent = data.status === 'Queued'
+                    ? 'Report is queued...'
+                    : 'Report is still generating...';
                 setTimeout(() => checkReportStatus(id), 2000);
+            } else if (data.status === 'Cancelled') {
+                statusText.textContent = 'Report was cancelled';
+                setLoading(false);
             }
         }
     } catch (err) {
@@ -140,9 +181,12 @@ async function generateReport() {
         setLoading(true);
         error.classList.add('hidden');
 
-        const response = await fetch('http://127.0.0.1:8000/get_report', { method: 'POST' });
+        const response = await fetch(`${API_URL}/trigger_report`, { method: 'POST' });
         const data = await response.json();
 
+        currentReportId = data.report_id;
+        sortColumn = 'store_id';
+        sortOrder = 'asc';
         reportId.textContent = data.report_id;
         statusText.textContent = 'Report generation started';
         reportInfo.classList.remove('hidden');
@@ -158,15 +202,11 @@ async function generateReport() {
 generateBtn.addEventListener('click', generateReport);
 prevPageBtn.addEventListener('click', () => {
     if (currentPage > 1) {
-        currentPage--;
-        updateTable();
-        updatePaginationControls();
+        loadPage(currentPage - 1);
     }
 });
 nextPageBtn.addEventListener('click', () => {
     if (currentPage < totalPages) {
-        currentPage++;
-        updateTable();
-        updatePaginationControls();
+        loadPage(currentPage + 1);
     }
 });
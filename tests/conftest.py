@@ -0,0 +1,102 @@
+"""
+Fixtures shared by the tests.
+
+Everything the app writes (report store, job store, cache, snapshots, bulk
+ingest checkpoints) goes to a temporary directory set up before app is
+imported, and the database is the SQLite stand-in from benchmarks, loaded with
+synthetic data by the bulk loader.
+"""
+import os
+import sqlite3
+import tempfile
+from datetime import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+WORKDIR = tempfile.mkdtemp(prefix='store_monitoring_tests_')
+DATA_DIR = os.path.join(WORKDIR, 'data')
+os.environ.update({
+    'REPORTS_DIR': os.path.join(WORKDIR, 'reports'),
+    'REPORT_STORE_PATH': os.path.join(WORKDIR, 'reports', 'jobs.sqlite3'),
+    'REPORT_JOB_STORE_PATH': os.path.join(WORKDIR, 'reports', 'jobs.sqlite3'),
+    'REPORT_CACHE_PATH': os.path.join(WORKDIR, 'reports', 'jobs.sqlite3'),
+    'SNAPSHOT_DIR': os.path.join(WORKDIR, 'reports', 'snapshots'),
+    'COLUMNAR_STORE_PATH': os.path.join(WORKDIR, 'columnar'),
+    'INGEST_DATA_DIR': DATA_DIR,
+    'LOG_LEVEL': 'WARNING',
+})
+
+# Stores and weeks of the synthetic database
+DATABASE_STORES = 40
+DATABASE_WEEKS = 1
+
+END_TIME = pd.Timestamp('2023-01-25 18:13:22.479220', tz='UTC')
+TIMEZONES = ['America/Chicago', 'America/New_York', 'America/Los_Angeles', 'Asia/Kolkata', 'Bad/Zone']
+
+
+def make_frames(n_stores=20, weeks=2, seed=0):
+    """
+    store_status, timezones and business_hours frames as fetched for a report.
+
+    Polls are irregular, a third of the stores have no timezone (some others an
+    invalid one), a quarter have no business hours, and the rest have one
+    same-day interval on most days: the input the per-store loop handles.
+    """
+    rng = np.random.default_rng(seed)
+    ids = [f"{i:08d}-0000-4000-8000-{rng.integers(10 ** 11):012d}" for i in range(n_stores)]
+    rows = []
+    for store_id in ids:
+        seconds = np.sort(rng.uniform(0, weeks * 7 * 86400, rng.integers(0, weeks * 48)))[::-1]
+        for timestamp in (END_TIME - pd.to_timedelta(seconds, unit='s')).floor('us'):
+            rows.append((store_id, timestamp, 'active' if rng.random() < 0.8 else 'inactive'))
+    # The newest poll, so the report ends at END_TIME
+    rows.append((ids[0], END_TIME, 'active'))
+    store_status = pd.DataFrame(rows, columns=['store_id', 'timestamp_utc', 'status'])
+    store_status = store_status.sort_values(['store_id', 'timestamp_utc'], kind='stable', ignore_index=True)
+
+    with_zone = ids[:n_stores * 2 // 3]
+    timezones = pd.DataFrame({'store_id': with_zone, 'timezone_str': rng.choice(TIMEZONES, len(with_zone))})
+    hours = []
+    for store_id in ids[n_stores // 4:]:
+        for day in range(7):
+            if rng.random() < 0.85:
+                open_hour, close_hour = int(rng.integers(0, 12)), int(rng.integers(12, 24))
+                close = time(23, 59, 59) if close_hour == 23 else time(close_hour)
+                hours.append((store_id, day, time(open_hour, int(rng.integers(60))), close))
+    business_hours = pd.DataFrame(hours, columns=['store_id', 'day_of_week', 'start_time_local', 'end_time_local'])
+    return store_status, timezones, business_hours
+
+
+@pytest.fixture(scope='session')
+def database():
+    """Path of the SQLite database with the synthetic data, installed as the connection pool."""
+    from app import ingest
+    from app.db import use_pool
+    from benchmarks.sqlite_backend import SQLiteBackend
+    from benchmarks.synthetic import generate
+
+    generate(DATA_DIR, DATABASE_STORES, DATABASE_WEEKS, seed=0)
+    path = os.path.join(WORKDIR, 'store_monitoring.sqlite3')
+    backend = SQLiteBackend(path)
+    backend.create_tables()
+    use_pool(backend)
+    ingest.bulk_insert_data(restart=True)
+    return path
+
+
+@pytest.fixture
+def database_copy(database, tmp_path):
+    """A copy of the synthetic database for tests that write to it, installed as the pool for the test."""
+    from app.db import use_pool
+    from benchmarks.sqlite_backend import SQLiteBackend
+
+    path = str(tmp_path / 'store_monitoring.sqlite3')
+    source, target = sqlite3.connect(database), sqlite3.connect(path)
+    source.backup(target)
+    source.close()
+    target.close()
+    use_pool(SQLiteBackend(path))
+    yield path
+    use_pool(SQLiteBackend(database))
@@ -0,0 +1,88 @@
+import io
+import time
+
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(database):
+    from app.api import app
+    # No context manager: its shutdown would stop the module-level executor for later tests
+    return TestClient(app)
+
+
+def wait_for(client, report_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f'/reports/{report_id}').json()
+        if job['status'] not in ('Queued', 'Running') or time.monotonic() > deadline:
+            return job
+        time.sleep(0.05)
+
+
+def test_trigger_and_get_report(client):
+    from app.main import generate_report_df
+
+    report_id = client.post('/trigger_report').json()['report_id']
+    job = wait_for(client, report_id)
+    assert job['status'] == 'Complete'
+    assert job['progress']['stores_done'] == job['progress']['stores_total']
+
+    response = client.get(f'/get_report/{report_id}')
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/csv')
+    report = pd.read_csv(io.BytesIO(response.content), dtype={'store_id': str})
+    pd.testing.assert_frame_equal(report, generate_report_df(), check_dtype=False)
+
+    # Same data: answered from the cache with the same file
+    cached_id = client.post('/trigger_report').json()['report_id']
+    assert client.get(f'/reports/{cached_id}').json()['status'] == 'Complete'
+    assert client.get(f'/get_report/{cached_id}').content == response.content
+
+
+def test_get_report_unknown_id(client):
+    assert client.get('/get_report/unknown').status_code == 404
+
+
+def test_trigger_report_rejects_bad_window(client):
+    assert client.post('/trigger_report', params={'window': 'soon'}).status_code == 400
+
+
+def test_new_polls_change_the_data_version(client, database_copy):
+    from app.storage import MySQLBackend
+
+    storage = MySQLBackend()
+    first_id = client.post('/trigger_report').json()['report_id']
+    assert wait_for(client, first_id)['status'] == 'Complete'
+    version = storage.data_version()
+
+    latest = pd.Timestamp(storage.latest_timestamp(), tz='UTC')
+    storage.insert_status(pd.DataFrame({
+        'store_id': ['new-store'],
+        'timestamp_utc': [latest + pd.Timedelta(minutes=5)],
+        'status': ['active'],
+    }))
+    assert storage.data_version() != version
+
+    # Not answered from the cache: the new poll is in the report
+    second_id = client.post('/trigger_report').json()['report_id']
+    assert second_id != first_id
+    assert wait_for(client, second_id)['status'] == 'Complete'
+    report = pd.read_csv(io.BytesIO(client.get(f'/get_report/{second_id}').content), dtype={'store_id': str})
+    assert 'new-store' in set(report['store_id'])
+
+
+def test_report_rows_come_from_the_stored_csv(client):
+    report_id = client.post('/trigger_report').json()['report_id']
+    assert wait_for(client, report_id)['status'] == 'Complete'
+    report = pd.read_csv(io.BytesIO(client.get(f'/get_report/{report_id}').content), dtype={'store_id': str})
+
+    page = client.get(f'/reports/{report_id}/rows', params={
+        'sort': 'downtime_last_day', 'order': 'desc', 'filter': 'uptime_last_week>0', 'limit': 5,
+    }).json()
+    expected = report[report['uptime_last_week'] > 0].sort_values('downtime_last_day', ascending=False, kind='stable')
+    assert page['total'] == len(expected)
+    assert [row['downtime_last_day'] for row in page['rows']] == list(expected['downtime_last_day'][:5])
+    assert all(isinstance(row['store_id'], str) for row in page['rows'])
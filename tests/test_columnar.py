@@ -0,0 +1,90 @@
+import multiprocessing
+
+import pandas as pd
+import pytest
+
+import app.columnar
+from app.columnar import ColumnarBackend
+from app.storage import MySQLBackend
+
+
+@pytest.fixture
+def columnar(database, tmp_path):
+    """A columnar store loaded from the same CSVs as the synthetic database."""
+    storage = ColumnarBackend(str(tmp_path / 'columnar'))
+    storage.insert_data()
+    return storage
+
+
+def streamed_batches(storage, n_batches):
+    """Batches of newer, late and replaced polls, some on a new day or for a new store."""
+    latest = pd.Timestamp(storage.latest_timestamp(), tz='UTC')
+    store_ids = sorted(status_frame(storage, latest - pd.Timedelta(days=1), latest)['store_id'].unique())[:8]
+    for batch in range(n_batches):
+        rows = []
+        for i, store_id in enumerate(store_ids):
+            rows.append((store_id, latest + pd.Timedelta(minutes=10 * batch + i), 'active'))
+            rows.append((store_id, latest - pd.Timedelta(hours=batch + 2, minutes=3 * i), 'inactive'))
+            rows.append((store_id, latest, 'inactive' if (batch + i) % 2 else 'active'))
+        rows.append((f'new-store-{batch % 2}', latest + pd.Timedelta(days=1, minutes=batch), 'active'))
+        yield pd.DataFrame(rows, columns=['store_id', 'timestamp_utc', 'status'])
+
+
+def status_frame(storage, start, end):
+    frame = storage.fetch_status(start, end)
+    return frame.astype({'store_id': str, 'status': str}).reset_index(drop=True)
+
+
+def test_streamed_polls_read_like_mysql(database_copy, columnar, monkeypatch):
+    monkeypatch.setattr(app.columnar, 'COLUMNAR_MAX_SEGMENTS', 3)
+    mysql = MySQLBackend()
+    pending = []
+    for polls in streamed_batches(columnar, 7):
+        mysql.insert_status(polls)
+        columnar.insert_status(polls)
+        pending.append(sum(len(segments) for segments in columnar._manifest()['segments'].values()))
+    # Segments pile up and are compacted
+    assert max(pending) == 2 and 0 in pending
+
+    start, end = pd.Timestamp('2023-01-01'), pd.Timestamp(mysql.latest_timestamp())
+    assert columnar.latest_timestamp() == mysql.latest_timestamp()
+    pd.testing.assert_frame_equal(status_frame(columnar, start, end), status_frame(mysql, start, end))
+    assert columnar.count_stores(start, end) == mysql.count_stores(start, end)
+    store_ids = ['new-store-0', 'new-store-1'] + list(status_frame(mysql, start, end)['store_id'].unique()[:5])
+    # Stores with polls, each at the generation of the last batch that wrote it
+    generations = columnar.store_generations(store_ids)
+    assert set(generations) == set(mysql.store_generations(store_ids))
+    assert generations['new-store-1'] < generations['new-store-0'] == columnar.generation()
+
+    # A load compacts every day
+    columnar.insert_data()
+    assert columnar._manifest()['segments'] == {}
+    pd.testing.assert_frame_equal(status_frame(columnar, start, end), status_frame(mysql, start, end))
+
+
+def insert_polls(path, worker, batches):
+    storage = ColumnarBackend(path)
+    for batch in range(batches):
+        storage.insert_status(pd.DataFrame({
+            'store_id': [f'worker-{worker}'] * 3,
+            'timestamp_utc': pd.date_range('2023-01-25 12:00', periods=3, freq='min', tz='UTC')
+            + pd.Timedelta(hours=batch),
+            'status': ['active', 'inactive', 'active'],
+        }))
+
+
+def test_concurrent_processes_keep_every_poll(columnar):
+    generation = columnar.generation()
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=insert_polls, args=(columnar.path, worker, 5)) for worker in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+        assert process.exitcode == 0
+
+    assert columnar.generation() == generation + 20
+    store_ids = [f'worker-{worker}' for worker in range(4)]
+    polls = columnar.fetch_status(pd.Timestamp('2023-01-25'), pd.Timestamp('2023-01-26'), store_ids)
+    assert polls['store_id'].astype(str).value_counts().to_dict() == {store_id: 15 for store_id in store_ids}
+    assert set(columnar.store_generations(store_ids).values()) <= set(range(generation + 1, generation + 21))
@@ -0,0 +1,66 @@
+import pandas as pd
+import pytest
+
+from app.engine import METRIC_COLUMNS, compute_metrics, iter_metrics
+from app.main import calculate_uptime_downtime, get_store_timezone
+from conftest import make_frames
+
+
+def legacy_report(store_status, timezones, business_hours, current_time):
+    """The report of calculate_uptime_downtime run for one store at a time."""
+    rows = []
+    for store_id in store_status['store_id'].unique():
+        metrics = calculate_uptime_downtime(
+            store_id,
+            store_status[store_status['store_id'] == store_id],
+            get_store_timezone(store_id, timezones),
+            business_hours[business_hours['store_id'] == store_id],
+            current_time,
+        )
+        rows.append({'store_id': store_id, **metrics})
+    return pd.DataFrame(rows, columns=['store_id'] + METRIC_COLUMNS)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_compute_metrics_matches_calculate_uptime_downtime(seed):
+    store_status, timezones, business_hours = make_frames(seed=seed)
+    current_time = store_status['timestamp_utc'].max()
+
+    expected = legacy_report(store_status, timezones, business_hours, current_time)
+    report = compute_metrics(store_status, timezones, business_hours, current_time)
+
+    pd.testing.assert_frame_equal(report, expected, check_dtype=False)
+
+
+def test_compute_metrics_categorical_store_ids():
+    store_status, timezones, business_hours = make_frames(seed=3)
+    current_time = store_status['timestamp_utc'].max()
+    categorical = store_status.assign(store_id=store_status['store_id'].astype('category'))
+
+    pd.testing.assert_frame_equal(
+        compute_metrics(categorical, timezones, business_hours, current_time),
+        compute_metrics(store_status, timezones, business_hours, current_time),
+    )
+
+
+def test_compute_metrics_empty():
+    store_status, timezones, business_hours = make_frames()
+    report = compute_metrics(store_status.iloc[:0], timezones, business_hours, pd.Timestamp.now(tz='UTC'))
+    assert report.empty
+    assert list(report.columns) == ['store_id'] + METRIC_COLUMNS
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_iter_metrics_chunks_match_compute_metrics(shuffle):
+    store_status, timezones, business_hours = make_frames(n_stores=30, seed=4)
+    current_time = store_status['timestamp_utc'].max()
+    if shuffle:
+        store_status = store_status.sample(frac=1, random_state=0, ignore_index=True)
+
+    chunks = list(iter_metrics(store_status, timezones, business_hours, current_time, rows=50))
+
+    assert len(chunks) > 1
+    pd.testing.assert_frame_equal(
+        pd.concat(chunks, ignore_index=True),
+        compute_metrics(store_status, timezones, business_hours, current_time),
+    )
@@ -0,0 +1,35 @@
+import io
+
+from app import ingest
+from app.db import get_connection
+
+
+def test_skip_records_counts_quoted_newlines_and_ignores_blank_lines():
+    f = io.StringIO('a,"two\nlines"\n\nb,x\nc,y\n')
+    ingest.skip_records(f, 2)
+    assert f.read() == 'c,y\n'
+
+
+def test_bulk_insert_file_resumes_after_committed_records(database_copy, tmp_path):
+    csv_path = str(tmp_path / 'timezones.csv')
+    with open(csv_path, 'w', newline='') as f:
+        f.write('store_id,timezone_str\n'
+                'resume-1,"America/\nChicago"\n'
+                'resume-2,America/Denver\n'
+                'resume-3,"Asia/\nKolkata"\n'
+                'resume-4,Europe/London\n')
+    # An earlier run committed the first two records, three lines
+    checkpoint = {csv_path: {'signature': ingest.file_signature(csv_path), 'rows_done': 2, 'complete': False}}
+
+    with get_connection() as db:
+        ingest.bulk_insert_file(
+            db, csv_path, 'timezones', {'store_id': 'store_id', 'timezone_str': 'timezone_str'},
+            ['timezone_str'], checkpoint,
+        )
+        cursor = db.cursor()
+        cursor.execute("SELECT store_id, timezone_str FROM timezones WHERE store_id LIKE 'resume-%' ORDER BY store_id")
+        rows = cursor.fetchall()
+
+    assert rows == [('resume-3', 'Asia/\nKolkata'), ('resume-4', 'Europe/London')]
+    assert checkpoint[csv_path]['rows_done'] == 4
+    assert checkpoint[csv_path]['complete']
@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from app.jobs import ReportExecutor
+from app.main import run_report
+from app.progress import ReportCancelled, ReportProgress
+from app.sinks import DataFrameSink
+
+
+def batches(produced, started=None, count=100):
+    try:
+        for i in range(count):
+            produced.append(i)
+            if started is not None:
+                started.set()
+                time.sleep(0.01)
+            yield pd.DataFrame({'store_id': [f'store-{i}'], 'uptime_last_hour': [float(i)]})
+    finally:
+        produced.append('closed')
+
+
+def test_run_report_stops_between_batches():
+    produced = []
+    progress = ReportProgress(cancelled=lambda: len(produced) >= 2)
+    with progress.activate(), pytest.raises(ReportCancelled):
+        run_report([DataFrameSink()], batches=batches(produced))
+    assert produced == [0, 1, 'closed']
+    assert progress.stores_done == 2
+
+
+class Statuses:
+    def __init__(self):
+        self.updates = []
+
+    def __call__(self, report_id, **fields):
+        self.updates.append((report_id, fields.get('status')))
+
+
+def cancellable_run(produced, started):
+    def run(report_id, snapshot, options, progress, cancelled):
+        with ReportProgress(cancelled=cancelled).activate():
+            run_report([DataFrameSink()], batches=batches(produced, started))
+        return {'file_path': 'report.csv'}
+    return run
+
+
+def test_cancel_stops_a_running_job():
+    produced, started, statuses = [], threading.Event(), Statuses()
+    executor = ReportExecutor(cancellable_run(produced, started), statuses, max_workers=1)
+    job = executor.submit('report-1', 'snapshot')
+    assert started.wait(5)
+    assert executor.cancel('report-1')
+    job.future.result(timeout=5)
+
+    assert job.state == 'Cancelled'
+    assert produced[-1] == 'closed' and len(produced) < 50
+    assert ('report-1', 'Complete') not in statuses.updates
+    assert statuses.updates[-1] == ('report-1', 'Cancelled')
+    executor.shutdown()
+
+
+def test_cancel_keeps_a_job_shared_with_another_report():
+    produced, started, statuses = [], threading.Event(), Statuses()
+    executor = ReportExecutor(cancellable_run(produced, started), statuses, max_workers=1)
+    job = executor.submit('report-1', 'snapshot')
+    executor.submit('report-2', 'snapshot')
+    assert started.wait(5)
+    assert executor.cancel('report-1')
+    job.future.result(timeout=10)
+
+    assert job.state == 'Complete'
+    assert ('report-2', 'Complete') in statuses.updates
+    assert ('report-1', 'Complete') not in statuses.updates
+    executor.shutdown()
+
+
+def test_job_cancelled_through_another_worker_stops():
+    produced, started, statuses = [], threading.Event(), Statuses()
+    cancelled_elsewhere = set()
+    executor = ReportExecutor(cancellable_run(produced, started), statuses, max_workers=1,
+                              is_cancelled=cancelled_elsewhere.__contains__)
+    job = executor.submit('report-1', 'snapshot')
+    assert started.wait(5)
+    cancelled_elsewhere.add('report-1')
+    job.future.result(timeout=5)
+
+    assert job.state == 'Cancelled'
+    assert len(produced) < 50
+    assert ('report-1', 'Complete') not in statuses.updates
+    executor.shutdown()
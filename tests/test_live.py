@@ -0,0 +1,55 @@
+import pandas as pd
+
+from app.live import LiveState
+from app.main import generate_report_df
+from app.storage import MySQLBackend
+
+
+def assert_matches_vectorized(report):
+    expected = generate_report_df(engine='vectorized')
+    pd.testing.assert_frame_equal(
+        report.sort_values('store_id', ignore_index=True),
+        expected.sort_values('store_id', ignore_index=True),
+        check_dtype=False,
+    )
+
+
+def test_live_report_follows_streamed_polls(database_copy):
+    storage = MySQLBackend()
+    state = LiveState(storage)
+    assert_matches_vectorized(state.report())
+
+    def reload():
+        raise AssertionError("the state was reloaded")
+    state._reload = reload
+
+    latest = pd.Timestamp(storage.latest_timestamp(), tz='UTC')
+    store_ids = sorted(storage.fetch_status(latest - pd.Timedelta(hours=2), latest)['store_id'].astype(str).unique())
+    in_order, late, replaced = store_ids[:6], store_ids[6:9], store_ids[9:12]
+
+    def polls(rows):
+        return pd.DataFrame(rows, columns=['store_id', 'timestamp_utc', 'status'])
+
+    # Newer polls, several per store and not sorted, and a new store
+    state.ingest(polls(
+        [(store_id, latest + pd.Timedelta(minutes=m), 'inactive' if m % 2 else 'active')
+         for m in (25, 5, 15) for store_id in in_order]
+        + [('new-store', latest + pd.Timedelta(minutes=1), 'active')]
+    ))
+    assert_matches_vectorized(state.report())
+
+    # A late poll between older ones, and a status replaced at an existing time
+    existing = storage.fetch_status(latest - pd.Timedelta(days=2), latest, store_ids=replaced)
+    state.ingest(polls(
+        [(store_id, latest - pd.Timedelta(hours=20, minutes=7 * i), 'inactive') for i, store_id in enumerate(late)]
+        + [(row.store_id, row.timestamp_utc, 'inactive' if row.status == 'active' else 'active')
+           for row in existing.iloc[::3].itertuples()]
+    ))
+    assert_matches_vectorized(state.report())
+
+    # Time moves on: the windows slide over the earlier polls
+    state.ingest(polls([(store_id, latest + pd.Timedelta(hours=30), 'active') for store_id in store_ids[::4]]))
+    assert_matches_vectorized(state.report())
+    state.ingest(polls([(in_order[0], latest + pd.Timedelta(days=3), 'inactive')]))
+    assert_matches_vectorized(state.report())
+
@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+
+from app import parallel
+from app.engine import compute_metrics
+from app.main import generate_report_df
+from conftest import make_frames
+
+
+@pytest.fixture(autouse=True, scope='module')
+def stop_pool():
+    yield
+    parallel.shutdown_process_pool()
+
+
+def by_store(report):
+    return report.sort_values('store_id', ignore_index=True)
+
+
+def test_parallel_matches_compute_metrics():
+    store_status, timezones, business_hours = make_frames(n_stores=30, seed=4)
+    current_time = store_status['timestamp_utc'].max()
+
+    batches = list(parallel.iter_metrics_parallel(store_status, timezones, business_hours, current_time, workers=3))
+    assert len(batches) == 3
+    pd.testing.assert_frame_equal(
+        by_store(pd.concat(batches, ignore_index=True)),
+        by_store(compute_metrics(store_status, timezones, business_hours, current_time)),
+    )
+
+
+def test_parallel_report_from_storage(database, monkeypatch):
+    # Fetched store_ids are categorical, which the shards must keep as store_id
+    monkeypatch.setattr(parallel, 'REPORT_WORKERS', 2)
+    report = generate_report_df(engine='parallel')
+    assert report['store_id'].notna().all()
+    pd.testing.assert_frame_equal(by_store(report), by_store(generate_report_df(engine='vectorized')))
+
+
+def test_pool_is_kept_between_reports():
+    pool = parallel.get_process_pool(2)
+    assert parallel.get_process_pool(1) is pool
+    assert parallel.get_process_pool(2) is pool
+    assert pool._mp_context.get_start_method() == parallel.REPORT_POOL_START_METHOD
+    parallel.shutdown_process_pool()
+    assert parallel.get_process_pool(2) is not pool
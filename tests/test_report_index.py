@@ -0,0 +1,30 @@
+import gzip
+import os
+import threading
+
+from app.report_index import compressed_report
+
+
+def test_concurrent_compression_writes_one_whole_file(tmp_path):
+    file_path = str(tmp_path / 'report_1.csv')
+    content = b'store_id,uptime_last_hour\n' + b''.join(b'%d,%d\n' % (i, i % 60) for i in range(200_000))
+    with open(file_path, 'wb') as f:
+        f.write(content)
+
+    barrier = threading.Barrier(8)
+    paths = []
+
+    def compress():
+        barrier.wait()
+        paths.append(compressed_report(file_path, 'gzip'))
+
+    threads = [threading.Thread(target=compress) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert paths == [file_path + '.gz'] * 8
+    with gzip.open(file_path + '.gz') as f:
+        assert f.read() == content
+    assert sorted(os.listdir(tmp_path)) == ['report_1.csv', 'report_1.csv.gz']
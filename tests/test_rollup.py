@@ -0,0 +1,130 @@
+import time
+
+import pandas as pd
+
+import app.rollup
+
+from app.db import get_connection
+from app.ingest import insert_status
+from app.main import generate_report_df
+from app.rollup import RollupRefresher, refresh_rollups, refresh_stale_rollups, rollup_lock, rollup_report
+from app.storage import MySQLBackend
+
+
+def assert_matches_vectorized():
+    with get_connection() as db:
+        report = rollup_report(db)
+    pd.testing.assert_frame_equal(
+        report.reset_index(drop=True), generate_report_df(engine='vectorized'), check_dtype=False,
+    )
+
+
+def test_rollup_report_matches_vectorized(database):
+    assert_matches_vectorized()
+
+
+def test_rollup_report_after_refresh_from_an_hour(database_copy):
+    with get_connection() as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT MAX(timestamp_utc) FROM store_status")
+        latest = cursor.fetchone()[0]
+        refresh_rollups(db, since=latest - pd.Timedelta(hours=30))
+    assert_matches_vectorized()
+
+
+def streamed_polls():
+    """Newer polls, a late poll between two older ones, and a replaced status for 10 stores."""
+    with get_connection() as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT store_id, MAX(timestamp_utc) FROM store_status GROUP BY store_id ORDER BY store_id")
+        stores = cursor.fetchall()[:10]
+    rows = []
+    for i, (store_id, latest) in enumerate(stores):
+        latest = pd.Timestamp(latest, tz='UTC')
+        rows.append((store_id, latest + pd.Timedelta(minutes=20 + i), 'inactive'))
+        rows.append((store_id, latest - pd.Timedelta(hours=5, minutes=7 * i), 'active'))
+        rows.append((store_id, latest, 'inactive' if i % 2 else 'active'))
+    return pd.DataFrame(rows, columns=['store_id', 'timestamp_utc', 'status'])
+
+
+def test_rollup_report_after_streamed_polls(database_copy):
+    polls = streamed_polls()
+    storage = MySQLBackend()
+    storage.insert_status(polls.iloc[::2])
+    storage.insert_status(polls.iloc[1::2])
+    assert_matches_vectorized()
+
+
+def test_rollup_report_leaves_out_stores_dark_for_the_window(database_copy):
+    storage = MySQLBackend()
+    latest = pd.Timestamp(storage.latest_timestamp(), tz='UTC')
+    storage.insert_status(pd.DataFrame({
+        'store_id': ['dark-store'] * 2,
+        'timestamp_utc': [latest - pd.Timedelta(days=30), latest - pd.Timedelta(days=30, minutes=-5)],
+        'status': ['active', 'inactive'],
+    }))
+    assert_matches_vectorized()
+
+
+def stale_hours(db):
+    cursor = db.cursor()
+    cursor.execute("SELECT COUNT(*) FROM store_status_hourly_dirty")
+    return cursor.fetchone()[0]
+
+
+def rollup_rows(db):
+    cursor = db.cursor()
+    cursor.execute("SELECT * FROM store_status_hourly ORDER BY store_id, hour_start")
+    return cursor.fetchall()
+
+
+def test_refreshing_stale_hours_matches_a_full_refresh(database_copy):
+    with get_connection() as db:
+        insert_status(db, streamed_polls())
+        assert stale_hours(db) > 0
+        assert refresh_stale_rollups(db)
+        assert stale_hours(db) == 0
+        refreshed = rollup_rows(db)
+        refresh_rollups(db)
+        assert rollup_rows(db) == refreshed
+
+
+def test_refresh_waits_for_the_lock(database_copy):
+    with get_connection() as db, get_connection() as other:
+        insert_status(db, streamed_polls())
+        with rollup_lock(other) as locked:
+            assert locked
+            assert not refresh_stale_rollups(db)
+        assert stale_hours(db) > 0
+        assert refresh_stale_rollups(db)
+
+
+def test_background_refresher(database_copy):
+    refresher = RollupRefresher(interval_ms=10)
+    with get_connection() as db:
+        insert_status(db, streamed_polls())
+        refresher.notify()
+        deadline = time.monotonic() + 30
+        while stale_hours(db) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert stale_hours(db) == 0
+    refresher.shutdown()
+    assert_matches_vectorized()
+
+
+def test_hours_marked_during_a_refresh_stay_marked(database_copy, monkeypatch):
+    refresh = app.rollup.stale_segments
+    polls = streamed_polls()
+
+    def write_meanwhile(db, stale):
+        # Another write to a claimed hour lands after its polls were read
+        segments = refresh(db, stale)
+        with get_connection() as other:
+            insert_status(other, polls.iloc[:1])
+        return segments
+
+    with get_connection() as db:
+        insert_status(db, polls)
+        monkeypatch.setattr(app.rollup, 'stale_segments', write_meanwhile)
+        refresh_stale_rollups(db)
+        assert stale_hours(db) == 1
@@ -0,0 +1,110 @@
+from datetime import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.engine import timestamp_to_us
+from app.schedule import compile_intervals, time_to_us
+
+
+def weekly_rows(*rows):
+    """Schedule rows from (code, day, open, close, tz) with datetime.time hours."""
+    return pd.DataFrame([
+        {'code': code, 'day': day, 'open': time_to_us(open_), 'close': time_to_us(close), 'tz': tz}
+        for code, day, open_, close, tz in rows
+    ])
+
+
+def intervals(rows, start, end):
+    """compile_intervals over [start, end] as (code, open, close) tuples of UTC wall times."""
+    codes, opens, closes = compile_intervals(rows, timestamp_to_us(start), timestamp_to_us(end))
+    as_time = lambda values: pd.to_datetime(values, unit='us')
+    return list(zip(codes.tolist(), as_time(opens), as_time(closes)))
+
+
+def at(text):
+    return pd.Timestamp(text)
+
+
+def test_split_shift():
+    # 2023-01-16 is a Monday (day 0)
+    rows = weekly_rows((0, 0, time(8), time(12), 'UTC'), (0, 0, time(14), time(22), 'UTC'))
+    assert intervals(rows, '2023-01-16 00:00', '2023-01-16 23:59') == [
+        (0, at('2023-01-16 08:00'), at('2023-01-16 12:00')),
+        (0, at('2023-01-16 14:00'), at('2023-01-16 22:00')),
+    ]
+
+
+def test_overnight_hours_run_into_the_next_day():
+    rows = weekly_rows((0, 0, time(20), time(2), 'UTC'))
+    assert intervals(rows, '2023-01-17 00:00', '2023-01-17 12:00') == [
+        (0, at('2023-01-16 20:00'), at('2023-01-17 02:00')),
+    ]
+
+
+def test_overnight_hours_merge_with_the_next_days_shift():
+    rows = weekly_rows((0, 0, time(22), time(3), 'UTC'), (0, 1, time(1), time(5), 'UTC'))
+    assert intervals(rows, '2023-01-17 00:00', '2023-01-17 12:00') == [
+        (0, at('2023-01-16 22:00'), at('2023-01-17 05:00')),
+    ]
+
+
+def test_local_hours_are_converted_per_store():
+    rows = weekly_rows(
+        (1, 0, time(9), time(17), 'UTC'),
+        (0, 0, time(9), time(17), 'America/New_York'),
+    )
+    assert intervals(rows, '2023-01-16 00:00', '2023-01-16 23:59') == [
+        (0, at('2023-01-16 14:00'), at('2023-01-16 22:00')),
+        (1, at('2023-01-16 09:00'), at('2023-01-16 17:00')),
+    ]
+
+
+@pytest.mark.parametrize('open_, close, expected', [
+    # Opens in EST and closes in EDT
+    (time(1), time(4), (at('2023-03-12 06:00'), at('2023-03-12 08:00'))),
+    # 02:30 doesn't exist that night and moves forward to 03:00 EDT
+    (time(2, 30), time(5), (at('2023-03-12 07:00'), at('2023-03-12 09:00'))),
+])
+def test_dst_spring_forward(open_, close, expected):
+    # 2023-03-12 is a Sunday (day 6)
+    rows = weekly_rows((0, 6, open_, close, 'America/New_York'))
+    assert intervals(rows, '2023-03-12 00:00', '2023-03-12 23:59') == [(0, *expected)]
+
+
+def test_dst_fall_back_opens_on_first_and_closes_on_second_occurrence():
+    # 01:00-01:30 happens twice on 2023-11-05: 05:00 EDT opens, 06:30 EST closes
+    rows = weekly_rows((0, 6, time(1), time(1, 30), 'America/New_York'))
+    assert intervals(rows, '2023-11-05 00:00', '2023-11-05 23:59') == [
+        (0, at('2023-11-05 05:00'), at('2023-11-05 06:30')),
+    ]
+
+
+def test_no_rows():
+    codes, opens, closes = compile_intervals(weekly_rows().reindex(columns=['code', 'day', 'open', 'close', 'tz']), 0, 1)
+    assert len(codes) == len(opens) == len(closes) == 0
+    assert opens.dtype == np.int64
+
+
+def test_schedule_index_contains_overnight_and_split_hours():
+    from app.schedule import build_schedule_index, invalidate_schedules
+
+    store_ids = pd.Index(['overnight', 'split', 'always'], dtype=str)
+    store_tz = pd.Series('UTC', index=store_ids)
+    business_hours = pd.DataFrame([
+        ('overnight', 0, time(20), time(2)),
+        ('split', 0, time(8), time(12)),
+        ('split', 0, time(14), time(22)),
+    ], columns=['store_id', 'day_of_week', 'start_time_local', 'end_time_local'])
+    polls = [
+        (0, '2023-01-16 21:00', True), (0, '2023-01-17 01:59', True), (0, '2023-01-17 02:01', False),
+        (1, '2023-01-16 12:00', True), (1, '2023-01-16 13:00', False), (1, '2023-01-16 14:00', True),
+        (2, '2023-01-16 23:59:59', True),
+    ]
+    codes = np.array([code for code, _, _ in polls])
+    ts_us = np.array([timestamp_to_us(text) for _, text, _ in polls])
+
+    invalidate_schedules(store_ids)
+    index = build_schedule_index(store_ids, store_tz, business_hours, int(ts_us.min()), int(ts_us.max()))
+    assert index.contains(codes, ts_us).tolist() == [expected for _, _, expected in polls]
@@ -0,0 +1,53 @@
+import os
+
+import pandas as pd
+
+from app.snapshot import SNAPSHOT_ATTEMPTS, SnapshotStore
+from conftest import make_frames
+
+
+class MovingStorage:
+    """A storage backend whose data version moves during its first moves fetches."""
+
+    def __init__(self, moves):
+        self.moves = moves
+        self.version = 0
+        self.fetches = 0
+
+    def data_version(self):
+        return str(self.version)
+
+    def fetch_data(self):
+        self.fetches += 1
+        if self.moves:
+            self.moves -= 1
+            self.version += 1
+        return make_frames(n_stores=5, weeks=1)
+
+
+def test_snapshot_is_saved_under_the_version_it_was_fetched_at(tmp_path):
+    storage = MovingStorage(moves=1)
+    store = SnapshotStore(str(tmp_path), storage)
+
+    store_status, _, _ = store.load()
+
+    assert storage.fetches == 2
+    assert sorted(os.listdir(tmp_path)) == ['.lock', os.path.basename(store._path('1'))]
+    expected = make_frames(n_stores=5, weeks=1)[0]
+    assert list(store_status['store_id']) == list(expected['store_id'])
+    assert (store_status['timestamp_utc'] == expected['timestamp_utc']).all()
+    assert list(store_status['status']) == list(expected['status'])
+    # Mapped from the snapshot from now on
+    store.load()
+    assert storage.fetches == 2
+
+
+def test_a_moving_version_falls_back_to_an_unsaved_fetch(tmp_path):
+    storage = MovingStorage(moves=SNAPSHOT_ATTEMPTS)
+    store = SnapshotStore(str(tmp_path), storage)
+
+    store_status, _, _ = store.load()
+
+    assert storage.fetches == SNAPSHOT_ATTEMPTS
+    assert sorted(os.listdir(tmp_path)) == ['.lock']
+    pd.testing.assert_frame_equal(store_status, make_frames(n_stores=5, weeks=1)[0])
@@ -0,0 +1,28 @@
+import pandas as pd
+
+from app.storage import MySQLBackend
+from app.store_uptime import StoreUptimeCache
+
+
+def test_a_late_poll_only_reloads_its_store(database_copy):
+    storage = MySQLBackend()
+    latest = pd.Timestamp(storage.latest_timestamp(), tz='UTC')
+    window = storage.fetch_status(latest - pd.Timedelta(hours=1), latest)
+    late_store, other_store = sorted(window['store_id'].astype(str).unique())[:2]
+    cache = StoreUptimeCache()
+
+    _, rows, unknown = cache.get([late_store, other_store, 'no-such-store'], storage)
+    assert unknown == ['no-such-store']
+    entries = dict(cache._entries)
+
+    # Older than the newest poll, so only the store's generation tells it apart
+    storage.insert_status(pd.DataFrame({
+        'store_id': [late_store],
+        'timestamp_utc': [latest - pd.Timedelta(minutes=1, microseconds=1)],
+        'status': ['inactive'],
+    }))
+    _, reloaded, _ = cache.get([late_store, other_store], storage)
+
+    assert cache._entries[late_store] is not entries[late_store]
+    assert cache._entries[other_store] is entries[other_store]
+    assert reloaded[other_store] == rows[other_store]
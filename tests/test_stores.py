@@ -0,0 +1,78 @@
+import os
+import threading
+
+import pytest
+
+from app.cache import ReportCache
+from app.job_store import SQLiteJobStore
+from app.report_store import ReportStore
+
+
+def test_stores_share_one_database_file(tmp_path):
+    path = str(tmp_path / 'index' / 'jobs.sqlite3')
+    jobs = SQLiteJobStore(path)
+    store = ReportStore(path=path, directory=str(tmp_path / 'reports'))
+    cache = ReportCache(store, path=path)
+
+    csv_path = tmp_path / 'reports' / 'report_new.partial.csv'
+    csv_path.write_text('store_id,uptime_last_hour\na,1.0\n')
+    file_path = store.add(str(csv_path))
+    jobs.create('report-1', status='Complete', file_path=file_path)
+    cache.put('version-1', file_path)
+
+    assert jobs.get('report-1')['file_path'] == file_path
+    assert cache.get('version-1') == file_path
+    assert store.stats()['files'] == 1
+
+
+def test_concurrent_job_updates_are_not_lost(tmp_path):
+    jobs = SQLiteJobStore(str(tmp_path / 'jobs.sqlite3'))
+    jobs.create('report-1', status='Running')
+
+    def update(i):
+        for j in range(20):
+            jobs.update('report-1', **{f'field_{i}_{j}': j})
+
+    threads = [threading.Thread(target=update, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(jobs.get('report-1')) == 1 + 4 * 20
+
+
+def test_store_codes_committed_out_of_order(database_copy):
+    from app.db import get_connection
+    from app.stores import StoreDictionary
+
+    dictionary = StoreDictionary()
+    with get_connection() as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT MAX(store_code) FROM stores")
+        top = cursor.fetchone()[0]
+        # The higher code commits and is read first
+        cursor.execute("INSERT INTO stores (store_code, store_id) VALUES (%s, %s)", (top + 2, 'late-high'))
+        db.commit()
+        high = dictionary.positions(db, [top + 2])[0]
+        cursor.execute("INSERT INTO stores (store_code, store_id) VALUES (%s, %s)", (top + 1, 'late-low'))
+        db.commit()
+        low = dictionary.positions(db, [top + 1])[0]
+        cursor.close()
+
+        categories = dictionary.categories()
+        assert (categories[high], categories[low]) == ('late-high', 'late-low')
+        with pytest.raises(RuntimeError):
+            dictionary.positions(db, [top + 3])
+
+
+def test_adopt_removes_stale_temporary_directories(tmp_path):
+    directory = tmp_path / 'reports'
+    stale = directory / 'report_abc.columns.tmp'
+    stale.mkdir(parents=True)
+    (stale / '0.npy').write_bytes(b'')
+    os.utime(stale, (0, 0))
+
+    store = ReportStore(path=str(tmp_path / 'jobs.sqlite3'), directory=str(directory))
+    store.adopt()
+
+    assert not stale.exists()